@@ -11,6 +11,7 @@
 
     let document;
     let strsData, mods, tagIds;
+    let shardsData = null, numPendingShards = 0;
     let domPathInput, domFuzzyMatch;
     let domTBody;
     let domPlaceholder = null;
@@ -213,10 +214,45 @@
         mods = createModulesFromData(stringsData, modulesData);
         tagIds = createTagIdsFromData(stringsData, mods);
 
-        document.addEventListener('DOMContentLoaded', function (evt) {
+        function createDom() {
             createControlDom(document.body);
             createTableDom(document.body);
-        });
+        }
+
+        if (document.readyState == 'loading') {
+            document.addEventListener('DOMContentLoaded', createDom);
+        } else {
+            createDom();
+        }
+    }
+
+    function initShards(doc, stringsData, shardPaths) {
+        // Load the shards in order.  Each shard calls addModules().
+        document = doc;
+        strsData = stringsData;
+        shardsData = [];
+        numPendingShards = shardPaths.length;
+
+        if (numPendingShards == 0) {
+            init(doc, stringsData, []);
+            return;
+        }
+
+        for (let path of shardPaths) {
+            let domScript = doc.createElement('script');
+            domScript.src = path;
+            domScript.async = false;
+            doc.head.appendChild(domScript);
+        }
+    }
+
+    function addModules(modulesData) {
+        shardsData.push(modulesData);
+        if (--numPendingShards == 0) {
+            let allModulesData = [].concat.apply([], shardsData);
+            shardsData = null;
+            init(document, strsData, allModulesData);
+        }
     }
 
     //--------------------------------------------------------------------------
@@ -505,5 +541,7 @@
 
     return {
         'init': init,
+        'initShards': initShards,
+        'addModules': addModules,
     };
 }));
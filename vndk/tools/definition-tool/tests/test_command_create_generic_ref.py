@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import argparse
+import os
+import unittest
+
+from vndk_definition_tool import (
+    CreateGenericRefCommand, ELF, GenericRefs)
+
+from .compat import StringIO, TemporaryDirectory, patch
+
+
+class CreateGenericRefCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'system')
+        self.elfs = dict()
+        for i in range(10):
+            lib_dir = 'lib' if i % 2 else 'lib64'
+            name = os.path.join(lib_dir, 'libfoo{}.so'.format(i))
+            self.elfs[name] = ELF(
+                ELF.ELFCLASS32 if i % 2 else ELF.ELFCLASS64,
+                ELF.ELFDATA2LSB,
+                exported_symbols={'foo{}'.format(i), 'bar'})
+        self.scan_args = []
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def _fake_scan_elf_files(self, root, jobs=1, elf_cache=None):
+        self.scan_args.append((root, jobs, elf_cache))
+        for name in sorted(self.elfs):
+            yield (os.path.join(root, name), self.elfs[name])
+
+
+    def _run(self, *argv):
+        cmd = CreateGenericRefCommand()
+        cmd._WRITE_BATCH_SIZE = 3  # pylint: disable=protected-access
+        parser = argparse.ArgumentParser()
+        cmd.add_argparser_options(parser)
+        args = parser.parse_args([self.root] + list(argv))
+
+        stdout = StringIO()
+        stderr = StringIO()
+        with patch('vndk_definition_tool.scan_elf_files',
+                   self._fake_scan_elf_files), \
+                patch('sys.stdout', stdout), \
+                patch('sys.stderr', stderr):
+            self.assertEqual(0, cmd.main(args))
+        return stderr.getvalue()
+
+
+    def _check_refs(self, refs):
+        self.assertEqual(
+            sorted('/' + name for name in self.elfs), sorted(refs.refs))
+        for name, elf in self.elfs.items():
+            self.assertEqual(elf.exported_symbols,
+                             refs.refs['/' + name].exported_symbols)
+
+
+    def test_sym_dir(self):
+        out_dir = os.path.join(self.tmp_dir.name, 'out')
+        stderr = self._run('-o', out_dir, '-j', '4')
+
+        self.assertEqual([(self.root, 4, None)], self.scan_args)
+        self.assertEqual(1, len(stderr.splitlines()))
+        self.assertIn('10 ELF files', stderr)
+        self._check_refs(GenericRefs.create_from_sym_dir(out_dir))
+
+
+    def test_packed(self):
+        out_file = os.path.join(self.tmp_dir.name, 'out.packed')
+        self._run('-o', out_file, '--packed')
+
+        self.assertEqual([(self.root, 1, None)], self.scan_args)
+        self._check_refs(GenericRefs.create_from_packed_file(out_file))
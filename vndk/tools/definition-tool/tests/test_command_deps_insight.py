@@ -105,3 +105,31 @@ class DepsInsightCommandTest(unittest.TestCase):
         self.assertFalse(deps)
         users = self._get_module_users(strs, mods, libvendor_bad.path)
         self.assertIn(libvndk.path, users)
+
+
+    def test_serialize_data_deps_layers(self):
+        gb = GraphBuilder()
+
+        liba = gb.add_lib32(PT_SYSTEM, 'liba', dt_needed=['libb.so'])
+        libb = gb.add_lib32(PT_SYSTEM, 'libb', dt_needed=['libc.so'])
+        libc = gb.add_lib32(PT_SYSTEM, 'libc',
+                            dt_needed=['libb.so', 'libd.so'])
+        libd = gb.add_lib32(PT_SYSTEM, 'libd')
+
+        gb.resolve()
+        libc.add_dlopen_dep(libd)
+
+        with patch('sys.stderr', StringIO()):
+            vndk_sets = gb.graph.compute_degenerated_vndk(set(), None)
+
+        strs, mods = DepsInsightCommand.serialize_data(
+            list(gb.graph.all_libs()), vndk_sets, ModuleInfo())
+
+        def get_deps(lib):
+            return self._get_module(strs, mods, lib.path)[self._DEPS_FIELD]
+
+        # The libs are sorted by paths: liba, libb, libc, and libd.
+        self.assertEqual([[1], [2], [3]], get_deps(liba))
+        self.assertEqual([[2], [3]], get_deps(libb))
+        self.assertEqual([[1, 3, 3]], get_deps(libc))
+        self.assertEqual([], get_deps(libd))
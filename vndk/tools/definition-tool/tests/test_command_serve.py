@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+
+from vndk_definition_tool import (
+    GraphQueryServer, PT_SYSTEM, PT_VENDOR, TaggedPathDict)
+
+from .compat import StringIO, TemporaryDirectory
+from .utils import GraphBuilder
+
+
+class GraphQueryServerTest(unittest.TestCase):
+    def setUp(self):
+        gb = GraphBuilder()
+        self.libc = gb.add_lib32(
+            PT_SYSTEM, 'libc', exported_symbols={'malloc', 'free'})
+        self.libfoo = gb.add_lib32(
+            PT_SYSTEM, 'libfoo', dt_needed=['libc.so', 'libmissing.so'],
+            imported_symbols={'malloc', 'free', 'missing'})
+        self.libbar = gb.add_lib32(
+            PT_VENDOR, 'libbar', dt_needed=['libfoo.so'])
+        gb.resolve()
+
+        tagged_paths = TaggedPathDict()
+        tagged_paths.add('ll_ndk', self.libc.path)
+
+        self.server = GraphQueryServer(gb.graph, tagged_paths)
+
+
+    def _query(self, **request):
+        return self.server.handle_request(dict(request, id=1))
+
+
+    def test_libs(self):
+        self.assertEqual(
+            {'id': 1, 'result': [self.libc.path, self.libfoo.path]},
+            self._query(query='libs', path_filter='/system/'))
+
+
+    def test_deps_and_users(self):
+        self.assertEqual(
+            [self.libc.path],
+            self._query(query='deps', lib=self.libfoo.path)['result'])
+        self.assertEqual(
+            [],
+            self._query(query='deps', lib=self.libfoo.path,
+                        kind='dlopen')['result'])
+        self.assertEqual(
+            [self.libbar.path],
+            self._query(query='users', lib=self.libfoo.path,
+                        kind='needed')['result'])
+
+
+    def test_closure(self):
+        self.assertEqual(
+            [self.libc.path, self.libfoo.path],
+            self._query(query='closure', libs=[self.libfoo.path])['result'])
+        self.assertEqual(
+            [self.libfoo.path],
+            self._query(query='closure', libs=[self.libfoo.path],
+                        exclude_libs=[self.libc.path])['result'])
+        self.assertEqual(
+            [self.libc.path, self.libfoo.path, self.libbar.path],
+            self._query(query='closure', libs=[self.libc.path],
+                        revert=True)['result'])
+
+
+    def test_unresolved(self):
+        self.assertEqual(
+            {'dt_needed': ['libmissing.so'], 'symbols': ['missing']},
+            self._query(query='unresolved', lib=self.libfoo.path)['result'])
+
+
+    def test_tag(self):
+        self.assertEqual(
+            'll_ndk', self._query(query='tag', lib=self.libc.path)['result'])
+        self.assertEqual(
+            'fwk_only',
+            self._query(query='tag', lib=self.libfoo.path)['result'])
+
+
+    def test_symbols(self):
+        self.assertEqual(
+            {self.libc.path: ['free', 'malloc']},
+            self._query(query='symbols', lib=self.libfoo.path)['result'])
+        self.assertEqual(
+            ['free', 'malloc'],
+            self._query(query='symbols', lib=self.libfoo.path,
+                        dep=self.libc.path)['result'])
+
+
+    def test_errors(self):
+        self.assertEqual(
+            {'id': 1, 'error': 'no such lib: /system/lib/libx.so'},
+            self._query(query='deps', lib='/system/lib/libx.so'))
+        self.assertEqual(
+            {'id': 1, 'error': 'missing field: lib'},
+            self._query(query='deps'))
+        self.assertEqual(
+            {'id': 1, 'error': 'unknown kind: x'},
+            self._query(query='deps', lib=self.libfoo.path, kind='x'))
+        self.assertEqual(
+            {'id': 1, 'error': 'unknown query: x'},
+            self._query(query='x'))
+
+        response = json.loads(self.server.handle_line('{'))
+        self.assertIsNone(response['id'])
+        self.assertIn('bad request', response['error'])
+
+        response = json.loads(self.server.handle_line(b'{"id": "\xff"}'))
+        self.assertIsNone(response['id'])
+        self.assertIn('bad request', response['error'])
+
+
+    def test_serve(self):
+        input_file = StringIO(
+            '{"id": 1, "query": "deps", "lib": "/system/lib/libfoo.so"}\n'
+            '\n'
+            '{"id": 2, "query": "shutdown"}\n'
+            '{"id": 3, "query": "libs"}\n')
+        output_file = StringIO()
+        self.server.serve(input_file, output_file)
+
+        self.assertEqual(
+            [{'id': 1, 'result': ['/system/lib/libc.so']},
+             {'id': 2, 'result': None}],
+            [json.loads(line) for line in output_file.getvalue().splitlines()])
+
+
+    def test_serve_unix_socket(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('UNIX socket not available')
+
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'serve.sock')
+            thread = threading.Thread(target=self.server.serve_unix_socket,
+                                      args=(path,))
+            thread.daemon = True
+            thread.start()
+            try:
+                for _ in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.01)
+
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(path)
+                sock.sendall(b'{"id": 1, "query": "tag", '
+                             b'"lib": "/system/lib/libc.so"}\n'
+                             b'{"id": "\xff\xfe"}\n'
+                             b'{"id": 2, "query": "shutdown"}\n')
+                output_file = sock.makefile('r')
+                lines = [output_file.readline() for _ in range(3)]
+                output_file.close()
+                sock.close()
+            finally:
+                thread.join(10)
+
+            self.assertFalse(thread.is_alive())
+            self.assertEqual({'id': 1, 'result': 'll_ndk'},
+                             json.loads(lines[0]))
+            self.assertIn('bad request', json.loads(lines[1])['error'])
+            self.assertEqual({'id': 2, 'result': None}, json.loads(lines[2]))
+            self.assertFalse(os.path.exists(path))
+
+
+    def test_serve_unix_socket_bind_error(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('UNIX socket not available')
+
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'serve.sock')
+            with open(path, 'w') as f:
+                f.write('keep')
+            with self.assertRaises(socket.error):
+                self.server.serve_unix_socket(path)
+            self.assertTrue(os.path.exists(path))
@@ -3,13 +3,17 @@
 from __future__ import print_function
 
 import os
+import struct
 import subprocess
 import unittest
 import zipfile
 
-from vndk_definition_tool import DexFileReader, UnicodeSurrogateDecodeError
+import vndk_definition_tool
+from vndk_definition_tool import (
+    DexFileReader, PT_SYSTEM, UnicodeSurrogateDecodeError, scan_apk_dep)
 
-from .compat import TemporaryDirectory
+from .compat import TemporaryDirectory, makedirs, patch
+from .utils import GraphBuilder
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_DIR = os.path.join(SCRIPT_DIR, 'testdata', 'test_dex_file')
@@ -120,3 +124,156 @@ class DexFileTest(unittest.TestCase):
             self.assertIn(b'world', strs)
             self.assertIn(b'foo', strs)
             self.assertIn(b'bar', strs)
+
+
+def _create_dex_buf(strings):
+    """Create a minimal dex file which only has a header and a string table."""
+    header_size = 0x70
+    string_ids_off = header_size
+    string_data_off = string_ids_off + 4 * len(strings)
+
+    string_ids = []
+    string_data = []
+    for string in strings:
+        string_ids.append(string_data_off)
+        length = DexFileReader.get_mutf8_utf16_length(string)
+        uleb128 = bytearray()
+        while length >= 0x80:
+            uleb128.append(0x80 | (length & 0x7f))
+            length >>= 7
+        uleb128.append(length)
+        string_data.append(bytes(uleb128) + string + b'\0')
+        string_data_off += len(string_data[-1])
+
+    file_size = string_data_off
+    header = struct.pack('<4s4sI20sIIIIIIII', b'dex\n', b'035\0', 0,
+                         b'\0' * 20, file_size, header_size, 0x12345678, 0, 0,
+                         0, len(strings), string_ids_off)
+    header += b'\0' * (header_size - len(header))
+    return (header + struct.pack('<{}I'.format(len(strings)), *string_ids) +
+            b''.join(string_data))
+
+
+class DexFileFindStringsTest(unittest.TestCase):
+    STRINGS = [b'hello', b'loadLibrary', b'libfoo', b'foo', b'x' * 200,
+               u'\u00e9t\u00e9'.encode('mutf-8')]
+
+
+    def test_get_mutf8_utf16_length(self):
+        get_length = DexFileReader.get_mutf8_utf16_length
+        self.assertEqual(3, get_length(b'foo'))
+        self.assertEqual(3, get_length(u'\u00e9t\u00e9'.encode('mutf-8')))
+        self.assertEqual(2, get_length(u'\U00010400'.encode('mutf-8')))
+
+
+    def test_find_dex_strings_buf(self):
+        buf = _create_dex_buf(self.STRINGS)
+
+        self.assertEqual(self.STRINGS,
+                         list(DexFileReader.enumerate_dex_strings_buf(buf)))
+
+        # The string_ids table is loaded in chunks.
+        chunk_size = DexFileReader._STRING_IDS_CHUNK_SIZE
+        DexFileReader._STRING_IDS_CHUNK_SIZE = 4
+        try:
+            self.assertEqual(
+                self.STRINGS,
+                list(DexFileReader.enumerate_dex_strings_buf(buf)))
+        finally:
+            DexFileReader._STRING_IDS_CHUNK_SIZE = chunk_size
+
+        strings = {b'foo', b'loadLibrary', b'x' * 200, b'bar',
+                   u'\u00e9t\u00e9'.encode('mutf-8')}
+        lengths = set(DexFileReader.get_mutf8_utf16_length(string)
+                      for string in strings)
+        self.assertEqual(
+            {b'foo', b'loadLibrary', b'x' * 200,
+             u'\u00e9t\u00e9'.encode('mutf-8')},
+            set(DexFileReader.find_dex_strings_buf(buf, strings, lengths)))
+
+
+    def test_find_dex_strings_apk(self):
+        with TemporaryDirectory() as tmp_dir:
+            apk_path = os.path.join(tmp_dir, 'example.apk')
+            with zipfile.ZipFile(apk_path, 'w') as zip_file:
+                # STORED members are mapped from the archive.
+                zip_file.writestr('classes.dex', _create_dex_buf([b'libfoo']),
+                                  zipfile.ZIP_STORED)
+                zip_file.writestr('classes2.dex',
+                                  _create_dex_buf([b'loadLibrary', b'bar']),
+                                  zipfile.ZIP_DEFLATED)
+
+            self.assertEqual(
+                [b'libfoo', b'loadLibrary', b'bar'],
+                list(DexFileReader.enumerate_dex_strings_apk(apk_path)))
+
+            self.assertEqual(
+                {b'libfoo', b'loadLibrary'},
+                DexFileReader.find_dex_strings(
+                    apk_path, {b'libfoo', b'loadLibrary'}, b'loadLibrary'))
+
+            # The dex files are not parsed if the required string is absent.
+            self.assertEqual(
+                set(),
+                DexFileReader.find_dex_strings(
+                    apk_path, {b'libfoo'}, b'System.loadLibrary'))
+
+
+    def test_find_dex_strings_vdex(self):
+        dex_buf = _create_dex_buf([b'libfoo', b'loadLibrary'])
+        vdex_buf = (struct.pack('<4s4s4sII', b'vdex', b'019\0', b'002\0', 1,
+                                0) +
+                    struct.pack('<I', 0) +  # checksum
+                    struct.pack('<III', len(dex_buf), 0, 0) +
+                    struct.pack('<I', 0) +  # quickening_table_off
+                    dex_buf)
+
+        with TemporaryDirectory() as tmp_dir:
+            vdex_path = os.path.join(tmp_dir, 'example.vdex')
+            with open(vdex_path, 'wb') as vdex_file:
+                vdex_file.write(vdex_buf)
+
+            self.assertEqual(
+                {b'libfoo'},
+                DexFileReader.find_dex_strings(vdex_path, {b'libfoo', b'bar'}))
+            self.assertEqual(
+                set(DexFileReader.enumerate_dex_strings_vdex(vdex_path)),
+                {b'libfoo', b'loadLibrary'})
+
+            txt_path = os.path.join(tmp_dir, 'example.txt')
+            with open(txt_path, 'wb') as txt_file:
+                txt_file.write(b'loadLibrary')
+            self.assertIsNone(
+                DexFileReader.find_dex_strings(txt_path, {b'libfoo'}))
+
+
+class ScanApkDepTest(unittest.TestCase):
+    def test_scan_apk_dep_without_fork(self):
+        gb = GraphBuilder()
+        gb.add_lib64(PT_SYSTEM, 'libfoojni', exported_symbols={'JNI_OnLoad'})
+        gb.resolve()
+
+        parallel_imap = vndk_definition_tool.parallel_imap
+        jobs_list = []
+        def check_parallel_imap(func, iterable, jobs=1, chunksize=16,
+                                context=None):
+            jobs_list.append(jobs)
+            return parallel_imap(func, iterable, jobs, chunksize, context)
+
+        with TemporaryDirectory() as tmp_dir:
+            app_dir = os.path.join(tmp_dir, 'app', 'Foo')
+            makedirs(app_dir, exist_ok=True)
+            with zipfile.ZipFile(os.path.join(app_dir, 'Foo.apk'), 'w') as zf:
+                zf.writestr('classes.dex', _create_dex_buf(
+                    [b'libfoojni.so', b'loadLibrary']))
+
+            # The workers can only find the strings if they are forked.
+            with patch('vndk_definition_tool.get_fork_context', lambda: None), \
+                    patch('vndk_definition_tool.parallel_imap',
+                          check_parallel_imap):
+                result = scan_apk_dep(gb.graph, [tmp_dir], [], jobs=2)
+
+        self.assertEqual([1], jobs_list)
+        self.assertEqual(
+            [('/system/app/Foo/Foo.apk', ['/system/lib64/libfoojni.so'])],
+            result)
@@ -2,12 +2,15 @@
 
 from __future__ import print_function
 
+import pickle
+import struct
+import sys
 import tempfile
 import unittest
 
-from vndk_definition_tool import Elf_Sym, ELF
+from vndk_definition_tool import Elf_Sym, ELF, ELFError, SymbolSet
 
-from .compat import StringIO
+from .compat import StringIO, patch
 
 
 class ElfSymTest(unittest.TestCase):
@@ -41,6 +44,37 @@ class ElfSymTest(unittest.TestCase):
         self.assertTrue(self.sym_undef.is_undef)
 
 
+class SymbolSetTest(unittest.TestCase):
+    def test_set_operations(self):
+        s = SymbolSet({'foo', 'bar', 'baz'})
+        self.assertEqual(3, len(s))
+        self.assertIn('foo', s)
+        self.assertNotIn('qux', s)
+        self.assertNotIn('__symbol_set_test_never_seen__', s)
+        self.assertEqual({'foo', 'bar', 'baz'}, set(s))
+        self.assertEqual({'foo', 'bar', 'baz'}, s)
+        self.assertEqual(s, {'foo', 'bar', 'baz'})
+        self.assertEqual({'bar'}, s & {'bar', 'qux'})
+        self.assertEqual({'foo', 'baz'}, s.difference({'bar'}))
+
+
+    def test_compare(self):
+        s = SymbolSet({'foo', 'bar'})
+        self.assertEqual(SymbolSet({'bar', 'foo'}), s)
+        self.assertNotEqual(SymbolSet({'foo'}), s)
+        self.assertTrue(SymbolSet({'foo', 'bar', 'baz'}) > s)
+        self.assertFalse(SymbolSet({'foo', 'baz'}) > s)
+        self.assertFalse(s > s)
+        self.assertTrue(s >= s)
+        self.assertTrue(SymbolSet({'foo'}) < s)
+        self.assertTrue(SymbolSet({'foo', 'bar', 'baz'}) > {'foo', 'bar'})
+
+
+    def test_pickle(self):
+        s = SymbolSet({'foo', 'bar'})
+        self.assertEqual(s, pickle.loads(pickle.dumps(s, 2)))
+
+
 class ELFTest(unittest.TestCase):
     def test_get_ei_class_from_name(self):
         self.assertEqual(ELF.ELFCLASS32, ELF.get_ei_class_from_name('32'))
@@ -190,6 +224,67 @@ class ELFTest(unittest.TestCase):
             check_parse_dump_file_result(ELF.load_dump(f.name))
 
 
+class ELFLazySymbolsTest(unittest.TestCase):
+    def _load_executable(self, lazy_symbols):
+        try:
+            return ELF.load(sys.executable, lazy_symbols)
+        except (ELFError, IOError, OSError):
+            self.skipTest('cannot parse ' + sys.executable)
+
+
+    def test_lazy_symbols(self):
+        elf = self._load_executable(lazy_symbols=False)
+        lazy_elf = self._load_executable(lazy_symbols=True)
+        if not elf.imported_symbols and not elf.exported_symbols:
+            self.skipTest('no symbols in ' + sys.executable)
+
+        self.assertTrue(lazy_elf.has_lazy_symbols)
+        self.assertEqual(elf.dt_needed, lazy_elf.dt_needed)
+        self.assertEqual(elf.imported_symbols, lazy_elf.imported_symbols)
+        self.assertFalse(lazy_elf.has_lazy_symbols)
+        self.assertEqual(elf.exported_symbols, lazy_elf.exported_symbols)
+
+
+    def test_bulk_and_per_entry_dynsym(self):
+        elf = self._load_executable(lazy_symbols=False)
+        with patch('vndk_definition_tool._struct_iter_unpack', None):
+            per_entry_elf = self._load_executable(lazy_symbols=False)
+        self.assertEqual(per_entry_elf, elf)
+
+
+    def test_pickle_lazy_symbols(self):
+        elf = self._load_executable(lazy_symbols=True)
+        lazy_elf = pickle.loads(pickle.dumps(elf, 2))
+        self.assertTrue(lazy_elf.has_lazy_symbols)
+        self.assertEqual(elf, lazy_elf)
+
+
+class ELFDynsymTest(unittest.TestCase):
+    def test_bad_st_name(self):
+        if sys.version_info < (3, 0):
+            self.skipTest('bulk .dynsym parser requires Python 3')
+
+        # The last name in .dynstr is not terminated, and the other st_name
+        # values point beyond .dynstr and beyond the buffer.
+        dynstr = b'\0foo\0bar'
+        buf = dynstr + b'baz\0'
+        dynsym_off = len(buf)
+        st_info = Elf_Sym.STB_GLOBAL << 4
+        for st_name, st_shndx in ((1, 1), (5, 0), (9, 1), (1000, 1)):
+            buf += struct.pack('<LBBHQQ', st_name, st_info, 0, st_shndx, 0, 0)
+
+        elf = ELF(ELF.ELFCLASS64, ELF.ELFDATA2LSB)
+        fmt = elf._get_elf_sym_name_info_shndx_fmt()
+        exp_symbols, imp_symbols = elf._parse_dynsym_bulk(
+            buf, fmt, dynsym_off, len(buf), 24, 0, len(dynstr))
+        self.assertEqual(['foo', 'az', ''], exp_symbols)
+        self.assertEqual(['barbaz'], imp_symbols)
+
+        self.assertEqual(
+            (set(exp_symbols), set(imp_symbols)),
+            elf._parse_dynsym_per_entry(buf, dynsym_off, len(buf), 24, 0))
+
+
 class ELFJniLibTest(unittest.TestCase):
     def test_lib_deps(self):
         elf = ELF(dt_needed=['libnativehelper.so'])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import os
+import sys
+import unittest
+
+from vndk_definition_tool import ELF, ELFCache, ELFError
+
+from .compat import TemporaryDirectory
+
+
+class ELFCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cache = ELFCache(os.path.join(self.tmp_dir.name, 'cache'))
+        self.path = os.path.join(self.tmp_dir.name, 'libfoo.so')
+        with open(self.path, 'wb') as f:
+            f.write(b'placeholder')
+        self.elf = ELF(ELF.ELFCLASS64, ELF.ELFDATA2LSB, ELF.EM_AARCH64,
+                       dt_needed=['libc.so'], exported_symbols={'foo'},
+                       imported_symbols={'printf'}, file_size=11)
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_store_and_load(self):
+        key = self.cache.get_key(self.path, True)
+        self.assertIsNone(self.cache.load(key))
+
+        self.cache.store(key, [(self.path, self.elf)])
+        result = self.cache.load(self.cache.get_key(self.path, True))
+        self.assertEqual([(self.path, self.elf)], result)
+
+        # The entries for unzip_files=True and unzip_files=False are different.
+        self.assertIsNone(self.cache.load(self.cache.get_key(self.path, False)))
+
+
+    def test_invalidate_on_change(self):
+        self.cache.store(self.cache.get_key(self.path, True),
+                         [(self.path, self.elf)])
+
+        with open(self.path, 'ab') as f:
+            f.write(b'changed')
+
+        self.assertIsNone(self.cache.load(self.cache.get_key(self.path, True)))
+
+
+    def test_invalidate_on_format_version(self):
+        key = self.cache.get_key(self.path, True)
+        self.cache.store(key, [(self.path, self.elf)])
+
+        key = (ELFCache.FORMAT_VERSION + 1,) + key[1:]
+        self.assertIsNone(self.cache.load(key))
+
+
+    def test_load_corrupted_entry(self):
+        key = self.cache.get_key(self.path, True)
+        self.cache.store(key, [(self.path, self.elf)])
+        entry_path = self.cache._get_entry_path(self.path, True)
+
+        # AttributeError, ImportError, and TypeError from unpickling.
+        for data in (b'cvndk_definition_tool\nNoSuchClass\n.',
+                     b'cno_such_module\nFoo\n.', b'K\x01.'):
+            with open(entry_path, 'wb') as f:
+                f.write(data)
+            self.assertIsNone(self.cache.load(key))
+
+
+    def test_store_lazy_symbols(self):
+        try:
+            elf = ELF.load(sys.executable, lazy_symbols=True)
+        except (ELFError, IOError, OSError):
+            self.skipTest('cannot parse ' + sys.executable)
+
+        key = self.cache.get_key(sys.executable, False)
+        self.cache.store(key, [(sys.executable, elf)])
+
+        result = self.cache.load(key)
+        self.assertFalse(result[0][1].has_lazy_symbols)
+        self.assertEqual(ELF.load(sys.executable), result[0][1])
@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
 
+import os
+import pickle
 import re
+import struct
 import tempfile
 
 from vndk_definition_tool import (
-    ELF, ELFLinker, GenericRefs, PT_SYSTEM, PT_VENDOR, VNDKLibDir)
+    ELF, ELFLinker, ELFLinkerState, GenericRefs, PT_SYSTEM, PT_VENDOR,
+    VNDKLibDir, get_fork_context)
 
-from .compat import StringIO, TestCase, patch
+from .compat import StringIO, TemporaryDirectory, TestCase, patch
 from .utils import GraphBuilder
 
 
 class ELFLinkerTest(TestCase):
-    def _create_normal_graph(self):
+    def _create_normal_graph(self, jobs=1):
         gb = GraphBuilder()
 
         gb.add_multilib(PT_SYSTEM, 'libdl',
@@ -37,7 +41,7 @@ class ELFLinkerTest(TestCase):
                         exported_symbols={'eglGetDisplay'},
                         imported_symbols={'fclose', 'fopen'})
 
-        gb.resolve()
+        gb.resolve(jobs=jobs)
         return gb
 
 
@@ -154,6 +158,168 @@ class ELFLinkerTest(TestCase):
             self.assertIs(libc, libEGL.linked_symbols['fopen'])
 
 
+    def test_linked_symbols_dt_needed_order(self):
+        gb = GraphBuilder()
+        gb.add_lib64(PT_SYSTEM, 'liba', exported_symbols={'foo', 'bar'})
+        gb.add_lib64(PT_SYSTEM, 'libb', exported_symbols={'foo', 'baz'})
+        gb.add_lib64(PT_SYSTEM, 'libc', exported_symbols={'foo', 'baz'})
+        gb.add_lib64(PT_SYSTEM, 'libd', exported_symbols={'foo', 'qux'})
+        gb.add_lib64(PT_SYSTEM, 'libuser1',
+                     dt_needed=['libc.so', 'libb.so', 'liba.so'],
+                     imported_symbols={'foo', 'bar', 'baz', 'qux'})
+        gb.add_lib64(PT_SYSTEM, 'libuser2', dt_needed=['libd.so', 'libb.so'],
+                     imported_symbols={'foo', 'bar', 'baz', 'qux'})
+        gb.resolve()
+
+        # The symbols should be resolved to the first DT_NEEDED library that
+        # exports the symbol.
+        self.assertIs(gb.libc_64, gb.libuser1_64.linked_symbols['foo'])
+        self.assertIs(gb.liba_64, gb.libuser1_64.linked_symbols['bar'])
+        self.assertIs(gb.libc_64, gb.libuser1_64.linked_symbols['baz'])
+        self.assertEqual({'qux'}, gb.libuser1_64.unresolved_symbols)
+
+        self.assertIs(gb.libd_64, gb.libuser2_64.linked_symbols['foo'])
+        self.assertIs(gb.libb_64, gb.libuser2_64.linked_symbols['baz'])
+        self.assertIs(gb.libd_64, gb.libuser2_64.linked_symbols['qux'])
+        self.assertEqual({'bar'}, gb.libuser2_64.unresolved_symbols)
+
+
+    def test_resolve_deps_without_symbols(self):
+        gb = GraphBuilder()
+        gb.add_lib64(PT_SYSTEM, 'liba', exported_symbols={'foo'})
+        gb.add_lib64(PT_SYSTEM, 'libuser', dt_needed=['liba.so'],
+                     imported_symbols={'foo', 'bar'})
+        gb.graph.resolve_deps(resolve_symbols=False)
+
+        self.assertIn(gb.liba_64, gb.libuser_64.deps_all)
+        self.assertEqual({}, gb.libuser_64.linked_symbols)
+        self.assertEqual(set(), gb.libuser_64.unresolved_symbols)
+
+
+    def test_resolve_deps_in_workers(self):
+        if get_fork_context() is None:
+            self.skipTest('cannot fork worker processes')
+
+        def get_results(gb):
+            return dict(
+                (lib.path, (self._get_paths_from_nodes(lib.deps_all),
+                            self._get_paths_from_nodes(lib.users_all),
+                            sorted(lib.unresolved_symbols),
+                            dict((symbol, dep.path) for symbol, dep in
+                                 lib.linked_symbols.items())))
+                for lib in gb.graph.all_libs())
+
+        self.assertEqual(get_results(self._create_normal_graph()),
+                         get_results(self._create_normal_graph(jobs=2)))
+
+
+    def test_compute_closure(self):
+        gb = self._create_normal_graph()
+        graph = gb.graph
+
+        def is_excluded(lib):
+            return lib.path.endswith('/libm.so')
+
+        closure = graph.compute_deps_closure({gb.libEGL_64}, is_excluded)
+        self.assertEqual(
+            ['/system/lib64/libc.so', '/system/lib64/libcutils.so',
+             '/system/lib64/libdl.so', '/vendor/lib64/libEGL.so'],
+            self._get_paths_from_nodes(closure))
+
+        closure = graph.compute_users_closure({gb.libdl_32}, is_excluded)
+        self.assertEqual(
+            ['/system/lib/libRS.so', '/system/lib/libc.so',
+             '/system/lib/libcutils.so', '/system/lib/libdl.so',
+             '/vendor/lib/libEGL.so'],
+            self._get_paths_from_nodes(closure))
+
+        # The hidden dependencies are only followed if ignore_hidden_deps is
+        # false.
+        gb.libEGL_64.hide_needed_dep(gb.libc_64)
+        gb.libEGL_64.hide_needed_dep(gb.libcutils_64)
+
+        closure = graph.compute_deps_closure({gb.libEGL_64}, is_excluded, True)
+        self.assertEqual(
+            ['/system/lib64/libdl.so', '/vendor/lib64/libEGL.so'],
+            self._get_paths_from_nodes(closure))
+
+        closure = graph.compute_deps_closure({gb.libEGL_64}, is_excluded)
+        self.assertEqual(
+            ['/system/lib64/libc.so', '/system/lib64/libcutils.so',
+             '/system/lib64/libdl.so', '/vendor/lib64/libEGL.so'],
+            self._get_paths_from_nodes(closure))
+
+
+    def test_edge_version(self):
+        gb = self._create_normal_graph()
+        other_gb = self._create_normal_graph()
+        graph = gb.graph
+
+        def is_excluded(lib):
+            return False
+
+        closure = graph.compute_deps_closure({gb.libm_64}, is_excluded)
+        self.assertEqual({gb.libm_64}, closure)
+
+        # The changes to another graph do not affect this graph.
+        edge_version = graph.edge_version
+        other_gb.libm_64.add_needed_dep(other_gb.libRS_64)
+        self.assertEqual(edge_version, graph.edge_version)
+
+        # The changes to this graph are seen by the next closure.
+        gb.libm_64.add_dlopen_dep(gb.libRS_64)
+        self.assertNotEqual(edge_version, graph.edge_version)
+        closure = graph.compute_deps_closure({gb.libm_64}, is_excluded)
+        self.assertEqual({gb.libm_64, gb.libRS_64, gb.libdl_64}, closure)
+
+
+    def test_compute_closures(self):
+        gb = self._create_normal_graph()
+        graph = gb.graph
+
+        # Add a dependency cycle.
+        gb.libdl_64.add_needed_dep(gb.libcutils_64)
+
+        def is_excluded(lib):
+            return lib.path.endswith('/libm.so') or lib is gb.libc_32
+
+        libs = sorted(graph.all_libs())
+        self.assertEqual(
+            [(lib, graph.compute_deps_closure({lib}, is_excluded))
+             for lib in libs],
+            list(graph.compute_deps_closures(libs, is_excluded)))
+        self.assertEqual(
+            [(lib, graph.compute_users_closure({lib}, is_excluded))
+             for lib in libs],
+            list(graph.compute_users_closures(libs, is_excluded)))
+
+        # An excluded root is in its own closure.
+        self.assertEqual(
+            [(gb.libc_32, {gb.libc_32, gb.libdl_32})],
+            list(graph.compute_deps_closures([gb.libc_32], is_excluded)))
+
+
+    def test_compute_deps_layers(self):
+        gb = self._create_normal_graph()
+
+        # Add a dependency cycle.
+        gb.libdl_64.add_needed_dep(gb.libcutils_64)
+
+        libs = sorted(lib for lib in gb.graph.all_libs() if lib.elf.is_64bit)
+        layers = dict(zip(libs, ELFLinker.compute_deps_layers(libs)))
+
+        def get_layers(lib):
+            return [[libs[i] for i in layer] for layer in layers[lib]]
+
+        self.assertEqual(
+            [[gb.libc_64, gb.libcutils_64, gb.libdl_64], [gb.libm_64]],
+            get_layers(gb.libEGL_64))
+        self.assertEqual(
+            [[gb.libcutils_64], [gb.libc_64], [gb.libm_64]],
+            get_layers(gb.libdl_64))
+        self.assertEqual([], get_layers(gb.libm_64))
+
+
     def test_unresolved_symbols(self):
         gb = GraphBuilder()
         gb.add_lib(PT_SYSTEM, ELF.ELFCLASS64, 'libfoo', dt_needed=[],
@@ -602,3 +768,210 @@ class ELFLinkerDlopenDepsTest(TestCase):
                 stderr.getvalue(),
                 'error:' + re.escape(tmp_file.name) + ':1: ' +
                 'Failed to add dlopen dependency from .* to .*\\.\n')
+
+
+class ELFLinkerIncrementalTest(TestCase):
+    def _create_elf(self, dt_needed=None, exported_symbols=None,
+                    imported_symbols=None):
+        return ELF(ELF.ELFCLASS64, ELF.ELFDATA2LSB, dt_needed=dt_needed,
+                   exported_symbols=exported_symbols,
+                   imported_symbols=imported_symbols)
+
+
+    def _create_graph(self, elfs):
+        graph = ELFLinker()
+        for path, elf in sorted(elfs.items()):
+            graph.add_lib(PT_SYSTEM, path, elf)
+        return graph
+
+
+    def _get_results(self, graph):
+        return dict(
+            (lib.path, (sorted(dep.path for dep in lib.deps_needed),
+                        sorted(user.path for user in lib.users_needed),
+                        sorted(lib.unresolved_symbols),
+                        lib.unresolved_dt_needed,
+                        dict((symbol, dep.path) for symbol, dep in
+                             lib.linked_symbols.items())))
+            for lib in graph.all_libs())
+
+
+    def _resolve_deps_incrementally(self, jobs):
+        elfs = {
+            '/system/lib64/libc.so': self._create_elf(
+                exported_symbols={'printf'}),
+            '/system/lib64/libfoo.so': self._create_elf(
+                dt_needed=['libc.so'], exported_symbols={'foo', 'bar'},
+                imported_symbols={'printf'}),
+            '/system/lib64/libbar.so': self._create_elf(
+                dt_needed=['libfoo.so', 'libbaz.so'],
+                imported_symbols={'foo', 'bar', 'baz'}),
+            '/system/lib64/libqux.so': self._create_elf(
+                dt_needed=['libc.so', 'libquux.so'],
+                imported_symbols={'printf'}),
+            '/system/lib64/libquux.so': self._create_elf(),
+        }
+
+        stderr = StringIO()
+        with patch('sys.stderr', stderr):
+            graph = self._create_graph(elfs)
+            graph.resolve_deps()
+            state = ELFLinkerState.create(None, {}, graph)
+
+            # Change libfoo.so, add libbaz.so, and remove libquux.so.
+            elfs['/system/lib64/libfoo.so'] = self._create_elf(
+                dt_needed=['libc.so'], exported_symbols={'foo'})
+            elfs['/system/lib64/libbaz.so'] = self._create_elf(
+                exported_symbols={'baz'})
+            del elfs['/system/lib64/libquux.so']
+
+            incremental_graph = self._create_graph(elfs)
+            incremental_graph.resolve_deps_incrementally(state, jobs=jobs)
+
+            full_graph = self._create_graph(elfs)
+            full_graph.resolve_deps()
+
+        self.assertEqual(self._get_results(full_graph),
+                         self._get_results(incremental_graph))
+
+        libbar = incremental_graph.get_lib('/system/lib64/libbar.so')
+        self.assertEqual({'bar'}, libbar.unresolved_symbols)
+        libqux = incremental_graph.get_lib('/system/lib64/libqux.so')
+        self.assertEqual(['libquux.so'], libqux.unresolved_dt_needed)
+        return stderr.getvalue()
+
+
+    def test_resolve_deps_incrementally(self):
+        self._resolve_deps_incrementally(jobs=1)
+
+
+    def test_resolve_deps_incrementally_jobs(self):
+        if get_fork_context() is None:
+            self.skipTest('cannot fork worker processes')
+        self.assertEqual(self._resolve_deps_incrementally(jobs=1),
+                         self._resolve_deps_incrementally(jobs=2))
+
+
+    def test_load_corrupted_state(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'state')
+            for data in (b'cvndk_definition_tool\nNoSuchClass\n.', b'K\x05.',
+                         pickle.dumps((ELFLinkerState.FORMAT_VERSION,), 2),
+                         b'garbage'):
+                with open(path, 'wb') as f:
+                    f.write(data)
+                self.assertIsNone(ELFLinkerState.load(path, None))
+
+
+class ELFLinkerGraphFileTest(TestCase):
+    def setUp(self):
+        self.tmp_file = tempfile.NamedTemporaryFile()
+
+
+    def tearDown(self):
+        self.tmp_file.close()
+
+
+    def _get_results(self, graph):
+        def get_paths(libs):
+            return sorted(lib.path for lib in libs)
+
+        return dict(
+            ((lib.partition, lib.path),
+             (lib.elf.ei_class, lib.elf.file_size, list(lib.elf.dt_needed),
+              lib.elf.exported_symbols, lib.elf.imported_symbols,
+              lib.is_ll_ndk, get_paths(lib.deps_needed),
+              get_paths(lib.deps_needed_hidden), get_paths(lib.deps_dlopen),
+              get_paths(lib.users_needed), get_paths(lib.users_needed_hidden),
+              get_paths(lib.users_dlopen), sorted(lib.unresolved_symbols),
+              lib.unresolved_dt_needed,
+              dict((symbol, dep.path) for symbol, dep in
+                   lib.linked_symbols.items()),
+              dict((dep.path, symbols) for dep, symbols in
+                   lib.imported_ext_symbols.items())))
+            for lib in graph.all_libs())
+
+
+    def test_save_and_load_graph(self):
+        gb = GraphBuilder()
+        libc = gb.add_lib64(PT_SYSTEM, 'libc', exported_symbols={'printf'})
+        libfoo = gb.add_lib64(PT_SYSTEM, 'libfoo', dt_needed=['libc.so'],
+                              exported_symbols={'foo', 'bar'},
+                              imported_symbols={'printf', 'puts'})
+        libbar = gb.add_lib64(PT_VENDOR, 'libbar',
+                              dt_needed=['libfoo.so', 'libbaz.so'],
+                              imported_symbols={'foo', 'bar'})
+        gb.add_lib32(PT_SYSTEM, 'libfoo', dt_needed=['libc.so'])
+        gb.graph.add_lib(
+            PT_SYSTEM, '/system/apex/com.android.foo/lib64/libapex.so',
+            ELF(ELF.ELFCLASS64, ELF.ELFDATA2LSB, file_size=(1 << 32) + 1))
+
+        generic_refs = GenericRefs()
+        generic_refs.add('/system/lib64/libfoo.so',
+                         ELF(exported_symbols={'foo'}))
+
+        stderr = StringIO()
+        with patch('sys.stderr', stderr):
+            gb.graph.rewrite_apex_modules()
+            gb.graph.resolve_deps(generic_refs)
+            libfoo.hide_needed_dep(libc)
+            libbar.add_dlopen_dep(libc)
+            gb.graph.save_graph(self.tmp_file.name)
+
+            graph = ELFLinker.load_graph(self.tmp_file.name,
+                                         generic_refs=generic_refs)
+
+        self.assertEqual(self._get_results(gb.graph),
+                         self._get_results(graph))
+        self.assertEqual({'com.android.foo'}, graph.apex_module_names)
+        self.assertEqual(['current'], list(graph.vndk_lib_dirs))
+        self.assertTrue(graph.get_lib('/system/lib64/libc.so').is_ll_ndk)
+        self.assertEqual({'bar'}, graph.get_lib('/vendor/lib64/libbar.so')
+                         .imported_ext_symbols[graph.get_lib(libfoo.path)])
+
+        # The warnings for unresolved DT_NEEDED entries are printed again.
+        self.assertEqual(2, stderr.getvalue().count(
+            '/vendor/lib64/libbar.so: Missing needed library: libbaz.so'))
+
+
+    def test_load_graph_bad_magic(self):
+        self.tmp_file.write(b'\0' * 64)
+        self.tmp_file.flush()
+        with self.assertRaises(ValueError):
+            ELFLinker.load_graph(self.tmp_file.name)
+
+
+    def test_load_graph_corrupted(self):
+        gb = GraphBuilder()
+        gb.add_lib64(PT_SYSTEM, 'libc', exported_symbols={'printf'})
+        gb.add_lib64(PT_SYSTEM, 'libfoo', dt_needed=['libc.so'],
+                     imported_symbols={'printf'})
+        gb.resolve()
+        gb.graph.save_graph(self.tmp_file.name)
+        with open(self.tmp_file.name, 'rb') as graph_file:
+            data = graph_file.read()
+
+        header_fmt = '<8sIIII'
+        header_size = struct.calcsize(header_fmt)
+        magic, version, num_strings, string_table_size, num_ints = \
+            struct.unpack_from(header_fmt, data)
+        body = data[header_size:]
+
+        def check(header, body):
+            with open(self.tmp_file.name, 'wb') as graph_file:
+                graph_file.write(struct.pack(header_fmt, *header) + body)
+            with self.assertRaises(ValueError) as ctx:
+                ELFLinker.load_graph(self.tmp_file.name)
+            self.assertIn('corrupted graph file', str(ctx.exception))
+
+        # The string table does not have num_strings strings.
+        check((magic, version, num_strings + 1, string_table_size, num_ints),
+              body)
+
+        # The integer stream is truncated.
+        check((magic, version, num_strings, string_table_size, num_ints - 4),
+              body[:-16])
+
+        # The string index is out of range.
+        check((magic, version, num_strings, string_table_size, num_ints),
+              body[:string_table_size] + b'\xff' * (num_ints * 4))
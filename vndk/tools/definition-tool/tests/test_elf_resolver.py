@@ -90,3 +90,55 @@ class ELFResolverTest(unittest.TestCase):
             'a2',
             r.resolve('/system/lib/libreq.so', 'liba.so',
                       dt_runpath=['/vendor/lib']))
+
+
+    def test_resolve_memoized(self):
+        r = self.resolver
+
+        # The results of the same name with different search paths must not
+        # be mixed up.
+        for _ in range(2):
+            self.assertEqual('a', r.resolve('/system/lib/libreq.so', 'liba.so'))
+            self.assertEqual(
+                'a2',
+                r.resolve('/system/lib/libreq.so', 'liba.so',
+                          dt_rpath=['/vendor/lib']))
+            self.assertEqual(
+                'a',
+                r.resolve('/system/lib/libreq.so', 'liba.so',
+                          dt_rpath=['/vendor/lib/hw']))
+            self.assertEqual(
+                None, r.resolve('/system/lib/libreq.so', 'libf.so'))
+
+        # The app-specific search paths depend on the requester.
+        r = ELFResolver({'/system/app/example/lib/liba.so': 'a3',
+                         '/system/lib/liba.so': 'a'}, ['/system/lib'])
+        for _ in range(2):
+            self.assertEqual(
+                'a3', r.resolve('/system/app/example/lib/libreq.so', 'liba.so'))
+            self.assertEqual(
+                'a', r.resolve('/system/app/other/lib/libreq.so', 'liba.so'))
+            self.assertEqual('a', r.resolve('/system/lib/libreq.so', 'liba.so'))
+
+
+    def test_resolve_relative_path(self):
+        r = self.resolver
+        self.assertEqual('e', r.resolve('/system/lib/libreq.so', 'hw/libe.so'))
+        self.assertEqual(
+            'f',
+            r.resolve('/system/lib/libreq.so', 'hw/libf.so',
+                      dt_runpath=['/C']))
+
+
+    def test_shared_dir_index(self):
+        lib_set = self.resolver.lib_set
+        dir_index = ELFResolver.create_dir_index(lib_set)
+        system_resolver = ELFResolver(lib_set, ['/system/lib'], dir_index)
+        vendor_resolver = ELFResolver(lib_set, ['/vendor/lib'], dir_index)
+
+        self.assertEqual(
+            'a', system_resolver.resolve('/system/lib/libreq.so', 'liba.so'))
+        self.assertEqual(
+            'a2', vendor_resolver.resolve('/vendor/lib/libreq.so', 'liba.so'))
+        self.assertEqual(
+            None, system_resolver.resolve('/system/lib/libreq.so', 'libc.so'))
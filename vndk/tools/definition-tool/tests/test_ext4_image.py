@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import os
+import struct
+import subprocess
+import unittest
+
+import vndk_definition_tool
+from vndk_definition_tool import Ext4Error, Ext4Image, scan_ext4_image
+
+from .compat import StringIO, TemporaryDirectory, makedirs, patch
+
+
+class Ext4ImageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+
+        # Create the files in the image.
+        self.root = os.path.join(self.tmp_dir.name, 'root')
+        makedirs(os.path.join(self.root, 'lib64', 'hw'), exist_ok=True)
+        makedirs(os.path.join(self.root, 'etc'), exist_ok=True)
+        self.contents = {
+            'lib64/libfoo.so': b'foo' * 10000,
+            'lib64/hw/libbar.so': b'bar',
+            'etc/empty': b'',
+        }
+        for i in range(200):
+            self.contents['etc/file_{}.txt'.format(i)] = str(i).encode()
+        for path, content in self.contents.items():
+            with open(os.path.join(self.root, path), 'wb') as f:
+                f.write(content)
+        os.symlink('../lib64/libfoo.so', os.path.join(self.root, 'etc/link'))
+        os.symlink('link', os.path.join(self.root, 'etc/link2'))
+        os.symlink('/lib64/libfoo.so', os.path.join(self.root, 'etc/abs'))
+        os.symlink('lib64', os.path.join(self.root, 'lib'))
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def _create_image(self, *args):
+        img_path = os.path.join(self.tmp_dir.name, 'test.img')
+        if os.path.exists(img_path):
+            os.remove(img_path)
+        cmd = ['mke2fs', '-q', '-F'] + list(args) + \
+              ['-d', self.root, img_path, '4M']
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError:
+            self.skipTest('mke2fs not available')
+        _, stderr = proc.communicate()
+        if proc.returncode != 0:
+            self.skipTest('mke2fs failed: ' + stderr.decode('utf-8'))
+        return img_path
+
+
+    def _check_image(self, img_path):
+        with Ext4Image(img_path) as image:
+            result = dict()
+            for path, inode in image.walk():
+                with image.open_buf(inode) as buf:
+                    result[path] = buf[:]
+
+        expected = dict(self.contents)
+        expected['etc/link'] = self.contents['lib64/libfoo.so']
+        expected['etc/link2'] = self.contents['lib64/libfoo.so']
+        self.assertEqual(sorted(expected), sorted(result))
+        for path, content in expected.items():
+            self.assertEqual(content, result[path], path)
+
+
+    def test_ext4(self):
+        self._check_image(self._create_image('-t', 'ext4'))
+
+
+    def test_ext4_1k_block(self):
+        self._check_image(self._create_image('-t', 'ext4', '-b', '1024'))
+
+
+    def test_ext2(self):
+        self._check_image(self._create_image('-t', 'ext2'))
+
+
+    def test_read_head(self):
+        img_path = self._create_image('-t', 'ext4')
+        with Ext4Image(img_path) as image:
+            for path, inode in image.walk():
+                if path == 'lib64/libfoo.so':
+                    self.assertEqual(b'foof', image.read(inode, 4))
+
+
+    def test_bad_image(self):
+        img_path = os.path.join(self.tmp_dir.name, 'bad.img')
+        with open(img_path, 'wb') as f:
+            f.write(b'\0' * 4096)
+        with self.assertRaises(Ext4Error):
+            Ext4Image(img_path)
+
+
+    def test_bad_extent_header(self):
+        img_path = self._create_image('-t', 'ext4')
+        # The entries run past the 60-byte i_block.
+        buf = struct.pack('<HHHH', Ext4Image.EXTENT_MAGIC, 5, 4, 0) + \
+              b'\0' * 52
+        with Ext4Image(img_path) as image:
+            with self.assertRaises(Ext4Error):
+                list(image._iter_extent_tree(buf))
+            with self.assertRaises(Ext4Error):
+                list(image._iter_block_map(buf[:40], 1))
+
+
+    def test_bad_inode_number(self):
+        img_path = self._create_image('-t', 'ext4')
+        with Ext4Image(img_path) as image:
+            for ino in (0, image.inodes_count + 1):
+                with self.assertRaises(Ext4Error):
+                    image.get_inode(ino)
+
+
+    def test_directory_loop(self):
+        img_path = self._create_image('-t', 'ext4')
+
+        class _LoopImage(Ext4Image):
+            def iterdir(self, inode):
+                for entry in super(_LoopImage, self).iterdir(inode):
+                    yield entry
+                # Link the subdirectories back to the root directory.
+                if inode.ino != Ext4Image.ROOT_INO:
+                    yield ('loop', Ext4Image.ROOT_INO)
+
+        with _LoopImage(img_path) as image:
+            with self.assertRaises(Ext4Error):
+                list(image.walk())
+
+
+    def test_scan_skip_bad_file(self):
+        img_path = self._create_image('-t', 'ext4')
+        scan_file = vndk_definition_tool._scan_ext4_image_file
+
+        def _scan_file(image, path, inode, unzip_files):
+            if path == '/apex/lib64/libfoo.so':
+                raise Ext4Error('bad block number: 12345')
+            if path.startswith('/apex/lib64/'):
+                return [(path, scan_file(image, path, inode, unzip_files))]
+            return []
+
+        stderr = StringIO()
+        with patch('vndk_definition_tool._scan_ext4_image_file', _scan_file), \
+                patch('sys.stderr', stderr):
+            result = list(scan_ext4_image(img_path, '/apex', True))
+
+        self.assertEqual(['/apex/lib64/hw/libbar.so'],
+                         [path for path, _ in result])
+        self.assertIn('Failed to read lib64/libfoo.so', stderr.getvalue())
+
+
+    def test_scan_fallback_on_bad_dir(self):
+        img_path = self._create_image('-t', 'ext4')
+        dumped = []
+
+        class _BadDirImage(Ext4Image):
+            def walk(self):
+                raise Ext4Error('bad directory entry')
+
+        def _dump_ext4_img(img_file_path, out_dir):
+            dumped.append(img_file_path)
+            makedirs(os.path.join(out_dir, 'lib64'), exist_ok=True)
+
+        with patch('vndk_definition_tool.Ext4Image', _BadDirImage), \
+                patch('vndk_definition_tool.dump_ext4_img', _dump_ext4_img):
+            self.assertEqual([], list(scan_ext4_image(img_path, '/apex', True)))
+        self.assertEqual([img_path], dumped)
@@ -7,6 +7,8 @@ import unittest
 
 from vndk_definition_tool import GenericRefs
 
+from .compat import TemporaryDirectory
+
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -59,6 +61,38 @@ class GenericRefsTest(unittest.TestCase):
                          g.refs['/system/lib64/libm.so'].exported_symbols)
 
 
+    def test_save_and_load_packed(self):
+        input_dir = os.path.join(SCRIPT_DIR, 'testdata', 'test_generic_refs')
+        g = GenericRefs.create_from_sym_dir(input_dir)
+
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'refs.packed')
+            g.save_packed(path)
+            packed = GenericRefs.create_from_packed_file(path)
+            self.assertEqual(sorted(g.refs), sorted(packed.refs))
+            for lib_path, elf in g.refs.items():
+                self.assertEqual(elf, packed.refs[lib_path])
+            self.assertEqual(g.get_digest(), packed.get_digest())
+            self.assertTrue(packed.has_same_name_lib(
+                MockLib('/vendor/lib/libc.so', {})))
+
+            # create_from_path() loads both formats.
+            self.assertEqual(
+                sorted(g.refs), sorted(GenericRefs.create_from_path(path).refs))
+            self.assertEqual(
+                sorted(g.refs),
+                sorted(GenericRefs.create_from_path(input_dir).refs))
+
+
+    def test_load_packed_bad_file(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'refs.packed')
+            with open(path, 'wb') as f:
+                f.write(b'VNDKGRPH' + b'\0' * 16)
+            with self.assertRaises(ValueError):
+                GenericRefs.create_from_packed_file(path)
+
+
     def test_classify_lib(self):
         libc_sub = MockLib('/system/lib/libc.so', {'fclose', 'fopen', 'fread'})
         libc_sup = MockLib('/system/lib/libc.so',
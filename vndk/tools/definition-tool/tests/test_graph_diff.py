@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import unittest
+
+from vndk_definition_tool import GraphDiff, PT_SYSTEM, PT_VENDOR
+
+from .compat import StringIO
+from .utils import GraphBuilder
+
+
+def _build_graph(changed):
+    gb = GraphBuilder()
+    gb.add_lib32(PT_SYSTEM, 'libc', exported_symbols={'malloc', 'free'})
+    if changed:
+        gb.add_lib32(PT_SYSTEM, 'libfoo', dt_needed=['libc.so'],
+                     exported_symbols={'foo', 'foo2'},
+                     imported_symbols={'malloc', 'calloc'})
+        gb.add_lib32(PT_SYSTEM, 'libnew')
+    else:
+        gb.add_lib32(PT_SYSTEM, 'libfoo', dt_needed=['libc.so', 'libbar.so'],
+                     exported_symbols={'foo', 'foo1'},
+                     imported_symbols={'malloc', 'bar'})
+        gb.add_lib32(PT_SYSTEM, 'libbar', exported_symbols={'bar'})
+    gb.add_lib32(PT_VENDOR, 'libvnd', dt_needed=['libc.so'],
+                 imported_symbols={'free'})
+    gb.resolve()
+    return gb.graph
+
+
+class GraphDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.graph_diff = GraphDiff(_build_graph(False), _build_graph(True))
+
+
+    def test_added_and_removed_libs(self):
+        self.assertEqual(['/system/lib/libnew.so'], self.graph_diff.added_libs)
+        self.assertEqual(['/system/lib/libbar.so'],
+                         self.graph_diff.removed_libs)
+
+
+    def test_changed_libs(self):
+        self.assertEqual(2, self.graph_diff.num_unchanged_libs)
+        self.assertEqual(1, len(self.graph_diff.changed_libs))
+
+        lib_diff = self.graph_diff.changed_libs[0]
+        self.assertEqual('/system/lib/libfoo.so', lib_diff.path)
+        self.assertEqual([], lib_diff.added_deps)
+        self.assertEqual(['/system/lib/libbar.so'], lib_diff.removed_deps)
+        self.assertEqual(['calloc'], lib_diff.added_unresolved_symbols)
+        self.assertEqual(['foo2'], lib_diff.added_exported_symbols)
+        self.assertEqual(['foo1'], lib_diff.removed_exported_symbols)
+
+
+    def test_same_graph(self):
+        graph = _build_graph(False)
+        graph_diff = GraphDiff(graph, _build_graph(False))
+        self.assertEqual([], graph_diff.added_libs)
+        self.assertEqual([], graph_diff.removed_libs)
+        self.assertEqual([], graph_diff.changed_libs)
+        self.assertEqual(4, graph_diff.num_unchanged_libs)
+
+
+    def test_dump(self):
+        output = StringIO()
+        self.graph_diff.dump(output)
+        self.assertEqual(
+            'ADDED: /system/lib/libnew.so\n'
+            'REMOVED: /system/lib/libbar.so\n'
+            'CHANGED: /system/lib/libfoo.so\n'
+            '\tREMOVED_DT_NEEDED: /system/lib/libbar.so\n'
+            '\tNEW_UNRESOLVED_SYMBOL: calloc\n'
+            '\tADDED_EXP_SYMBOL: foo2\n'
+            '\tREMOVED_EXP_SYMBOL: foo1\n',
+            output.getvalue())
+
+
+    def test_to_json(self):
+        data = self.graph_diff.to_json()
+        self.assertEqual(2, data['num_unchanged_libs'])
+        self.assertEqual('/system/lib/libfoo.so',
+                         data['changed_libs'][0]['path'])
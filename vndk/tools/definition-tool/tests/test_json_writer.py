@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import json
+import os
+import unittest
+
+from vndk_definition_tool import write_json_array, write_json_array_shards
+
+from .compat import StringIO, TemporaryDirectory
+
+
+class JSONWriterTest(unittest.TestCase):
+    _ITEMS = [[0, 64, [1], [[2, 3], [4]], [], []],
+              {'name': '/system/lib/libc.so', 'depends': ['libdl.so']},
+              'str', 1.5, None]
+
+
+    def test_write_json_array(self):
+        for items in ([], self._ITEMS):
+            f = StringIO()
+            write_json_array(f, iter(items))
+            self.assertEqual(json.dumps(items), f.getvalue())
+
+
+    def test_write_json_array_shards(self):
+        with TemporaryDirectory() as tmp_dir:
+            file_names = write_json_array_shards(
+                tmp_dir, 'data', iter(self._ITEMS), 2, 'add(', ');\n')
+
+            self.assertEqual(['data-0.js', 'data-1.js', 'data-2.js'],
+                             file_names)
+
+            items = []
+            for file_name in file_names:
+                with open(os.path.join(tmp_dir, file_name), 'r') as f:
+                    content = f.read()
+                self.assertTrue(content.startswith('add('))
+                self.assertTrue(content.endswith(');\n'))
+                items.extend(json.loads(content[4:-3]))
+            self.assertEqual(self._ITEMS, items)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import unittest
+
+from vndk_definition_tool import parallel_imap
+
+
+class ParallelImapTest(unittest.TestCase):
+    def test_serial(self):
+        self.assertEqual([1, 2, 3], list(parallel_imap(abs, [-1, 2, -3])))
+
+
+    def test_parallel_keeps_order(self):
+        items = list(range(-500, 500))
+        self.assertEqual([abs(x) for x in items],
+                         list(parallel_imap(abs, items, jobs=4, chunksize=7)))
+
+
+    def test_parallel_early_exit(self):
+        results = parallel_imap(abs, range(-100, 0), jobs=2)
+        self.assertEqual(100, next(results))
+        results.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import json
+import os
+import unittest
+
+from vndk_definition_tool import ELFLinker, PhaseTimings
+
+from .compat import StringIO, TemporaryDirectory, makedirs, patch
+
+
+class PhaseTimingsTest(unittest.TestCase):
+    def test_nested_phases(self):
+        timings = PhaseTimings()
+        with timings.phase('create') as create:
+            with timings.phase('scan', 'system') as scan:
+                scan.count += 2
+                with timings.phase('parse') as parse:
+                    parse.count += 1
+            with timings.phase('scan', 'vendor') as scan:
+                scan.count += 3
+
+        self.assertEqual(
+            [('create', None, 0, 1, 0),
+             ('scan', 'system', 1, 1, 2),
+             ('parse', 'system', 2, 1, 1),
+             ('scan', 'vendor', 1, 1, 3)],
+            [(record.name, record.partition, record.depth, record.calls,
+              record.count) for record in timings.records])
+
+        for record in timings.records:
+            self.assertGreaterEqual(record.wall_time, 0.0)
+            self.assertGreaterEqual(record.cpu_time, 0.0)
+        self.assertGreaterEqual(
+            create.wall_time, timings.records[1].wall_time)
+
+
+    def test_merge_phases(self):
+        timings = PhaseTimings()
+        for i in range(3):
+            with timings.phase('load') as record:
+                record.count += i
+
+        self.assertEqual(1, len(timings.records))
+        self.assertEqual(3, timings.records[0].calls)
+        self.assertEqual(3, timings.records[0].count)
+
+
+    def test_merge_worker_records(self):
+        worker_timings = PhaseTimings()
+        with worker_timings.phase('extract') as record:
+            record.count += 2
+            with worker_timings.phase('dump'):
+                pass
+
+        timings = PhaseTimings()
+        with timings.phase('scan', 'system'):
+            timings.merge(worker_timings.records)
+            timings.merge(worker_timings.records)
+
+        self.assertEqual(
+            [('scan', 'system', 0, 1, 0),
+             ('extract', 'system', 1, 2, 4),
+             ('dump', 'system', 2, 2, 0)],
+            [(record.name, record.partition, record.depth, record.calls,
+              record.count) for record in timings.records])
+
+
+    def test_phase_exception(self):
+        timings = PhaseTimings()
+        with self.assertRaises(ValueError):
+            with timings.phase('fail'):
+                raise ValueError()
+
+        self.assertEqual(1, timings.records[0].calls)
+        with timings.phase('next'):
+            pass
+        self.assertEqual(0, timings.records[1].depth)
+
+
+    def test_to_json_and_dump(self):
+        timings = PhaseTimings()
+        with timings.phase('scan', 'vendor') as record:
+            record.count += 5
+
+        data = json.loads(json.dumps(timings.to_json()))
+        self.assertEqual(1, len(data))
+        self.assertEqual('scan', data[0]['name'])
+        self.assertEqual('vendor', data[0]['partition'])
+        self.assertEqual(5, data[0]['count'])
+        for key in ('calls', 'depth', 'wall_time', 'cpu_time', 'peak_rss_kb'):
+            self.assertIn(key, data[0])
+
+        output = StringIO()
+        timings.dump(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].startswith('Phase'))
+        self.assertTrue(lines[1].startswith('scan (vendor)'))
+
+
+    def test_elf_linker_create(self):
+        timings = PhaseTimings()
+        with TemporaryDirectory() as tmp_dir:
+            system_dir = os.path.join(tmp_dir, 'system')
+            vendor_dir = os.path.join(tmp_dir, 'vendor')
+            makedirs(system_dir, exist_ok=True)
+            makedirs(vendor_dir, exist_ok=True)
+            with patch('vndk_definition_tool._phase_timings', timings):
+                ELFLinker.create(system_dirs=[system_dir],
+                                 vendor_dirs=[vendor_dir])
+
+        self.assertEqual(
+            [('scan', 'system'), ('scan', 'vendor'),
+             ('rewrite_apex_modules', None), ('resolve_deps', None)],
+            [(record.name, record.partition) for record in timings.records])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import json
+import os
+import unittest
+import zipfile
+
+from vndk_definition_tool import (
+    ELF, ELFCache, PhaseTimings, scan_apex_files, scan_elf_files_incremental)
+
+from .compat import TemporaryDirectory, makedirs, patch
+
+
+def _fake_scan_elf_files(root, mount_point=None, unzip_files=True):
+    """Yield an ELF for each *.so file without parsing it."""
+    # pylint: disable=unused-argument
+    for base, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            path = os.path.join(base, filename)
+            if filename.endswith('.so') and os.path.exists(path):
+                yield (os.path.join(mount_point, os.path.relpath(path, root)),
+                       ELF(ELF.ELFCLASS64, ELF.ELFDATA2LSB,
+                           file_size=os.path.getsize(path)))
+
+
+def _fail_scan_apex_file(apex_collection_root, apex_zip_file, unzip_files):
+    raise AssertionError('unexpected extraction: ' + apex_zip_file)
+
+
+class ScanApexFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.apex_dir = os.path.join(self.tmp_dir.name, 'system', 'apex')
+
+        # Create a flattened APEX module.
+        lib_dir = os.path.join(self.apex_dir, 'com.android.foo', 'lib64')
+        makedirs(lib_dir, exist_ok=True)
+        with open(os.path.join(lib_dir, 'libfoo.so'), 'wb') as f:
+            f.write(b'foo')
+        with open(os.path.join(self.apex_dir, 'com.android.foo',
+                               'apex_manifest.json'), 'w') as f:
+            json.dump({'name': 'com.android.foo'}, f)
+
+        # Create an APEX file.
+        self.apex_file = os.path.join(self.apex_dir, 'com.android.bar.apex')
+        self._write_apex_file(b'bar')
+
+        self.cache = ELFCache(os.path.join(self.tmp_dir.name, 'cache'))
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def _write_apex_file(self, content):
+        with zipfile.ZipFile(self.apex_file, 'w') as zip_file:
+            zip_file.writestr('apex_manifest.json',
+                              json.dumps({'name': 'com.android.bar'}))
+            zip_file.writestr('lib64/libbar.so', content)
+
+
+    def _scan(self, elf_cache=None):
+        with patch('vndk_definition_tool.scan_elf_files',
+                   _fake_scan_elf_files):
+            return sorted((path, elf.file_size) for path, elf in
+                          scan_apex_files(self.apex_dir, True,
+                                          elf_cache=elf_cache))
+
+
+    def test_scan_apex_files(self):
+        self.assertEqual(
+            [(os.path.join(self.apex_dir, 'com.android.bar/lib64/libbar.so'),
+              3),
+             (os.path.join(self.apex_dir, 'com.android.foo/lib64/libfoo.so'),
+              3)],
+            self._scan())
+
+
+    def test_elf_cache(self):
+        expected = self._scan(self.cache)
+
+        # The APEX file is not extracted again if it is not changed.
+        with patch('vndk_definition_tool.scan_apex_file',
+                   _fail_scan_apex_file):
+            self.assertEqual(expected, self._scan(self.cache))
+
+        # The APEX file is extracted again if the contents are changed.
+        self._write_apex_file(b'bar2')
+        self.assertEqual(
+            4, dict(self._scan(self.cache))[
+                os.path.join(self.apex_dir, 'com.android.bar/lib64/libbar.so')])
+
+
+    def test_phase_timings(self):
+        for jobs in (1, 2):
+            timings = PhaseTimings()
+            with patch('vndk_definition_tool._phase_timings', timings):
+                with patch('vndk_definition_tool.scan_elf_files',
+                           _fake_scan_elf_files):
+                    with timings.phase('scan', 'system'):
+                        list(scan_apex_files(self.apex_dir, True, jobs))
+
+            records = dict(((record.name, record.partition), record)
+                           for record in timings.records)
+
+            # The APEX file is extracted in a worker and the flattened APEX
+            # module is not extracted.
+            extract_apex = records[('extract_apex', 'system')]
+            self.assertEqual(1, extract_apex.count)
+            self.assertEqual(1, extract_apex.calls)
+            self.assertEqual(2, extract_apex.depth)
+            self.assertEqual(2, records[('scan_apex', 'system')].count)
+
+
+    def test_scan_elf_files_incremental_dangling_symlink(self):
+        if not hasattr(os, 'symlink'):
+            self.skipTest('symlink not available')
+        os.symlink('does_not_exist', os.path.join(
+            self.apex_dir, 'com.android.foo', 'lib64', 'libdangling.so'))
+
+        root = os.path.dirname(self.apex_dir)
+        with patch('vndk_definition_tool.scan_elf_files',
+                   _fake_scan_elf_files):
+            results, files = scan_elf_files_incremental(root, dict())
+
+        self.assertIn(self.apex_dir, files)
+        self.assertIn(
+            os.path.join(self.apex_dir, 'com.android.foo/lib64/libfoo.so'),
+            [path for path, _ in results])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+
+import mmap
+import os
+import unittest
+import zipfile
+
+from vndk_definition_tool import ELF, scan_zip_file
+
+from .compat import TemporaryDirectory
+
+
+class ScanZipFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.zip_path = os.path.join(self.tmp_dir.name, 'test.apk')
+        self.content = ELF.ELF_MAGIC + b'\x02\x01\x01' + b'\0' * 1024
+
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def _write_stored_member(self, fp, zip_file, name, aligned):
+        data_offset = fp.tell() + 30 + len(name)
+        padding = -data_offset % mmap.ALLOCATIONGRANULARITY
+        if not aligned:
+            padding += 1
+        info = zipfile.ZipInfo(name)
+        info.compress_type = zipfile.ZIP_STORED
+        info.extra = b'\0' * padding
+        zip_file.writestr(info, self.content)
+
+
+    def test_scan_zip_file(self):
+        with open(self.zip_path, 'wb') as fp:
+            with zipfile.ZipFile(fp, 'w') as zip_file:
+                zip_file.writestr('res.txt', b'hello')
+                self._write_stored_member(
+                    fp, zip_file, 'lib/arm64-v8a/libaligned.so', True)
+                self._write_stored_member(
+                    fp, zip_file, 'lib/arm64-v8a/libunaligned.so', False)
+                zip_file.writestr(
+                    zipfile.ZipInfo('lib/x86/libdeflated.so'), self.content,
+                    zipfile.ZIP_DEFLATED)
+                zip_file.writestr('short.bin', ELF.ELF_MAGIC[0:3])
+
+        result = dict((path, buf[:]) for path, buf in
+                      scan_zip_file(self.zip_path))
+
+        def get_path(name):
+            return os.path.join(self.zip_path, name)
+
+        self.assertEqual({
+            get_path('lib/arm64-v8a/libaligned.so'): self.content,
+            get_path('lib/arm64-v8a/libunaligned.so'): self.content,
+            get_path('lib/x86/libdeflated.so'): self.content,
+        }, result)
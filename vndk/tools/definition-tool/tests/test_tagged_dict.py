@@ -248,6 +248,50 @@ class TaggedPathDictTest(unittest.TestCase):
         self.assertEqual('vnd_only', d.get_path_tag('/vendor/lib/unknown.so'))
 
 
+    def test_get_regex_literal_prefix(self):
+        get_prefix = TaggedPathDict._get_regex_literal_prefix
+        self.assertEqual('/system/lib', get_prefix('/system/lib(?:64)?/a.so'))
+        self.assertEqual('/system/lib6', get_prefix('^/system/lib64?/a.so'))
+        self.assertEqual('/vendor/a.so', get_prefix('/vendor/a\\.so'))
+        self.assertEqual('/vendor/', get_prefix('/vendor/\\w+\\.so'))
+        self.assertEqual('', get_prefix('.*/a\\.so'))
+        self.assertEqual('', get_prefix('/system/a.so|/vendor/a.so'))
+        self.assertEqual('', get_prefix('(?i)/system/a.so'))
+
+
+    def test_get_path_tag_regex(self):
+        d = TaggedPathDict()
+        d.add_regex('vndk', '/system/lib(?:64)?/libfoo\\.so')
+        d.add_regex('ll_ndk', '.*/libfoo\\.so')
+        d.add_regex('vndk_sp', '/system/lib64/lib.*\\.so')
+        d.add_regex('sp_hal', '/vendor/(lib|lib64)/libbar\\.so')
+        d.add_regex('sp_hal_dep', '/vendor/lib64/lib.*\\.so')
+
+        # The first matching pattern wins.
+        self.assertEqual('vndk', d.get_path_tag('/system/lib64/libfoo.so'))
+        self.assertEqual('ll_ndk', d.get_path_tag('/vendor/lib64/libfoo.so'))
+        self.assertEqual('vndk_sp', d.get_path_tag('/system/lib64/libbar.so'))
+
+        # Patterns with groups cannot be combined.
+        self.assertEqual('sp_hal', d.get_path_tag('/vendor/lib64/libbar.so'))
+        self.assertEqual('sp_hal_dep',
+                         d.get_path_tag('/vendor/lib64/libbaz.so'))
+
+        # Unmatched paths
+        self.assertEqual('fwk_only', d.get_path_tag('/system/lib/libbar.so'))
+        self.assertEqual('vnd_only', d.get_path_tag('/vendor/lib/libbaz.so'))
+
+        # Cached tags are invalidated by add() and add_regex().
+        tag_bit = d.get_path_tag_bit('/system/lib/libbar.so')
+        self.assertEqual(TaggedPathDict.FWK_ONLY, tag_bit)
+        d.add_regex('vndk_sp', '/system/lib/libbar\\.so')
+        self.assertEqual(TaggedPathDict.VNDK_SP,
+                         d.get_path_tag_bit('/system/lib/libbar.so'))
+        d.add('ll_ndk', '/system/lib/libbar.so')
+        self.assertEqual(TaggedPathDict.LL_NDK,
+                         d.get_path_tag_bit('/system/lib/libbar.so'))
+
+
     def _check_path_visibility(self, d, all_paths, from_paths, visible_paths):
         for from_path in from_paths:
             for to_path in all_paths:
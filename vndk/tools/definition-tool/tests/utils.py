@@ -69,9 +69,9 @@ class GraphBuilder(object):
         )
 
 
-    def resolve(self, vndk_lib_dirs=None, ro_vndk_version=None):
+    def resolve(self, vndk_lib_dirs=None, ro_vndk_version=None, jobs=1):
         if vndk_lib_dirs is not None:
             self.graph.vndk_lib_dirs = vndk_lib_dirs
         if ro_vndk_version is not None:
             self.graph.ro_vndk_version = ro_vndk_version
-        self.graph.resolve_deps()
+        self.graph.resolve_deps(jobs=jobs)
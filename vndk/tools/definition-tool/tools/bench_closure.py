@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# This tool compares the speed of a set-based closure and
+# ELFLinker.compute_deps_closure() (which uses ELFLinkIndex) in
+# vndk_definition_tool.py on a synthetic graph, e.g.
+#
+#   $ tools/bench_closure.py --num-libs 50000 --num-deps 8
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from vndk_definition_tool import ELF, ELFLinker, ELFLinkIndex, PT_SYSTEM
+
+
+def create_graph(num_libs, num_deps, seed):
+    rand = random.Random(seed)
+    graph = ELFLinker()
+    libs = [graph.add_lib(PT_SYSTEM, '/system/lib64/lib{}.so'.format(i),
+                          ELF(ELF.ELFCLASS64, ELF.ELFDATA2LSB))
+            for i in range(num_libs)]
+
+    # Most libs depend on the libs with larger indices, and a few of them
+    # depend on the libs with smaller indices to form cycles.
+    for i, lib in enumerate(libs):
+        for j in range(rand.randint(0, num_deps * 2)):
+            if rand.random() < 0.95:
+                dep = libs[min(num_libs - 1, i + int(rand.expovariate(0.01)))]
+            else:
+                dep = libs[rand.randrange(num_libs)]
+            if rand.random() < 0.8:
+                lib.add_needed_dep(dep)
+            else:
+                lib.add_dlopen_dep(dep)
+    return graph, libs
+
+
+def compute_set_closure(root_set, is_excluded):
+    """Compute the closure of deps_all with Python sets, i.e. without
+    ELFLinkIndex."""
+    closure = set(root_set)
+    stack = list(root_set)
+    while stack:
+        lib = stack.pop()
+        for dep in lib.deps_all:
+            if dep not in closure and not is_excluded(dep):
+                closure.add(dep)
+                stack.append(dep)
+    return closure
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-libs', type=int, default=50000,
+                        help='number of libs in the synthetic graph')
+    parser.add_argument('--num-deps', type=int, default=8,
+                        help='average number of dependencies of a lib')
+    parser.add_argument('--num-roots', type=int, default=16,
+                        help='number of libs in the root set')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs (the fastest is reported)')
+    args = parser.parse_args()
+
+    graph, libs = create_graph(args.num_libs, args.num_deps, args.seed)
+    rand = random.Random(args.seed)
+    root_set = set(rand.sample(libs, args.num_roots))
+    excluded = set(rand.sample(libs, args.num_libs // 100))
+
+    def is_excluded(lib):
+        return lib in excluded
+
+    def set_closure():
+        return compute_set_closure(root_set, is_excluded)
+
+    def index_closure():
+        return graph.compute_deps_closure(root_set, is_excluded)
+
+    def build_index():
+        ELFLinkIndex(libs).get_adjacency('deps_all')
+
+    assert set_closure() == index_closure()
+    print('{} libs, closure of {} libs'.format(len(libs), len(set_closure())))
+
+    for name, func in (('set-based', set_closure),
+                       ('index build', build_index),
+                       ('index closure', index_closure)):
+        secs = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('{}\t{:.2f} ms'.format(name, secs * 1000))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
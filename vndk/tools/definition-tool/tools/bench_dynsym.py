@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# This tool compares the speed of the bulk .dynsym decoder and the per-entry
+# .dynsym decoder in vndk_definition_tool.py, e.g.
+#
+#   $ tools/bench_dynsym.py ${ANDROID_PRODUCT_OUT}/system/lib64/libc++.so \
+#         ${ANDROID_PRODUCT_OUT}/system/lib64/libart.so
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=protected-access,wrong-import-position
+from vndk_definition_tool import ELF, ACCESS_READ, mmap
+
+
+def bench(path, repeat):
+    elf = ELF.load(path, lazy_symbols=True)
+    if not elf.has_lazy_symbols:
+        print('{}: no .dynsym section'.format(path))
+        return
+
+    dynsym_off, dynsym_end, dynsym_entsize, dynstr_off, dynstr_end = \
+        elf._lazy_symbols[1:]
+    dynsym_off += dynsym_entsize
+    fmt = elf._get_elf_sym_name_info_shndx_fmt()
+
+    with open(path, 'rb') as f:
+        with mmap(f.fileno(), 0, access=ACCESS_READ) as buf:
+            def per_entry():
+                elf._parse_dynsym_per_entry(
+                    buf, dynsym_off, dynsym_end, dynsym_entsize, dynstr_off)
+
+            def bulk():
+                ELF._parse_dynsym_bulk(
+                    buf, fmt, dynsym_off, dynsym_end, dynsym_entsize,
+                    dynstr_off, dynstr_end)
+
+            num_syms = (dynsym_end - dynsym_off) // dynsym_entsize
+            for name, func in (('per-entry', per_entry), ('bulk', bulk)):
+                secs = min(timeit.repeat(func, number=1, repeat=repeat))
+                print('{}\t{}\t{} symbols\t{:.2f} ms'.format(
+                    path, name, num_syms, secs * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='ELF files to decode')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of runs (the fastest is reported)')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        bench(path, args.repeat)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
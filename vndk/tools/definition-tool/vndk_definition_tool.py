@@ -3,23 +3,34 @@
 from __future__ import print_function
 
 import argparse
+import bisect
 import codecs
 import collections
+import contextlib
 import copy
 import csv
+import functools
+import hashlib
 import io
 import itertools
 import json
+import multiprocessing
 import os
+import pickle
 import posixpath
 import re
 import shutil
+import socket
 import stat
 import struct
 import subprocess
 import sys
+import tempfile
+import time
 import zipfile
 
+from array import array
+
 
 #------------------------------------------------------------------------------
 # Python 2 and 3 Compatibility Layer
@@ -27,15 +38,17 @@ import zipfile
 
 if sys.version_info >= (3, 0):
     from os import makedirs
-    from mmap import ACCESS_READ, mmap
+    from mmap import ACCESS_READ, ALLOCATIONGRANULARITY, mmap
 
     def get_py3_bytes(buf):
         return buf
 
+    fsdecode = os.fsdecode
+
     create_chr = chr
     enumerate_bytes = enumerate
 else:
-    from mmap import ACCESS_READ, mmap
+    from mmap import ACCESS_READ, ALLOCATIONGRANULARITY, mmap
 
     def makedirs(path, exist_ok):
         if exist_ok and os.path.isdir(path):
@@ -63,8 +76,13 @@ else:
             return Py3Bytes(res)
 
     def get_py3_bytes(buf):
+        if isinstance(buf, (mmap, Py3Bytes)):
+            return buf
         return Py3Bytes(buf)
 
+    def fsdecode(path):
+        return path
+
     create_chr = unichr
 
     def enumerate_bytes(iterable):
@@ -78,6 +96,21 @@ try:
 except ImportError:
     pass
 
+try:
+    from collections.abc import Set
+except ImportError:
+    from collections import Set
+
+try:
+    from struct import iter_unpack as _struct_iter_unpack
+except ImportError:
+    _struct_iter_unpack = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 try:
     from tempfile import TemporaryDirectory
 except ImportError:
@@ -294,7 +327,9 @@ def decode_mutf8(input, errors='strict'):
 
 
 def probe_mutf8(name):
-    if name == 'mutf-8':
+    # Python 3.9 and later normalize the hyphens in codec names to underscores
+    # before calling the search functions.
+    if name in ('mutf-8', 'mutf_8'):
         return codecs.CodecInfo(encode_mutf8, decode_mutf8)
     return None
 
@@ -373,6 +408,454 @@ def create_struct(name, fields):
     return cls
 
 
+def load_le_uint32_array(buf, start=0, end=None):
+    """Load an array('I') from the little-endian 32-bit unsigned integers in
+    buf[start:end].  The integers are copied from a memoryview of buf in bulk
+    instead of being unpacked one by one."""
+    ints = array('I')
+    if sys.version_info >= (3, 0):
+        with memoryview(buf) as view:
+            ints.frombytes(view[start:end])
+    else:
+        ints.fromstring(buf[start:end])
+    if sys.byteorder != 'little':
+        ints.byteswap()
+    return ints
+
+
+# The packed files start with a header, which is followed by a string table
+# (NUL-separated UTF-8 strings) and an array of little-endian 32-bit integers.
+# Strings are referred by their indices, and lists are prefixed with their
+# lengths.
+_PACKED_FILE_HEADER_FMT = '<8sIIII'
+
+
+class PackedFileWriter(object):
+    """PackedFileWriter collects the integers and the strings of a packed
+    file."""
+
+    def __init__(self):
+        self.ints = array('I')
+        self._string_ids = dict()
+
+
+    def add_int(self, value):
+        self.ints.append(value)
+
+
+    def add_u64(self, value):
+        self.ints.append(value & 0xffffffff)
+        self.ints.append(value >> 32)
+
+
+    def add_str(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self._string_ids)
+        self.ints.append(string_id)
+
+
+    def add_strs(self, strings):
+        self.ints.append(len(strings))
+        for string in strings:
+            self.add_str(string)
+
+
+    def add_ints(self, values):
+        self.ints.append(len(values))
+        self.ints.extend(values)
+
+
+    def save(self, path, magic, version):
+        strings = [None] * len(self._string_ids)
+        for string, string_id in self._string_ids.items():
+            strings[string_id] = string
+        string_table = '\0'.join(strings)
+        if sys.version_info >= (3, 0):
+            string_table = string_table.encode('utf-8')
+
+        ints = self.ints
+        if sys.byteorder != 'little':
+            ints = array('I', ints)
+            ints.byteswap()
+
+        with open(path, 'wb') as packed_file:
+            packed_file.write(struct.pack(
+                _PACKED_FILE_HEADER_FMT, magic, version, len(strings),
+                len(string_table), len(ints)))
+            packed_file.write(string_table)
+            ints.tofile(packed_file)
+
+
+class PackedFileReader(object):
+    """PackedFileReader reads the integers and the strings of a packed file in
+    the order that they were added to PackedFileWriter.  ValueError is raised
+    if the magic word or the version does not match."""
+
+    def __init__(self, path, magic, version, file_type):
+        with open(path, 'rb') as packed_file:
+            data = packed_file.read()
+
+        header_size = struct.calcsize(_PACKED_FILE_HEADER_FMT)
+        if len(data) < header_size:
+            raise ValueError('{}: not a {} file'.format(path, file_type))
+        file_magic, file_version, num_strings, string_table_size, num_ints = \
+            struct.unpack_from(_PACKED_FILE_HEADER_FMT, data)
+        if file_magic != magic:
+            raise ValueError('{}: not a {} file'.format(path, file_type))
+        if file_version != version:
+            raise ValueError('{}: unsupported {} format version {}'
+                             .format(path, file_type, file_version))
+
+        offset = header_size + string_table_size
+        if len(data) != offset + num_ints * 4:
+            raise ValueError('{}: truncated {} file'.format(path, file_type))
+
+        self.path = path
+        self.file_type = file_type
+
+        if num_strings:
+            # The strings are kept as byte strings in Python 2, which is what
+            # intern() accepts.
+            strings = data[header_size:offset]
+            if sys.version_info >= (3, 0):
+                try:
+                    strings = strings.decode('utf-8')
+                except UnicodeDecodeError:
+                    raise self._corrupted_error()
+            self.strings = [intern(string) for string in strings.split('\0')]
+        else:
+            self.strings = []
+        if len(self.strings) != num_strings:
+            raise self._corrupted_error()
+
+        self.ints = load_le_uint32_array(data, offset)
+        self._ints_iter = iter(self.ints)
+        self.read_int = functools.partial(next, self._ints_iter)
+
+
+    def _corrupted_error(self):
+        return ValueError('{}: corrupted {} file'.format(self.path,
+                                                         self.file_type))
+
+
+    @contextlib.contextmanager
+    def reading(self):
+        """Raise ValueError instead of IndexError or StopIteration if the
+        contents read in the context are out of range."""
+        try:
+            yield
+        except (IndexError, StopIteration):
+            raise self._corrupted_error()
+
+
+    def read_ints(self):
+        return itertools.islice(self._ints_iter, self.read_int())
+
+
+    def read_u64(self):
+        low = self.read_int()
+        return low | (self.read_int() << 32)
+
+
+    def read_str(self):
+        return self.strings[self.read_int()]
+
+
+    def read_strs(self):
+        return [self.strings[i] for i in self.read_ints()]
+
+
+#------------------------------------------------------------------------------
+# Phase Timings
+#------------------------------------------------------------------------------
+
+class PhaseRecord(object):
+    def __init__(self, name, partition, depth):
+        self.name = name
+        self.partition = partition
+        self.depth = depth
+        self.calls = 0
+        self.count = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss_kb = None
+
+
+    def to_json(self):
+        return collections.OrderedDict((
+            ('name', self.name),
+            ('partition', self.partition),
+            ('depth', self.depth),
+            ('calls', self.calls),
+            ('count', self.count),
+            ('wall_time', round(self.wall_time, 6)),
+            ('cpu_time', round(self.cpu_time, 6)),
+            ('peak_rss_kb', self.peak_rss_kb),
+        ))
+
+
+class PhaseTimings(object):
+    """PhaseTimings records the wall time, the CPU time, the peak RSS, and the
+    number of processed items of each phase.  The CPU time and the peak RSS
+    include the worker processes which have exited.  The records of the
+    phases with the same name and partition are merged.  Nested phases are
+    included in their enclosing phases and inherit their partitions."""
+
+    def __init__(self):
+        self._records = collections.OrderedDict()
+        self._stack = []
+
+
+    @staticmethod
+    def get_cpu_time():
+        times = os.times()
+        return times[0] + times[1] + times[2] + times[3]
+
+
+    @staticmethod
+    def get_peak_rss_kb():
+        if resource is None:
+            return None
+        rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        if sys.platform == 'darwin':
+            # ru_maxrss is in bytes on macOS.
+            rss //= 1024
+        return rss
+
+
+    @contextlib.contextmanager
+    def phase(self, name, partition=None):
+        """Record the phase in the with statement.  The with statement gets the
+        PhaseRecord whose count should be increased by the number of the
+        processed items."""
+        if partition is None and self._stack:
+            partition = self._stack[-1].partition
+        key = (name, partition)
+        record = self._records.get(key)
+        if record is None:
+            record = PhaseRecord(name, partition, len(self._stack))
+            self._records[key] = record
+
+        self._stack.append(record)
+        wall_time = time.time()
+        cpu_time = self.get_cpu_time()
+        try:
+            yield record
+        finally:
+            record.calls += 1
+            record.wall_time += time.time() - wall_time
+            record.cpu_time += self.get_cpu_time() - cpu_time
+            record.peak_rss_kb = self.get_peak_rss_kb()
+            self._stack.pop()
+
+
+    def merge(self, records):
+        """Merge the records of another PhaseTimings (e.g. of a worker
+        process) into the current phase."""
+        parent = self._stack[-1] if self._stack else None
+        for other in records:
+            partition = other.partition
+            if partition is None and parent is not None:
+                partition = parent.partition
+            key = (other.name, partition)
+            record = self._records.get(key)
+            if record is None:
+                record = PhaseRecord(other.name, partition,
+                                     len(self._stack) + other.depth)
+                self._records[key] = record
+            record.calls += other.calls
+            record.count += other.count
+            record.wall_time += other.wall_time
+            record.cpu_time += other.cpu_time
+            if other.peak_rss_kb is not None:
+                record.peak_rss_kb = max(record.peak_rss_kb or 0,
+                                         other.peak_rss_kb)
+
+
+    @property
+    def records(self):
+        return list(self._records.values())
+
+
+    def to_json(self):
+        return [record.to_json() for record in self._records.values()]
+
+
+    def dump(self, fp):
+        print('{:<40} {:>6} {:>8} {:>10} {:>10} {:>12}'.format(
+            'Phase', 'Calls', 'Items', 'Wall (s)', 'CPU (s)', 'Peak RSS (KB)'),
+              file=fp)
+        for record in self._records.values():
+            name = '  ' * record.depth + record.name
+            if record.partition:
+                name += ' (' + record.partition + ')'
+            print('{:<40} {:>6} {:>8} {:>10.3f} {:>10.3f} {:>12}'.format(
+                name, record.calls, record.count, record.wall_time,
+                record.cpu_time, record.peak_rss_kb or '-'), file=fp)
+
+
+# The phase timings of this process, which are reported with --profile or
+# --timings-json.
+_phase_timings = PhaseTimings()
+
+
+def timed_phase(name, partition=None):
+    """Record a phase in the phase timings of this process."""
+    return _phase_timings.phase(name, partition)
+
+
+#------------------------------------------------------------------------------
+# Symbol Set
+#------------------------------------------------------------------------------
+
+class SymbolTable(object):
+    """SymbolTable assigns a unique integer ID to each symbol name."""
+
+    def __init__(self):
+        self._ids = dict()
+        self.names = []
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def get_id(self, name):
+        """Get the ID of the symbol name.  Assign a new ID if the name was not
+        seen before."""
+        try:
+            return self._ids[name]
+        except KeyError:
+            symbol_id = len(self.names)
+            name = intern(name)
+            self._ids[name] = symbol_id
+            self.names.append(name)
+            return symbol_id
+
+
+    def find_id(self, name):
+        """Get the ID of the symbol name or None if the name was not seen
+        before."""
+        return self._ids.get(name)
+
+
+class SymbolSet(Set):
+    """SymbolSet is an immutable set of symbol names.  The symbol names are
+    stored as a sorted array of the IDs from the global SymbolTable, which
+    takes much less memory than a set of str.
+
+    SymbolSet supports the read-only set operations.  The operations with
+    another SymbolSet are computed with the IDs."""
+
+    __slots__ = ('ids',)
+
+    table = SymbolTable()
+
+
+    def __init__(self, symbols=()):
+        if isinstance(symbols, SymbolSet):
+            self.ids = symbols.ids
+            return
+        get_id = self.table.get_id
+        self.ids = array('I', sorted(set(get_id(name) for name in symbols)))
+
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Create a SymbolSet from an array('I') of sorted unique IDs."""
+        result = cls.__new__(cls)
+        result.ids = ids
+        return result
+
+
+    def __reduce__(self):
+        # Symbol IDs are only meaningful in this process.  Pickle the symbol
+        # names instead.
+        return (SymbolSet, (list(self),))
+
+
+    def __repr__(self):
+        # Represent as a set literal so that repr(ELF(...)) can be evaluated.
+        if not self.ids:
+            return 'set()'
+        return '{' + ', '.join(repr(name) for name in sorted(self)) + '}'
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def __iter__(self):
+        names = self.table.names
+        return (names[symbol_id] for symbol_id in self.ids)
+
+
+    def __contains__(self, name):
+        symbol_id = self.table.find_id(name)
+        return symbol_id is not None and self.contains_id(symbol_id)
+
+
+    def contains_id(self, symbol_id):
+        ids = self.ids
+        i = bisect.bisect_left(ids, symbol_id)
+        return i < len(ids) and ids[i] == symbol_id
+
+
+    def __eq__(self, other):
+        if isinstance(other, SymbolSet):
+            return self.ids == other.ids
+        return Set.__eq__(self, other)
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    __hash__ = None
+
+
+    def __le__(self, other):
+        if isinstance(other, SymbolSet):
+            return len(self) <= len(other) and \
+                    set(self.ids).issubset(other.ids)
+        return Set.__le__(self, other)
+
+
+    def __lt__(self, other):
+        return len(self) < len(other) and self <= other
+
+
+    def __ge__(self, other):
+        if isinstance(other, SymbolSet):
+            return other <= self
+        return Set.__ge__(self, other)
+
+
+    def __gt__(self, other):
+        return len(self) > len(other) and self >= other
+
+
+    def issubset(self, other):
+        return self <= (other if isinstance(other, Set) else set(other))
+
+
+    def issuperset(self, other):
+        return self >= (other if isinstance(other, Set) else set(other))
+
+
+    def difference(self, *others):
+        result = set(self)
+        result.difference_update(*others)
+        return result
+
+
 #------------------------------------------------------------------------------
 # ELF Parser
 #------------------------------------------------------------------------------
@@ -515,10 +998,15 @@ class ELF(object):
         return ELF._dict_find_key_by_value(ELF.ELF_MACHINES, name)
 
 
+    _FIELDS = ('ei_class', 'ei_data', 'e_machine', 'dt_rpath', 'dt_runpath',
+               'dt_needed', 'exported_symbols', 'imported_symbols',
+               'file_size', 'ro_seg_file_size', 'ro_seg_mem_size',
+               'rw_seg_file_size', 'rw_seg_mem_size',)
+
     __slots__ = ('ei_class', 'ei_data', 'e_machine', 'dt_rpath', 'dt_runpath',
-                 'dt_needed', 'exported_symbols', 'imported_symbols',
-                 'file_size', 'ro_seg_file_size', 'ro_seg_mem_size',
-                 'rw_seg_file_size', 'rw_seg_mem_size',)
+                 'dt_needed', '_exported_symbols', '_imported_symbols',
+                 '_lazy_symbols', 'file_size', 'ro_seg_file_size',
+                 'ro_seg_mem_size', 'rw_seg_file_size', 'rw_seg_mem_size',)
 
 
     def __init__(self, ei_class=ELFCLASSNONE, ei_data=ELFDATANONE, e_machine=0,
@@ -532,10 +1020,11 @@ class ELF(object):
         self.dt_rpath = dt_rpath if dt_rpath is not None else []
         self.dt_runpath = dt_runpath if dt_runpath is not None else []
         self.dt_needed = dt_needed if dt_needed is not None else []
-        self.exported_symbols = \
-            exported_symbols if exported_symbols is not None else set()
-        self.imported_symbols = \
-            imported_symbols if imported_symbols is not None else set()
+        self._lazy_symbols = None
+        self.exported_symbols = SymbolSet(
+            exported_symbols if exported_symbols is not None else ())
+        self.imported_symbols = SymbolSet(
+            imported_symbols if imported_symbols is not None else ())
         self.file_size = file_size
         self.ro_seg_file_size = ro_seg_file_size
         self.ro_seg_mem_size = ro_seg_mem_size
@@ -544,12 +1033,46 @@ class ELF(object):
 
 
     def __repr__(self):
-        args = (a + '=' + repr(getattr(self, a)) for a in self.__slots__)
+        args = (a + '=' + repr(getattr(self, a)) for a in self._FIELDS)
         return 'ELF(' + ', '.join(args) + ')'
 
 
     def __eq__(self, rhs):
-        return all(getattr(self, a) == getattr(rhs, a) for a in self.__slots__)
+        return all(getattr(self, a) == getattr(rhs, a) for a in self._FIELDS)
+
+
+    @property
+    def exported_symbols(self):
+        if self._lazy_symbols is not None:
+            self._load_lazy_symbols()
+        return self._exported_symbols
+
+
+    @exported_symbols.setter
+    def exported_symbols(self, symbols):
+        if self._lazy_symbols is not None:
+            self._load_lazy_symbols()
+        self._exported_symbols = SymbolSet(symbols)
+
+
+    @property
+    def imported_symbols(self):
+        if self._lazy_symbols is not None:
+            self._load_lazy_symbols()
+        return self._imported_symbols
+
+
+    @imported_symbols.setter
+    def imported_symbols(self, symbols):
+        if self._lazy_symbols is not None:
+            self._load_lazy_symbols()
+        self._imported_symbols = SymbolSet(symbols)
+
+
+    @property
+    def has_lazy_symbols(self):
+        """Whether the symbols have not been loaded from the file yet."""
+        return self._lazy_symbols is not None
 
 
     @property
@@ -632,8 +1155,148 @@ class ELF(object):
             return intern(self._extract_zero_terminated_buf_slice(buf, offset))
 
 
-    def _parse_from_buf_internal(self, buf):
-        """Parse ELF image resides in the buffer"""
+    def _get_elf_sym_fmt(self):
+        endian_fmt = '<' if self.ei_data == ELF.ELFDATA2LSB else '>'
+        if self.is_32bit:
+            return endian_fmt + 'LLLBBH'
+        return endian_fmt + 'LBBHQQ'
+
+
+    def _get_elf_sym_name_info_shndx_fmt(self):
+        """Get the format that only unpacks st_name, st_info, and st_shndx
+        from an Elf_Sym entry."""
+        endian_fmt = '<' if self.ei_data == ELF.ELFDATA2LSB else '>'
+        if self.is_32bit:
+            return endian_fmt + 'L8xBxH'
+        return endian_fmt + 'LBxH16x'
+
+
+    def _parse_dynsym(self, buf, dynsym_off, dynsym_end, dynsym_entsize,
+                      dynstr_off, dynstr_end):
+        """Parse exported and imported symbols in .dynsym section"""
+
+        # Skip first symbol entry (null symbol).
+        dynsym_off += dynsym_entsize
+
+        fmt = self._get_elf_sym_name_info_shndx_fmt()
+        if _struct_iter_unpack and dynsym_entsize == struct.calcsize(fmt):
+            exp_symbols, imp_symbols = self._parse_dynsym_bulk(
+                buf, fmt, dynsym_off, dynsym_end, dynsym_entsize, dynstr_off,
+                dynstr_end)
+        else:
+            exp_symbols, imp_symbols = self._parse_dynsym_per_entry(
+                buf, dynsym_off, dynsym_end, dynsym_entsize, dynstr_off)
+
+        self._exported_symbols = SymbolSet(exp_symbols)
+        self._imported_symbols = SymbolSet(imp_symbols)
+
+
+    def _parse_dynsym_bulk(self, buf, fmt, dynsym_off, dynsym_end,
+                           dynsym_entsize, dynstr_off, dynstr_end):
+        """Decode all .dynsym entries at once with struct.iter_unpack() and
+        slice the names from a copy of .dynstr section."""
+        num_entries = max(0, (dynsym_end - dynsym_off) // dynsym_entsize)
+        dynsym = buf[dynsym_off:dynsym_off + num_entries * dynsym_entsize]
+        if len(dynsym) != num_entries * dynsym_entsize:
+            raise ELFError('bad elf sym')
+
+        entries = list(_struct_iter_unpack(fmt, dynsym))
+        if not entries:
+            return ((), ())
+
+        # Classify the entries by columns: undefined symbols are imported and
+        # non-local defined symbols are exported.
+        st_names, st_infos, st_shndxs = zip(*entries)
+        is_imported = [shndx == Elf_Sym.SHN_UNDEF for shndx in st_shndxs]
+        is_exported = [not imported and (info >> 4) != Elf_Sym.STB_LOCAL
+                       for imported, info in zip(is_imported, st_infos)]
+
+        dynstr = buf[dynstr_off:dynstr_end]
+
+        # Decode .dynstr once if it is an ASCII string (the common case), so
+        # that byte offsets are also string indices.
+        try:
+            dynstr = dynstr.decode('ascii')
+            nul = '\0'
+            decode = None
+        except UnicodeDecodeError:
+            nul = b'\0'
+            decode = lambda name: name.decode('utf-8')
+
+        find = dynstr.find
+        extract_str = self._extract_zero_terminated_str
+
+        def extract_name(offset):
+            end = find(nul, offset)
+            if end < 0:
+                # The name is not terminated in .dynstr section (or st_name is
+                # out of range), thus read it like _parse_dynsym_per_entry().
+                return extract_str(buf, dynstr_off + offset)
+            name = dynstr[offset:end]
+            return name if decode is None else decode(name)
+
+        def extract_names(offsets):
+            return [extract_name(offset) for offset in offsets]
+
+        exp_symbols = extract_names(itertools.compress(st_names, is_exported))
+        imp_symbols = extract_names(itertools.compress(st_names, is_imported))
+        return (exp_symbols, imp_symbols)
+
+
+    def _parse_dynsym_per_entry(self, buf, dynsym_off, dynsym_end,
+                                dynsym_entsize, dynstr_off):
+        """Decode .dynsym entries one by one."""
+        elf_sym_fmt = self._get_elf_sym_fmt()
+
+        if self.is_32bit:
+            def parse_elf_sym(offset):
+                try:
+                    return Elf_Sym._make(
+                        struct.unpack_from(elf_sym_fmt, buf, offset))
+                except struct.error:
+                    raise ELFError('bad elf sym')
+        else:
+            def parse_elf_sym(offset):
+                try:
+                    p = struct.unpack_from(elf_sym_fmt, buf, offset)
+                    return Elf_Sym(p[0], p[4], p[5], p[1], p[2], p[3])
+                except struct.error:
+                    raise ELFError('bad elf sym')
+
+        exp_symbols = set()
+        imp_symbols = set()
+
+        for ent_off in range(dynsym_off, dynsym_end, dynsym_entsize):
+            ent = parse_elf_sym(ent_off)
+            symbol_name = self._extract_zero_terminated_str(
+                buf, dynstr_off + ent.st_name)
+            if ent.is_undef:
+                imp_symbols.add(symbol_name)
+            elif not ent.is_local:
+                exp_symbols.add(symbol_name)
+
+        return (exp_symbols, imp_symbols)
+
+
+    def _load_lazy_symbols(self):
+        """Load the symbols which were skipped by a lazy parse"""
+        path = self._lazy_symbols[0]
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size != self.file_size:
+                raise ELFError('file changed: ' + path)
+            with mmap(f.fileno(), st.st_size, access=ACCESS_READ) as image:
+                try:
+                    self._parse_dynsym(image, *self._lazy_symbols[1:])
+                except IndexError:
+                    raise ELFError('bad offset')
+        self._lazy_symbols = None
+
+
+    def _parse_from_buf_internal(self, buf, lazy_symbols=False):
+        """Parse ELF image resides in the buffer.  If lazy_symbols is true,
+        the location of .dynsym section is kept in self._lazy_symbols instead of
+        the parsed symbols."""
 
         # Check ELF ident.
         if len(buf) < 8:
@@ -660,13 +1323,11 @@ class ELF(object):
             elf_shdr_fmt = endian_fmt + 'LLLLLLLLLL'
             elf_phdr_fmt = endian_fmt + 'LLLLLLLL'
             elf_dyn_fmt = endian_fmt + 'lL'
-            elf_sym_fmt = endian_fmt + 'LLLBBH'
         else:
             elf_hdr_fmt = endian_fmt + '4x4B8xHHLQQQLHHHHHH'
             elf_shdr_fmt = endian_fmt + 'LLQQQQLLQQ'
             elf_phdr_fmt = endian_fmt + 'LLQQQQQQ'
             elf_dyn_fmt = endian_fmt + 'QQ'
-            elf_sym_fmt = endian_fmt + 'LBBHQQ'
 
         def parse_struct(cls, fmt, offset, error_msg):
             try:
@@ -698,18 +1359,6 @@ class ELF(object):
             return parse_struct(Elf_Dyn, elf_dyn_fmt, offset,
                                 'bad .dynamic entry')
 
-        if self.is_32bit:
-            def parse_elf_sym(offset):
-                return parse_struct(
-                    Elf_Sym, elf_sym_fmt, offset, 'bad elf sym')
-        else:
-            def parse_elf_sym(offset):
-                try:
-                    p = struct.unpack_from(elf_sym_fmt, buf, offset)
-                    return Elf_Sym(p[0], p[4], p[5], p[1], p[2], p[3])
-                except struct.error:
-                    raise ELFError('bad elf sym')
-
         def extract_str(offset):
             return self._extract_zero_terminated_str(buf, offset)
 
@@ -773,6 +1422,7 @@ class ELF(object):
 
         dynamic_off = dynamic_shdr.sh_offset
         dynstr_off = dynstr_shdr.sh_offset
+        dynstr_end = dynstr_off + dynstr_shdr.sh_size
 
         # Parse entries in .dynamic section.
         assert struct.calcsize(elf_dyn_fmt) == dynamic_shdr.sh_entsize
@@ -792,45 +1442,41 @@ class ELF(object):
         # Parse exported symbols in .dynsym section.
         dynsym_shdr = sections.get('.dynsym')
         if dynsym_shdr:
-            exp_symbols = self.exported_symbols
-            imp_symbols = self.imported_symbols
-
             dynsym_off = dynsym_shdr.sh_offset
             dynsym_end = dynsym_off + dynsym_shdr.sh_size
             dynsym_entsize = dynsym_shdr.sh_entsize
-
-            # Skip first symbol entry (null symbol).
-            dynsym_off += dynsym_entsize
-
-            for ent_off in range(dynsym_off, dynsym_end, dynsym_entsize):
-                ent = parse_elf_sym(ent_off)
-                symbol_name = extract_str(dynstr_off + ent.st_name)
-                if ent.is_undef:
-                    imp_symbols.add(symbol_name)
-                elif not ent.is_local:
-                    exp_symbols.add(symbol_name)
+            dynsym_range = (dynsym_off, dynsym_end, dynsym_entsize,
+                            dynstr_off, dynstr_end)
+            if lazy_symbols:
+                self._lazy_symbols = dynsym_range
+            else:
+                self._parse_dynsym(buf, *dynsym_range)
 
 
-    def _parse_from_buf(self, buf):
+    def _parse_from_buf(self, buf, lazy_symbols=False):
         """Parse ELF image resides in the buffer"""
         try:
-            self._parse_from_buf_internal(buf)
+            self._parse_from_buf_internal(buf, lazy_symbols)
         except IndexError:
             raise ELFError('bad offset')
 
 
-    def _parse_from_file(self, path):
+    def _parse_from_file(self, path, lazy_symbols=False):
         """Parse ELF image from the file path"""
         with open(path, 'rb') as f:
             st = os.fstat(f.fileno())
             if not st.st_size:
                 raise ELFError('empty file')
             with mmap(f.fileno(), st.st_size, access=ACCESS_READ) as image:
-                self._parse_from_buf(image)
+                self._parse_from_buf(image, lazy_symbols)
+        if self._lazy_symbols is not None:
+            self._lazy_symbols = (path,) + self._lazy_symbols
 
 
     def _parse_from_dump_lines(self, path, lines):
         patt = re.compile('^([A-Za-z_]+)\t+(.*)$')
+        exported_symbols = set(self.exported_symbols)
+        imported_symbols = set(self.imported_symbols)
         for line_no, line in enumerate(lines):
             match = patt.match(line)
             if not match:
@@ -863,13 +1509,16 @@ class ELF(object):
             elif key == 'DT_NEEDED':
                 self.dt_needed.append(intern(value))
             elif key == 'EXP_SYMBOL':
-                self.exported_symbols.add(intern(value))
+                exported_symbols.add(value)
             elif key == 'IMP_SYMBOL':
-                self.imported_symbols.add(intern(value))
+                imported_symbols.add(value)
             else:
                 print('error: {}: {}: unknown tag name: {}'
                       .format(path, line_no + 1, key), file=sys.stderr)
 
+        self.exported_symbols = SymbolSet(exported_symbols)
+        self.imported_symbols = SymbolSet(imported_symbols)
+
 
     def _parse_from_dump_file(self, path):
         """Load information from ELF dump file."""
@@ -884,10 +1533,11 @@ class ELF(object):
 
 
     @staticmethod
-    def load(path):
-        """Create an ELF instance from the file path"""
+    def load(path, lazy_symbols=False):
+        """Create an ELF instance from the file path.  If lazy_symbols is
+        true, .dynsym section is not parsed until the symbols are accessed."""
         elf = ELF()
-        elf._parse_from_file(path)
+        elf._parse_from_file(path, lazy_symbols)
         return elf
 
 
@@ -994,9 +1644,14 @@ class DexFileReader(object):
             yield 'classes{}.dex'.format(i)
 
 
+    # The number of string_ids entries which are loaded at once.
+    _STRING_IDS_CHUNK_SIZE = 16384
+
+
     @classmethod
-    def enumerate_dex_strings_buf(cls, buf, offset=0, data_offset=None):
-        buf = get_py3_bytes(buf)
+    def _enumerate_dex_string_data_offsets(cls, buf, offset, data_offset):
+        """Enumerate the offsets of the string_data_item of the dex file at the
+        offset in buf.  The string_ids table is loaded in chunks."""
         header = cls.Header.unpack_from(buf, offset=offset)
 
         if data_offset is None:
@@ -1009,16 +1664,25 @@ class DexFileReader(object):
                 # of the dex header and header.data_off.
                 data_offset = offset + header.data_off
 
-        StringId = cls.StringId
-        struct_size = StringId.struct_size
-
         offset_start = offset + header.string_ids_off
-        offset_end = offset_start + header.string_ids_size * struct_size
+        offset_end = offset_start + header.string_ids_size * \
+                cls.StringId.struct_size
+        if offset_end > len(buf):
+            raise ValueError('bad string_ids offset {}'.format(offset_start))
 
-        for offset in range(offset_start, offset_end, struct_size):
-            offset = StringId.unpack_from(buf, offset).string_data_off
-            offset += data_offset
+        chunk_size = cls._STRING_IDS_CHUNK_SIZE * cls.StringId.struct_size
+        for chunk_start in range(offset_start, offset_end, chunk_size):
+            chunk_end = min(chunk_start + chunk_size, offset_end)
+            for string_data_off in load_le_uint32_array(buf, chunk_start,
+                                                        chunk_end):
+                yield data_offset + string_data_off
 
+
+    @classmethod
+    def enumerate_dex_strings_buf(cls, buf, offset=0, data_offset=None):
+        buf = get_py3_bytes(buf)
+        for offset in cls._enumerate_dex_string_data_offsets(
+                buf, offset, data_offset):
             # Skip the ULEB128 integer for UTF-16 string length
             offset += cls.extract_uleb128(buf, offset)[1]
 
@@ -1026,17 +1690,77 @@ class DexFileReader(object):
             yield cls.extract_dex_string(buf, offset)
 
 
+    @classmethod
+    def find_dex_strings_buf(cls, buf, strings, lengths, offset=0,
+                             data_offset=None):
+        """Find the MUTF-8 encoded strings in the dex file at the offset in buf.
+        lengths is the set of the UTF-16 lengths of the strings, so that the
+        strings with other lengths are skipped without being extracted.  buf
+        must return integers for indices (e.g. the result of get_py3_bytes() or
+        an mmap)."""
+        for offset in cls._enumerate_dex_string_data_offsets(
+                buf, offset, data_offset):
+            length = buf[offset]
+            if length & 0x80:
+                length, num_bytes = cls.extract_uleb128(buf, offset)
+            else:
+                num_bytes = 1
+            if length not in lengths:
+                continue
+            string = bytes(cls.extract_dex_string(buf, offset + num_bytes))
+            if string in strings:
+                yield string
+
+
+    @classmethod
+    def _enumerate_apk_dex_infos(cls, zip_file):
+        for name in cls.generate_classes_dex_names():
+            try:
+                yield zip_file.getinfo(name)
+            except KeyError:
+                break
+
+
+    @staticmethod
+    def _load_zip_member(fp, zip_file, info):
+        """Load a zip member and return a (buf, offset) pair, where offset is
+        the offset of the member data in buf.  STORED members are mapped from
+        the archive without being copied.  The caller must close buf if it is
+        an mmap."""
+        if info.compress_type == zipfile.ZIP_STORED and \
+                not info.flag_bits & 0x1 and info.file_size:
+            data_offset = _get_zip_member_data_offset(fp, info)
+            if data_offset is not None:
+                map_offset = data_offset - data_offset % ALLOCATIONGRANULARITY
+                offset = data_offset - map_offset
+                buf = mmap(fp.fileno(), offset + info.file_size,
+                           access=ACCESS_READ, offset=map_offset)
+                return (buf, offset)
+
+        with zip_file.open(info, 'r') as member:
+            return (get_py3_bytes(member.read()), 0)
+
+
+    @classmethod
+    def _enumerate_apk_dex_bufs(cls, fp, zip_file):
+        """Enumerate the (buf, offset) pairs of the dex files in the APK.  The
+        buf is only valid until the next pair is generated."""
+        for info in cls._enumerate_apk_dex_infos(zip_file):
+            buf, offset = cls._load_zip_member(fp, zip_file, info)
+            try:
+                yield (buf, offset)
+            finally:
+                if isinstance(buf, mmap):
+                    buf.close()
+
+
     @classmethod
     def enumerate_dex_strings_apk(cls, apk_file_path):
-        with zipfile.ZipFile(apk_file_path, 'r') as zip_file:
-            for name in cls.generate_classes_dex_names():
-                try:
-                    with zip_file.open(name) as dex_file:
-                        dex_file_content = dex_file.read()
-                    for s in cls.enumerate_dex_strings_buf(dex_file_content):
+        with open(apk_file_path, 'rb') as fp:
+            with zipfile.ZipFile(fp, 'r') as zip_file:
+                for buf, offset in cls._enumerate_apk_dex_bufs(fp, zip_file):
+                    for s in cls.enumerate_dex_strings_buf(buf, offset):
                         yield s
-                except KeyError:
-                    break
 
 
     @classmethod
@@ -1095,9 +1819,8 @@ class DexFileReader(object):
 
 
     @classmethod
-    def enumerate_dex_strings_vdex_buf(cls, buf):
-        buf = get_py3_bytes(buf)
-
+    def _enumerate_vdex_dex_offsets(cls, buf):
+        """Enumerate the offsets of the dex files in the vdex file in buf."""
         magic, version = struct.unpack_from('4s4s', buf)
 
         # Check the vdex file magic word
@@ -1153,20 +1876,77 @@ class DexFileReader(object):
 
             dex_header = cls.Header.unpack_from(buf, offset)
             dex_file_end = offset + dex_header.file_size
-            for s in cls.enumerate_dex_strings_buf(buf, offset):
-                yield s
+            yield offset
 
             # Align to the end of the dex file
             offset = (dex_file_end + 3) // 4 * 4
 
 
     @classmethod
-    def enumerate_dex_strings_vdex(cls, vdex_file_path):
-        with open(vdex_file_path, 'rb') as vdex_file:
-            return cls.enumerate_dex_strings_vdex_buf(vdex_file.read())
+    def enumerate_dex_strings_vdex_buf(cls, buf):
+        buf = get_py3_bytes(buf)
+        for offset in cls._enumerate_vdex_dex_offsets(buf):
+            for s in cls.enumerate_dex_strings_buf(buf, offset):
+                yield s
 
 
-    @classmethod
+    @staticmethod
+    def _map_vdex_file(vdex_file):
+        st = os.fstat(vdex_file.fileno())
+        if not st.st_size:
+            raise ValueError('empty vdex file')
+        return mmap(vdex_file.fileno(), st.st_size, access=ACCESS_READ)
+
+
+    @classmethod
+    def enumerate_dex_strings_vdex(cls, vdex_file_path):
+        with open(vdex_file_path, 'rb') as vdex_file:
+            with cls._map_vdex_file(vdex_file) as buf:
+                for s in cls.enumerate_dex_strings_vdex_buf(buf):
+                    yield s
+
+
+    @classmethod
+    def _find_dex_strings_apk(cls, apk_file_path, strings, lengths, required):
+        with open(apk_file_path, 'rb') as fp:
+            with zipfile.ZipFile(fp, 'r') as zip_file:
+                dex_bufs = []
+                try:
+                    for info in cls._enumerate_apk_dex_infos(zip_file):
+                        dex_bufs.append(
+                            cls._load_zip_member(fp, zip_file, info))
+
+                    if required and all(buf.find(required, offset) == -1
+                                         for buf, offset in dex_bufs):
+                        return set()
+
+                    result = set()
+                    for buf, offset in dex_bufs:
+                        result.update(cls.find_dex_strings_buf(
+                            buf, strings, lengths, offset))
+                    return result
+                finally:
+                    for buf, _ in dex_bufs:
+                        if isinstance(buf, mmap):
+                            buf.close()
+
+
+    @classmethod
+    def _find_dex_strings_vdex(cls, vdex_file_path, strings, lengths,
+                               required):
+        with open(vdex_file_path, 'rb') as vdex_file:
+            with cls._map_vdex_file(vdex_file) as buf:
+                if required and buf.find(required) == -1:
+                    return set()
+
+                result = set()
+                for offset in cls._enumerate_vdex_dex_offsets(buf):
+                    result.update(cls.find_dex_strings_buf(
+                        buf, strings, lengths, offset))
+                return result
+
+
+    @classmethod
     def enumerate_dex_strings(cls, path):
         if is_zipfile(path):
             return DexFileReader.enumerate_dex_strings_apk(path)
@@ -1175,6 +1955,359 @@ class DexFileReader(object):
         return None
 
 
+    @staticmethod
+    def get_mutf8_utf16_length(string):
+        """Get the UTF-16 length of a MUTF-8 encoded string."""
+        return sum(1 for byte in bytearray(string) if (byte & 0xc0) != 0x80)
+
+
+    @classmethod
+    def find_dex_strings(cls, path, strings, required=None):
+        """Find the MUTF-8 encoded strings in the dex files in the APK or vdex
+        file at the path.  If required is specified and it does not occur in
+        the raw dex data, an empty set is returned without parsing the dex
+        files.  Return None if the path is neither an APK nor a vdex file."""
+        lengths = set(cls.get_mutf8_utf16_length(string)
+                      for string in strings)
+        if is_zipfile(path):
+            return cls._find_dex_strings_apk(path, strings, lengths, required)
+        if cls.is_vdex_file(path):
+            return cls._find_dex_strings_vdex(path, strings, lengths, required)
+        return None
+
+
+#------------------------------------------------------------------------------
+# Ext4 Image Reader
+#------------------------------------------------------------------------------
+
+class Ext4Error(ValueError):
+    pass
+
+
+Ext4Inode = collections.namedtuple('Ext4Inode', 'ino mode flags size block')
+
+
+class Ext4Image(object):
+    """Ext4Image reads the directories and the regular files in a raw ext4
+    image without mounting the image or dumping it with debugfs.  Ext4Error is
+    raised if the image uses the incompatible features which are not supported
+    (e.g. inline data, encryption, or meta block groups)."""
+
+    SUPERBLOCK_OFFSET = 1024
+
+    MAGIC = 0xef53
+
+    ROOT_INO = 2
+
+    INCOMPAT_FILETYPE = 0x2
+    INCOMPAT_RECOVER = 0x4
+    INCOMPAT_EXTENTS = 0x40
+    INCOMPAT_64BIT = 0x80
+    INCOMPAT_MMP = 0x100
+    INCOMPAT_FLEX_BG = 0x200
+    INCOMPAT_EA_INODE = 0x400
+    INCOMPAT_CSUM_SEED = 0x2000
+    INCOMPAT_LARGEDIR = 0x4000
+
+    SUPPORTED_INCOMPAT = (
+        INCOMPAT_FILETYPE | INCOMPAT_RECOVER | INCOMPAT_EXTENTS |
+        INCOMPAT_64BIT | INCOMPAT_MMP | INCOMPAT_FLEX_BG | INCOMPAT_EA_INODE |
+        INCOMPAT_CSUM_SEED | INCOMPAT_LARGEDIR)
+
+    EXTENTS_FL = 0x80000
+    INLINE_DATA_FL = 0x10000000
+
+    EXTENT_MAGIC = 0xf30a
+    EXTENT_INIT_MAX_LEN = 32768
+
+    MAX_SYMLINK_HOPS = 8
+
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < self.SUPERBLOCK_OFFSET * 2:
+                raise Ext4Error('image too small')
+            self._buf = mmap(self._file.fileno(), size, access=ACCESS_READ)
+            try:
+                self._parse_superblock()
+            except BaseException:
+                self._buf.close()
+                raise
+        except BaseException:
+            self._file.close()
+            raise
+
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc, value, tb):
+        self.close()
+
+
+    def _unpack(self, fmt, offset=0, buf=None):
+        """Unpack the little-endian fields at the offset of buf (the image by
+        default).  Raise Ext4Error if buf is too short."""
+        try:
+            return struct.unpack_from(
+                '<' + fmt, self._buf if buf is None else buf, offset)
+        except struct.error:
+            raise Ext4Error('bad offset')
+
+
+    def _parse_superblock(self):
+        offset = self.SUPERBLOCK_OFFSET
+
+        magic, = self._unpack('H', offset + 0x38)
+        if magic != self.MAGIC:
+            raise Ext4Error('bad magic')
+
+        incompat, = self._unpack('I', offset + 0x60)
+        if incompat & ~self.SUPPORTED_INCOMPAT:
+            raise Ext4Error('unsupported features: 0x{:x}'.format(
+                incompat & ~self.SUPPORTED_INCOMPAT))
+        self._has_file_type = bool(incompat & self.INCOMPAT_FILETYPE)
+
+        self.first_data_block, log_block_size = \
+            self._unpack('II', offset + 0x14)
+        self.inodes_per_group, = self._unpack('I', offset + 0x28)
+        self.inodes_count, = self._unpack('I', offset)
+        self.block_size = 1024 << log_block_size
+
+        rev_level, = self._unpack('I', offset + 0x4c)
+        self.inode_size = self._unpack('H', offset + 0x58)[0] \
+            if rev_level >= 1 else 128
+
+        self.desc_size = 32
+        if incompat & self.INCOMPAT_64BIT:
+            self.desc_size = max(32, self._unpack('H', offset + 0xfe)[0])
+
+        if self.inodes_per_group == 0 or self.inode_size < 128:
+            raise Ext4Error('bad superblock')
+
+
+    def _get_block_offset(self, block, size=None):
+        offset = block * self.block_size
+        if offset + (self.block_size if size is None else size) > \
+                len(self._buf):
+            raise Ext4Error('bad block number: {}'.format(block))
+        return offset
+
+
+    def _read_block(self, block):
+        offset = self._get_block_offset(block)
+        return self._buf[offset:offset + self.block_size]
+
+
+    def get_inode(self, ino):
+        """Read the inode with the inode number."""
+        if not 1 <= ino <= self.inodes_count:
+            raise Ext4Error('bad inode number: {}'.format(ino))
+        group, index = divmod(ino - 1, self.inodes_per_group)
+
+        # Find the inode table from the group descriptor.
+        desc_offset = \
+            (self.first_data_block + 1) * self.block_size + \
+            group * self.desc_size
+        inode_table, = self._unpack('I', desc_offset + 0x8)
+        if self.desc_size >= 64:
+            inode_table |= self._unpack('I', desc_offset + 0x28)[0] << 32
+
+        offset = self._get_block_offset(inode_table) + index * self.inode_size
+        mode, size_lo = self._unpack('HxxI', offset)
+        flags, = self._unpack('I', offset + 0x20)
+        block, = self._unpack('60s', offset + 0x28)
+        size_hi, = self._unpack('I', offset + 0x6c)
+        return Ext4Inode(ino, mode, flags, size_lo | (size_hi << 32), block)
+
+
+    def _iter_extent_tree(self, buf, depth=None):
+        magic, num_entries, _, tree_depth = self._unpack('HHHH', buf=buf)
+        if magic != self.EXTENT_MAGIC or \
+                (depth is not None and tree_depth != depth):
+            raise Ext4Error('bad extent header')
+
+        for offset in range(12, 12 + num_entries * 12, 12):
+            if tree_depth == 0:
+                logical, length, start_hi, start_lo = \
+                    self._unpack('IHHI', offset, buf)
+                initialized = length <= self.EXTENT_INIT_MAX_LEN
+                if not initialized:
+                    length -= self.EXTENT_INIT_MAX_LEN
+                yield (logical, (start_hi << 32) | start_lo, length,
+                       initialized)
+            else:
+                _, leaf_lo, leaf_hi = self._unpack('IIH', offset, buf)
+                leaf = self._read_block((leaf_hi << 32) | leaf_lo)
+                for extent in self._iter_extent_tree(leaf, tree_depth - 1):
+                    yield extent
+
+
+    def _iter_block_map(self, buf, num_blocks):
+        """Iterate the blocks in the direct and indirect block maps of the
+        inodes without extents."""
+        num_ptrs = self.block_size // 4
+
+        def iter_blocks(ptr, level, logical):
+            if ptr == 0:
+                return
+            if level == 0:
+                yield (logical, ptr, 1, True)
+                return
+            span = num_ptrs ** (level - 1)
+            ptrs = self._unpack('{}I'.format(num_ptrs),
+                                buf=self._read_block(ptr))
+            for i, child in enumerate(ptrs):
+                if logical + i * span >= num_blocks:
+                    break
+                for extent in iter_blocks(child, level - 1,
+                                          logical + i * span):
+                    yield extent
+
+        ptrs = self._unpack('15I', buf=buf)
+        logical = 0
+        for ptr, level in zip(ptrs, [0] * 12 + [1, 2, 3]):
+            if logical >= num_blocks:
+                break
+            for extent in iter_blocks(ptr, level, logical):
+                yield extent
+            logical += num_ptrs ** level
+
+
+    def _iter_extents(self, inode):
+        """Iterate the (logical block, physical block, length, initialized)
+        tuples of the inode."""
+        if inode.flags & self.INLINE_DATA_FL:
+            raise Ext4Error('inline data is not supported')
+        if inode.flags & self.EXTENTS_FL:
+            return self._iter_extent_tree(inode.block)
+        num_blocks = (inode.size + self.block_size - 1) // self.block_size
+        return self._iter_block_map(inode.block, num_blocks)
+
+
+    def read(self, inode, size=None):
+        """Read the contents of the regular file or the directory.  If size is
+        specified, at most size bytes are read from the beginning."""
+        size = inode.size if size is None else min(size, inode.size)
+        data = bytearray(size)
+        for logical, physical, length, initialized in \
+                self._iter_extents(inode):
+            start = logical * self.block_size
+            if start >= size or not initialized:
+                continue
+            end = min(size, start + length * self.block_size)
+            offset = self._get_block_offset(physical, end - start)
+            data[start:end] = self._buf[offset:offset + end - start]
+        return bytes(data)
+
+
+    @contextlib.contextmanager
+    def open_buf(self, inode):
+        """Get a buffer with the contents of the regular file.  The file is
+        mapped from the image if the contents are stored in one extent which is
+        aligned to the mmap() granularity.  Otherwise, the contents are read
+        into a bytes object."""
+        if inode.size > 0 and inode.flags & self.EXTENTS_FL:
+            extents = list(self._iter_extents(inode))
+            if len(extents) == 1:
+                logical, physical, length, initialized = extents[0]
+                offset = self._get_block_offset(physical, inode.size)
+                if logical == 0 and initialized and \
+                        length * self.block_size >= inode.size and \
+                        offset % ALLOCATIONGRANULARITY == 0:
+                    with mmap(self._file.fileno(), inode.size,
+                              access=ACCESS_READ, offset=offset) as buf:
+                        yield buf
+                    return
+        yield self.read(inode)
+
+
+    def iterdir(self, inode):
+        """Iterate the (name, inode number) pairs of the directory except . and
+        .. entries."""
+        buf = self.read(inode)
+        offset = 0
+        while offset + 8 <= len(buf):
+            ino, rec_len, name_len = self._unpack('IHH', offset, buf)
+            if self._has_file_type:
+                name_len &= 0xff
+            if rec_len < 8:
+                raise Ext4Error('bad directory entry')
+            # The entries with zero inode numbers are unused entries or the
+            # checksum tails of metadata_csum.
+            if ino != 0:
+                if offset + 8 + name_len > len(buf):
+                    raise Ext4Error('bad directory entry')
+                name = buf[offset + 8:offset + 8 + name_len]
+                if name != b'.' and name != b'..':
+                    yield (fsdecode(name), ino)
+            offset += rec_len
+
+
+    def walk(self):
+        """Iterate the (path, inode) pairs of the regular files, where path is
+        relative to the root directory.  The symbolic links with relative
+        targets are resolved, so that the regular files are iterated with the
+        paths of the symbolic links as well."""
+        files = dict()
+        symlinks = []
+
+        # A directory can only be reached once unless the image is corrupted,
+        # e.g. a directory entry links to an ancestor.
+        visited_dirs = {self.ROOT_INO}
+
+        stack = [('', self.get_inode(self.ROOT_INO))]
+        while stack:
+            dir_path, dir_inode = stack.pop()
+            for name, ino in self.iterdir(dir_inode):
+                path = posixpath.join(dir_path, name)
+                inode = self.get_inode(ino)
+                if stat.S_ISDIR(inode.mode):
+                    if ino in visited_dirs:
+                        raise Ext4Error('directory loop: ' + path)
+                    visited_dirs.add(ino)
+                    stack.append((path, inode))
+                elif stat.S_ISREG(inode.mode):
+                    files[path] = inode
+                    yield (path, inode)
+                elif stat.S_ISLNK(inode.mode):
+                    symlinks.append((path, inode))
+
+        # Resolve the symbolic links.
+        targets = dict()
+        for path, inode in symlinks:
+            target = self._read_symlink(inode)
+            if not target.startswith('/'):
+                target = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(path), target))
+                targets[path] = target
+
+        for path, target in targets.items():
+            for _ in range(self.MAX_SYMLINK_HOPS):
+                if target not in targets:
+                    break
+                target = targets[target]
+            inode = files.get(target)
+            if inode is not None:
+                yield (path, inode)
+
+
+    def _read_symlink(self, inode):
+        # The targets shorter than 60 bytes are stored in the block map.
+        if inode.size < 60 and \
+                not inode.flags & (self.EXTENTS_FL | self.INLINE_DATA_FL):
+            return fsdecode(inode.block[0:inode.size])
+        return fsdecode(self.read(inode))
+
+
 #------------------------------------------------------------------------------
 # TaggedDict
 #------------------------------------------------------------------------------
@@ -1273,6 +2406,8 @@ class TaggedDict(object):
         for tag in self.TAGS:
             setattr(self, tag, set())
         self._regex_patterns = []
+        self._compiled_regex = None
+        self._path_tag_bits = dict()
 
         if vndk_lib_dirs is None:
             self._vndk_suffixes = ['']
@@ -1285,10 +2420,104 @@ class TaggedDict(object):
         lib_set = getattr(self, tag)
         lib_set.add(lib)
         self._path_tag[lib] = tag
+        self._path_tag_bits.clear()
 
 
     def add_regex(self, tag, pattern):
         self._regex_patterns.append((re.compile(pattern), tag))
+        self._compiled_regex = None
+        self._path_tag_bits.clear()
+
+
+    _REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+    @classmethod
+    def _get_regex_literal_prefix(cls, pattern):
+        """Get the literal string that all strings matched by the pattern start
+        with."""
+        if '|' in pattern:
+            return ''
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+        prefix = []
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if char == '\\':
+                if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                    break
+                char = pattern[i + 1]
+                i += 2
+            elif char in cls._REGEX_SPECIAL_CHARS:
+                break
+            else:
+                i += 1
+            if i < len(pattern) and pattern[i] in '*?{':
+                # The last char is optional or repeated.
+                break
+            prefix.append(char)
+        return ''.join(prefix)
+
+
+    @staticmethod
+    def _compile_regex_alternation(patterns):
+        """Compile the (index, pattern) pairs into an alternation with a named
+        group for each pattern.  The alternatives are tried in order, thus
+        the first matching pattern wins.  Return None if the patterns cannot
+        be combined, e.g. they have groups or inline flags."""
+        default_flags = re.compile('').flags
+        if len(patterns) < 2 or any(pattern.groups or
+                                    pattern.flags != default_flags
+                                    for i, pattern in patterns):
+            return None
+        try:
+            return re.compile('|'.join(
+                '(?P<_{}>{})'.format(i, pattern.pattern)
+                for i, pattern in patterns))
+        except (re.error, AssertionError, OverflowError):
+            # Python 2 only supports 100 named groups.
+            return None
+
+
+    def _compile_regex(self):
+        """Group the regex patterns by their literal prefixes, so that only the
+        patterns whose prefixes match a path are tried.  Return a list of
+        prefix lengths and a dict that maps prefixes to (alternation,
+        patterns) pairs."""
+        groups = collections.defaultdict(list)
+        for i, (pattern, tag) in enumerate(self._regex_patterns):
+            prefix = self._get_regex_literal_prefix(pattern.pattern)
+            groups[prefix].append((i, pattern))
+        prefixes = dict(
+            (prefix, (self._compile_regex_alternation(patterns), patterns))
+            for prefix, patterns in groups.items())
+        return (sorted(set(len(prefix) for prefix in prefixes)), prefixes)
+
+
+    def _get_regex_tag(self, lib):
+        if self._compiled_regex is None:
+            self._compiled_regex = self._compile_regex()
+        prefix_lens, prefixes = self._compiled_regex
+
+        # Find the first matching pattern among the groups whose prefixes
+        # match lib.
+        result = None
+        for prefix_len in prefix_lens:
+            group = prefixes.get(lib[:prefix_len])
+            if not group:
+                continue
+            alternation, patterns = group
+            if alternation:
+                match = alternation.match(lib)
+                index = int(match.lastgroup[1:]) if match else None
+            else:
+                index = next((i for i, pattern in patterns
+                              if pattern.match(lib)), None)
+            if index is not None and (result is None or index < result):
+                result = index
+
+        return self._regex_patterns[result][1] if result is not None else None
 
 
     def get_path_tag(self, lib):
@@ -1297,8 +2526,9 @@ class TaggedDict(object):
         except KeyError:
             pass
 
-        for pattern, tag in self._regex_patterns:
-            if pattern.match(lib):
+        if self._regex_patterns:
+            tag = self._get_regex_tag(lib)
+            if tag is not None:
                 return tag
 
         return self.get_path_tag_default(lib)
@@ -1309,7 +2539,12 @@ class TaggedDict(object):
 
 
     def get_path_tag_bit(self, lib):
-        return self.TAGS[self.get_path_tag(lib)]
+        try:
+            return self._path_tag_bits[lib]
+        except KeyError:
+            tag_bit = self._path_tag_bits[lib] = \
+                self.TAGS[self.get_path_tag(lib)]
+            return tag_bit
 
 
     def is_path_visible(self, from_lib, to_lib):
@@ -1521,12 +2756,64 @@ def is_zipfile(path):
     return zipfile.is_zipfile(path)
 
 
-def scan_zip_file(zip_file_path):
-    """Scan all ELF files in a zip archive."""
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_file:
-        for name in zip_file.namelist():
-            yield (os.path.join(zip_file_path, name),
-                   zip_file.open(name, 'r').read())
+def _get_zip_member_data_offset(fp, info):
+    """Get the offset of the data of a zip member from its local header."""
+    fp.seek(info.header_offset)
+    header = fp.read(30)
+    if len(header) != 30 or header[0:4] != b'PK\x03\x04':
+        return None
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def scan_zip_file(zip_file_path, fp=None):
+    """Scan all ELF files in a zip archive.  The members that do not start
+    with the ELF magic word are skipped without being extracted.  The STORED
+    members which are aligned to the mmap() granularity (e.g. the page-aligned
+    shared libraries in APK files) are mapped from the archive directly.  If
+    fp is specified, the archive is read from the file object instead, and the
+    members are not mapped."""
+    if fp is None:
+        with open(zip_file_path, 'rb') as fp:
+            for path, buf in _scan_zip_fp(zip_file_path, fp, True):
+                yield (path, buf)
+    else:
+        for path, buf in _scan_zip_fp(zip_file_path, fp, False):
+            yield (path, buf)
+
+
+def _scan_zip_fp(zip_file_path, fp, map_members):
+    elf_magic = ELF.ELF_MAGIC
+    with zipfile.ZipFile(fp, 'r') as zip_file:
+        for info in zip_file.infolist():
+            if info.file_size < len(elf_magic):
+                continue
+
+            path = os.path.join(zip_file_path, info.filename)
+
+            # Read STORED members from the archive.
+            if info.compress_type == zipfile.ZIP_STORED and \
+                    not info.flag_bits & 0x1:
+                data_offset = _get_zip_member_data_offset(fp, info)
+                if data_offset is not None:
+                    fp.seek(data_offset)
+                    if fp.read(len(elf_magic)) != elf_magic:
+                        continue
+                    if map_members and data_offset % ALLOCATIONGRANULARITY == 0:
+                        with mmap(fp.fileno(), info.file_size,
+                                  access=ACCESS_READ,
+                                  offset=data_offset) as buf:
+                            yield (path, buf)
+                    else:
+                        fp.seek(data_offset)
+                        yield (path, fp.read(info.file_size))
+                    continue
+
+            # Extract other members if they start with the ELF magic word.
+            with zip_file.open(info, 'r') as member:
+                if member.read(len(elf_magic)) != elf_magic:
+                    continue
+                yield (path, elf_magic + member.read())
 
 
 def dump_ext4_img(img_file_path, out_dir):
@@ -1558,12 +2845,76 @@ def is_accessible(path):
         return False
 
 
+def get_file_stat_key(path):
+    """Get the (size, mtime, inode) tuple which changes when the file at the
+    path is modified or replaced."""
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    return (st.st_size, mtime, st.st_ino)
+
+
+def _scan_ext4_image_file(image, path, inode, unzip_files):
+    """Scan the ELF files in a regular file in the ext4 image like
+    _scan_elf_file_uncached()."""
+    head = image.read(inode, 4)
+
+    if unzip_files and head[0:2] == b'PK':
+        zip_fp = io.BytesIO(image.read(inode))
+        if zipfile.is_zipfile(zip_fp):
+            result = []
+            for path, content in scan_zip_file(path, zip_fp):
+                try:
+                    result.append((path, ELF.loads(content)))
+                except ELFError:
+                    pass
+            return result
+
+    if head != ELF.ELF_MAGIC:
+        return []
+    with image.open_buf(inode) as buf:
+        try:
+            return [(path, ELF.loads(buf))]
+        except ELFError:
+            return []
+
+
 def scan_ext4_image(img_file_path, mount_point, unzip_files):
-    """Scan all ELF files in the ext4 image."""
-    with TemporaryDirectory() as tmp_dir:
-        dump_ext4_img(img_file_path, tmp_dir)
-        for path, elf in scan_elf_files(tmp_dir, mount_point, unzip_files):
-            yield path, elf
+    """Scan all ELF files in the ext4 image.  The files are read from the image
+    directly, and the image is dumped with debugfs only if it uses the features
+    which are not supported by Ext4Image or if its directories are corrupted.
+    The files which cannot be read from the image are skipped."""
+    try:
+        image = Ext4Image(img_file_path)
+        try:
+            files = list(image.walk())
+        except BaseException:
+            image.close()
+            raise
+    except Ext4Error:
+        with TemporaryDirectory() as tmp_dir:
+            with timed_phase('extract_apex') as phase:
+                dump_ext4_img(img_file_path, tmp_dir)
+                phase.count += 1
+            for path, elf in scan_elf_files(tmp_dir, mount_point,
+                                            unzip_files):
+                yield path, elf
+        return
+
+    with image:
+        for rel_path, inode in files:
+            # Skip the files that cannot be read like is_accessible().
+            if not inode.mode & (stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH):
+                continue
+            try:
+                result = _scan_ext4_image_file(
+                    image, os.path.join(mount_point, rel_path), inode,
+                    unzip_files)
+            except Ext4Error as e:
+                print('warning: {}: Failed to read {}: {}'
+                      .format(img_file_path, rel_path, e), file=sys.stderr)
+                continue
+            for path, elf in result:
+                yield path, elf
 
 
 def scan_apex_dir(apex_collection_root, apex_dir, unzip_files):
@@ -1599,27 +2950,257 @@ def scan_apex_dir(apex_collection_root, apex_dir, unzip_files):
 
 def scan_apex_file(apex_collection_root, apex_zip_file, unzip_files):
     with TemporaryDirectory() as tmp_dir:
-        with zipfile.ZipFile(apex_zip_file) as zip_file:
-            zip_file.extractall(tmp_dir)
+        with timed_phase('extract_apex') as phase:
+            with zipfile.ZipFile(apex_zip_file) as zip_file:
+                zip_file.extractall(tmp_dir)
+            phase.count += 1
         for path, elf in scan_apex_dir(apex_collection_root, tmp_dir,
                                        unzip_files):
             yield path, elf
 
 
-def scan_apex_files(apex_collection_root, unzip_files):
+def _scan_apex_worker(args):
+    """Scan an APEX directory or an APEX file.  Return a (result, extracted,
+    records) tuple, where extracted is false if the result of the APEX file is
+    loaded from elf_cache, and records are the PhaseRecords of the phases
+    (e.g. extract_apex) in the worker."""
+    global _phase_timings
+    parent_timings = _phase_timings
+    _phase_timings = PhaseTimings()
+    try:
+        result, extracted = _scan_apex(*args)
+        return (result, extracted, _phase_timings.records)
+    finally:
+        _phase_timings = parent_timings
+
+
+def _scan_apex(apex_collection_root, path, is_dir, unzip_files, elf_cache):
+    if is_dir:
+        return (list(scan_apex_dir(apex_collection_root, path, unzip_files)),
+                True)
+
+    if elf_cache is not None:
+        key = elf_cache.get_apex_key(path, apex_collection_root, unzip_files)
+        result = elf_cache.load(key)
+        if result is not None:
+            return (result, False)
+
+    result = list(scan_apex_file(apex_collection_root, path, unzip_files))
+
+    if elf_cache is not None:
+        elf_cache.store(key, result)
+    return (result, True)
+
+
+def scan_apex_files(apex_collection_root, unzip_files, jobs=1,
+                    elf_cache=None):
+    """Scan the APEX directories and the APEX files under
+    apex_collection_root.  If jobs is greater than 1, the APEX modules are
+    extracted and scanned by a pool of worker processes.  If elf_cache is
+    specified, the APEX files which have been scanned before are not extracted
+    again."""
+    worker_args = []
     for ent in scandir(apex_collection_root):
         if ent.is_dir():
-            for path, elf in scan_apex_dir(apex_collection_root, ent.path,
-                                           unzip_files):
-                yield path, elf
+            worker_args.append(
+                (apex_collection_root, ent.path, True, unzip_files, None))
         elif ent.is_file() and ent.name.endswith('.apex'):
-            for path, elf in scan_apex_file(apex_collection_root, ent.path,
-                                            unzip_files):
-                yield path, elf
+            worker_args.append(
+                (apex_collection_root, ent.path, False, unzip_files,
+                 elf_cache))
+
+    # Each APEX module takes a while to extract, so dispatch them one by one.
+    if jobs is not None:
+        jobs = min(jobs, len(worker_args))
+    results = []
+    with timed_phase('scan_apex') as phase:
+        for result, extracted, records in parallel_imap(
+                _scan_apex_worker, worker_args, jobs, chunksize=1):
+            results.append(result)
+            if extracted:
+                phase.count += 1
+            _phase_timings.merge(records)
+
+    for result in results:
+        for path, elf in result:
+            yield path, elf
+
+
+class ELFCache(object):
+    """ELFCache keeps the parsed ELF files in a directory so that the files
+    which have not been changed since the last run are not parsed again.
+
+    Each cache entry is keyed by the file path, and it is invalidated when the
+    size, the modification time, or the inode number of the file is changed, or
+    when FORMAT_VERSION is changed.  The entries of APEX files are keyed by the
+    SHA-1 digest of the file contents instead, so that an APEX file is not
+    extracted again even if it is copied or rebuilt with the same contents."""
+
+    FORMAT_VERSION = 4
 
+    _PICKLE_PROTOCOL = 2
 
-def scan_elf_files(root, mount_point=None, unzip_files=True):
-    """Scan all ELF files under a directory."""
+    _HASH_BLOCK_SIZE = 1 << 20
+
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        makedirs(self.cache_dir, exist_ok=True)
+
+
+    def _get_entry_path(self, path, unzip_files):
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        suffix = '.zip' if unzip_files else ''
+        return os.path.join(self.cache_dir, digest[:2], digest + suffix)
+
+
+    def get_key(self, path, unzip_files):
+        return (self.FORMAT_VERSION, path, unzip_files) + \
+            get_file_stat_key(path)
+
+
+    def get_apex_key(self, path, apex_collection_root, unzip_files):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as apex_file:
+            while True:
+                block = apex_file.read(self._HASH_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        # The scanned paths start with apex_collection_root, thus it is a part
+        # of the key as well.
+        return (self.FORMAT_VERSION, 'apex:' + digest.hexdigest(),
+                unzip_files, apex_collection_root)
+
+
+    @staticmethod
+    def _intern_elf(elf):
+        elf.dt_rpath = [intern(s) for s in elf.dt_rpath]
+        elf.dt_runpath = [intern(s) for s in elf.dt_runpath]
+        elf.dt_needed = [intern(s) for s in elf.dt_needed]
+        return elf
+
+
+    def load(self, key):
+        """Load the list of (path, elf) pairs stored with the key.  Return None
+        if there is no such entry or the entry is out-of-date or corrupted."""
+        entry_path = self._get_entry_path(key[1], key[2])
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                entry_key, result = pickle.load(entry_file)
+        except Exception:  # pylint: disable=broad-except
+            # Unpickling a corrupted entry or an entry written by another
+            # version of this module may raise almost any exception.
+            return None
+        if entry_key != key:
+            return None
+        return [(path, self._intern_elf(elf)) for path, elf in result]
+
+
+    def store(self, key, result):
+        """Store the list of (path, elf) pairs with the key.  The lazy symbols
+        are loaded before storing because the key does not tell whether the
+        entry was parsed lazily."""
+        for path, elf in result:
+            if elf.has_lazy_symbols:
+                elf._load_lazy_symbols()  # pylint: disable=protected-access
+
+        entry_path = self._get_entry_path(key[1], key[2])
+        entry_dir = os.path.dirname(entry_path)
+        makedirs(entry_dir, exist_ok=True)
+
+        # Write to a temporary file first so that concurrent readers never see
+        # partially written entries.
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir)
+        try:
+            with os.fdopen(fd, 'wb') as entry_file:
+                pickle.dump((key, result), entry_file, self._PICKLE_PROTOCOL)
+            os.rename(tmp_path, entry_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def get_fork_context():
+    """Get the multiprocessing context which forks worker processes, so that
+    the workers inherit the module globals.  Return None if the platform
+    cannot fork."""
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is None:
+        # Python 2 always forks worker processes on POSIX platforms.
+        return multiprocessing if os.name == 'posix' else None
+    try:
+        return get_context('fork')
+    except ValueError:
+        return None
+
+
+def parallel_imap(func, iterable, jobs=1, chunksize=16, context=None):
+    """Apply func to the items in iterable with a pool of worker processes and
+    yield the results in the order of iterable.  The items are processed in
+    this process if jobs is less than or equal to 1.  The pool is created with
+    the multiprocessing context if it is specified."""
+    if jobs is None or jobs <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    pool = (context or multiprocessing).Pool(jobs)
+    try:
+        for result in pool.imap(func, iterable, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _scan_elf_file_uncached(path, unzip_files, lazy_symbols=False):
+
+    # If this is a zip file and unzip_file is true, scan the ELF files in the
+    # zip file.
+    if unzip_files and is_zipfile(path):
+        result = []
+        for path, content in scan_zip_file(path):
+            try:
+                result.append((path, ELF.loads(content)))
+            except ELFError:
+                pass
+        return result
+
+    # Load ELF from the path.
+    try:
+        return [(path, ELF.load(path, lazy_symbols))]
+    except ELFError:
+        return []
+
+
+def scan_elf_file(path, unzip_files=True, elf_cache=None, lazy_symbols=False):
+    """Load the ELF file (or the ELF files in the zip file) at the path and
+    return a list of (path, elf) pairs.  If lazy_symbols is true, the symbols
+    of the ELF file are loaded on first access.  The ELF files in zip files
+    or in elf_cache are always parsed completely."""
+    if elf_cache is None:
+        return _scan_elf_file_uncached(path, unzip_files, lazy_symbols)
+
+    key = elf_cache.get_key(path, unzip_files)
+    result = elf_cache.load(key)
+    if result is None:
+        result = _scan_elf_file_uncached(path, unzip_files)
+        elf_cache.store(key, result)
+    return result
+
+
+def _scan_elf_file_worker(args):
+    return scan_elf_file(*args)
+
+
+def scan_elf_files(root, mount_point=None, unzip_files=True, jobs=1,
+                   elf_cache=None, lazy_symbols=False):
+    """Scan all ELF files under a directory.  If jobs is greater than 1, ELF
+    files are parsed by a pool of worker processes.  The results are yielded
+    in the same order regardless of jobs.  If elf_cache is specified, the ELF
+    files that have not been changed are loaded from the cache.  If
+    lazy_symbols is true, .dynsym sections are parsed on first access."""
 
     if mount_point:
         root_prefix_len = len(root) + 1
@@ -1629,34 +3210,87 @@ def scan_elf_files(root, mount_point=None, unzip_files=True):
         def norm_path(path):
             return path
 
+    apex_dir = os.path.join(root, 'apex')
+    if os.path.isdir(apex_dir):
+        for path, elf in scan_apex_files(apex_dir, unzip_files, jobs,
+                                         elf_cache):
+            yield (path, elf)
+
+    def enumerate_paths():
+        for base, dirnames, filenames in os.walk(root):
+            if base == root and 'apex' in dirnames:
+                dirnames.remove('apex')
+
+            for filename in filenames:
+                path = os.path.join(base, filename)
+                if is_accessible(path):
+                    yield (path, unzip_files, elf_cache, lazy_symbols)
+
+    for result in parallel_imap(_scan_elf_file_worker, enumerate_paths(),
+                                jobs):
+        for path, elf in result:
+            yield (norm_path(path), elf)
+
+
+def scan_elf_files_incremental(root, prev_files, unzip_files=True, jobs=1,
+                               elf_cache=None, lazy_symbols=False):
+    """Scan all ELF files under a directory like scan_elf_files() but reuse
+    the results of the files which have not been changed.  prev_files and the
+    returned files map each file path to the (stat_key, results) pair, where
+    results is the list of (path, elf) pairs from the file.  The directory of
+    APEX modules is tracked as a whole.  Return (results, files)."""
+
+    entries = []
+    worker_args = []
+
+    def add_entry(path, stat_key):
+        """Add an entry and return whether the path should be scanned."""
+        prev = prev_files.get(path)
+        if prev is not None and prev[0] == stat_key:
+            entries.append((path, stat_key, prev[1]))
+            return False
+        entries.append((path, stat_key, None))
+        return True
+
+    apex_dir = os.path.join(root, 'apex')
+    scan_apex = False
+    if os.path.isdir(apex_dir):
+        apex_stat_key = []
+        for base, _, filenames in os.walk(apex_dir):
+            for filename in filenames:
+                path = os.path.join(base, filename)
+                if is_accessible(path):
+                    apex_stat_key.append((path, get_file_stat_key(path)))
+        apex_stat_key.sort()
+        scan_apex = add_entry(apex_dir, tuple(apex_stat_key))
+
     for base, dirnames, filenames in os.walk(root):
         if base == root and 'apex' in dirnames:
             dirnames.remove('apex')
-            for path, elf in scan_apex_files(os.path.join(root, 'apex'),
-                                             unzip_files):
-                yield (path, elf)
 
         for filename in filenames:
             path = os.path.join(base, filename)
-            if not is_accessible(path):
-                continue
-
-
-            # If this is a zip file and unzip_file is true, scan the ELF files
-            # in the zip file.
-            if unzip_files and is_zipfile(path):
-                for path, content in scan_zip_file(path):
-                    try:
-                        yield (norm_path(path), ELF.loads(content))
-                    except ELFError:
-                        pass
-                continue
-
-            # Load ELF from the path.
-            try:
-                yield (norm_path(path), ELF.load(path))
-            except ELFError:
-                pass
+            if is_accessible(path) and \
+                    add_entry(path, get_file_stat_key(path)):
+                worker_args.append(
+                    (path, unzip_files, elf_cache, lazy_symbols))
+
+    # Scan APEX modules in this process and other files in worker processes.
+    scanned = []
+    if scan_apex:
+        scanned.append(list(scan_apex_files(apex_dir, unzip_files, jobs,
+                                            elf_cache)))
+    scanned.extend(parallel_imap(_scan_elf_file_worker, worker_args, jobs))
+    scanned.reverse()
+
+    files = dict()
+    results = []
+    for path, stat_key, result in entries:
+        if result is None:
+            result = scanned.pop()
+        files[path] = (stat_key, result)
+        results.extend(result)
+    return (results, files)
 
 
 PT_SYSTEM = 0
@@ -1914,10 +3548,36 @@ _APP_DIR_PATTERNS = re.compile('^(?:/[^/]+){1,2}/(?:priv-)?app/')
 
 
 class ELFResolver(object):
-    def __init__(self, lib_set, default_search_path):
+    def __init__(self, lib_set, default_search_path, dir_index=None):
+        """Create a resolver for the libs in lib_set.  dir_index must be
+        created by create_dir_index() from the same lib_set, so that the
+        resolvers with different search paths can share it."""
         self.lib_set = lib_set
         self.default_search_path = default_search_path
 
+        if dir_index is None:
+            dir_index = self.create_dir_index(lib_set)
+        self._dir_index = dir_index
+
+        # Map (name, dt_rpath, dt_runpath, app_dir) to the resolved lib.  The
+        # result of resolve() only depends on these.
+        self._resolved = dict()
+
+        # Map each requester to its app-specific search path or None.
+        self._app_dirs = dict()
+
+
+    @staticmethod
+    def create_dir_index(lib_set):
+        """Map each directory (with the trailing slash) to a dict from the
+        file names in the directory to the libs, so that a name can be looked
+        up in a search path without building the candidate path."""
+        dir_index = dict()
+        for path, lib in lib_set.items():
+            dirname, sep, basename = path.rpartition('/')
+            dir_index.setdefault(dirname + sep, dict())[basename] = lib
+        return dir_index
+
 
     def get_candidates(self, requester, name, dt_rpath=None, dt_runpath=None):
         # Search app-specific search paths.
@@ -1936,6 +3596,29 @@ class ELFResolver(object):
 
 
     def resolve(self, requester, name, dt_rpath=None, dt_runpath=None):
+        try:
+            app_dir = self._app_dirs[requester]
+        except KeyError:
+            app_dir = os.path.dirname(requester) \
+                    if _APP_DIR_PATTERNS.match(requester) else None
+            self._app_dirs[requester] = app_dir
+        key = (name, tuple(dt_rpath) if dt_rpath else (),
+               tuple(dt_runpath) if dt_runpath else (), app_dir)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        if '/' in name:
+            lib = self._resolve_candidates(requester, name, dt_rpath,
+                                           dt_runpath)
+        else:
+            lib = self._resolve_basename(name, app_dir, dt_rpath, dt_runpath)
+        self._resolved[key] = lib
+        return lib
+
+
+    def _resolve_candidates(self, requester, name, dt_rpath, dt_runpath):
         for path in self.get_candidates(requester, name, dt_rpath, dt_runpath):
             try:
                 return self.lib_set[path]
@@ -1944,8 +3627,92 @@ class ELFResolver(object):
         return None
 
 
+    def _resolve_basename(self, name, app_dir, dt_rpath, dt_runpath):
+        """Resolve a name without slashes with the directory index.  The
+        directories are searched in the same order as get_candidates()."""
+        search_path = itertools.chain(
+            (app_dir,) if app_dir is not None else (), dt_rpath or (),
+            dt_runpath or (), self.default_search_path)
+        for d in search_path:
+            # os.path.join(d, name) == os.path.join(d, '') + name if name has
+            # no slashes.
+            names = self._dir_index.get(os.path.join(d, ''))
+            if names is not None and name in names:
+                return names[name]
+        return None
+
+
+class ELFSymbolIndex(object):
+    """ELFSymbolIndex maps exported symbols to the shared libraries which
+    export them, so that an imported symbol can be resolved without testing
+    the exported symbols of each DT_NEEDED library one by one."""
+
+
+    def __init__(self, libs):
+        # Map each exported symbol to the first library that exports it.
+        self._first_provider = dict()
+
+        # Map the symbols exported by more than one library to the list of all
+        # such libraries.
+        self._providers = dict()
+
+        exported_symbols = set()
+        for lib in libs:
+            symbols = set(lib.elf.exported_symbols.ids)
+            if not symbols:
+                continue
+            dup_symbols = symbols & exported_symbols
+            for symbol in dup_symbols:
+                providers = self._providers.get(symbol)
+                if providers is None:
+                    self._providers[symbol] = \
+                        [self._first_provider[symbol], lib]
+                else:
+                    providers.append(lib)
+            exported_symbols |= symbols
+            self._first_provider.update(
+                dict.fromkeys(symbols - dup_symbols, lib))
+
+
+    def find_exported_symbols(self, symbols, libs):
+        """Find the first library in libs that exports each symbol in the
+        SymbolSet and yield (symbol, lib) pairs.  lib is None if no library
+        exports the symbol."""
+
+        lib_order = dict()
+        for i, lib in enumerate(libs):
+            lib_order.setdefault(lib, i)
+        num_libs = len(libs)
+
+        names = SymbolSet.table.names
+        for symbol in symbols.ids:
+            providers = self._providers.get(symbol)
+            if providers is None:
+                # Only one library exports this symbol.
+                provider = self._first_provider.get(symbol)
+                if provider not in lib_order:
+                    provider = None
+            elif len(providers) < num_libs:
+                # Pick the provider that comes first in libs.
+                provider = None
+                provider_order = num_libs
+                for lib in providers:
+                    order = lib_order.get(lib, num_libs)
+                    if order < provider_order:
+                        provider = lib
+                        provider_order = order
+            else:
+                # There are more providers than libs.  Test libs in order.
+                provider = None
+                for lib in libs:
+                    if lib.elf.exported_symbols.contains_id(symbol):
+                        provider = lib
+                        break
+            yield (names[symbol], provider)
+
+
 class ELFLinkData(object):
-    def __init__(self, partition, path, elf, tag_bit):
+    def __init__(self, partition, path, elf, tag_bit, graph=None):
         self.partition = partition
         self.path = path
         self.elf = elf
@@ -1962,6 +3729,14 @@ class ELFLinkData(object):
         self.unresolved_symbols = set()
         self.unresolved_dt_needed = []
         self.linked_symbols = dict()
+        # The ELFLinker that owns this lib, whose edge_version is increased
+        # whenever the dependencies are changed.
+        self._graph = graph
+
+
+    def _increase_edge_version(self):
+        if self._graph is not None:
+            self._graph.edge_version += 1
 
 
     @property
@@ -1999,6 +3774,7 @@ class ELFLinkData(object):
         assert self not in dst.users_needed_hidden
         self.deps_needed.add(dst)
         dst.users_needed.add(self)
+        self._increase_edge_version()
 
 
     def add_dlopen_dep(self, dst):
@@ -2006,6 +3782,7 @@ class ELFLinkData(object):
         assert self not in dst.users_dlopen_hidden
         self.deps_dlopen.add(dst)
         dst.users_dlopen.add(self)
+        self._increase_edge_version()
 
 
     def hide_needed_dep(self, dst):
@@ -2013,6 +3790,7 @@ class ELFLinkData(object):
         dst.users_needed.remove(self)
         self.deps_needed_hidden.add(dst)
         dst.users_needed_hidden.add(self)
+        self._increase_edge_version()
 
 
     def hide_dlopen_dep(self, dst):
@@ -2020,6 +3798,7 @@ class ELFLinkData(object):
         dst.users_dlopen.remove(self)
         self.deps_dlopen_hidden.add(dst)
         dst.users_dlopen_hidden.add(self)
+        self._increase_edge_version()
 
 
     @property
@@ -2165,6 +3944,180 @@ class ELFLibDict(defaultnamedtuple('ELFLibDict', ('lib32', 'lib64'), {})):
         return itertools.chain(self.lib32.items(), self.lib64.items())
 
 
+class ELFLinkIndex(object):
+    """ELFLinkIndex maps the libs to integers and keeps the dependency edges in
+    compressed adjacency arrays, so that closures can be computed with
+    integer arrays instead of the sets in ELFLinkData."""
+
+    _UNSEEN = 0
+    _IN_CLOSURE = 1
+    _EXCLUDED = 2
+
+
+    def __init__(self, libs):
+        self.libs = list(libs)
+        self.lib_ids = dict((lib, i) for i, lib in enumerate(self.libs))
+        self._adjacencies = dict()
+
+
+    def get_adjacency(self, name):
+        """Get an (offsets, targets) pair for the ELFLinkData property name
+        (e.g. deps_all), where the successors of the lib i are
+        targets[offsets[i]:offsets[i + 1]].  It is created on first use."""
+        adjacency = self._adjacencies.get(name)
+        if adjacency is None:
+            lib_ids = self.lib_ids
+            offsets = array('l', [0])
+            targets = array('l')
+            for lib in self.libs:
+                targets.extend(
+                    set(lib_ids[succ] for succ in getattr(lib, name)))
+                offsets.append(len(targets))
+            adjacency = self._adjacencies[name] = (offsets, targets)
+        return adjacency
+
+
+    def compute_closure(self, root_set, is_excluded, name):
+        """Compute the closure of root_set with the ELFLinkData property name
+        (e.g. deps_all).  is_excluded is called at most once for each lib, and
+        the excluded libs are kept in an exclusion mask."""
+        offsets, targets = self.get_adjacency(name)
+        libs = self.libs
+        state = bytearray(len(libs))
+
+        frontier = [self.lib_ids[lib] for lib in root_set]
+        for i in frontier:
+            state[i] = self._IN_CLOSURE
+        closure = list(frontier)
+
+        # Expand the whole frontier at a time.
+        while frontier:
+            next_frontier = []
+            for i in frontier:
+                for succ in targets[offsets[i]:offsets[i + 1]]:
+                    if state[succ] != self._UNSEEN:
+                        continue
+                    if is_excluded(libs[succ]):
+                        state[succ] = self._EXCLUDED
+                    else:
+                        state[succ] = self._IN_CLOSURE
+                        next_frontier.append(succ)
+            closure.extend(next_frontier)
+            frontier = next_frontier
+
+        return set(libs[i] for i in closure)
+
+
+class ELFLinkerState(object):
+    """ELFLinkerState keeps the scanned files and the resolved DT_NEEDED
+    dependencies and symbols of an ELFLinker.  ELFLinker.create() with the
+    same config only rescans the changed files and only re-resolves the
+    libraries affected by them."""
+
+    FORMAT_VERSION = 1
+
+    _PICKLE_PROTOCOL = 2
+
+
+    def __init__(self, config, files, apex_module_names, vndk_lib_dirs,
+                 ro_vndk_version, libs):
+        self.config = config
+        self.files = files
+        self.apex_module_names = apex_module_names
+        self.vndk_lib_dirs = vndk_lib_dirs
+        self.ro_vndk_version = ro_vndk_version
+
+        # A list of (path, elf, deps_needed, unresolved_symbols,
+        # unresolved_dt_needed, linked_symbols, imported_ext_symbols) tuples,
+        # where the libraries are referred by their indices in the list.
+        self.libs = libs
+
+
+    @staticmethod
+    def create(config, files, graph):
+        """Capture the state of an ELFLinker right after resolve_deps()."""
+        all_libs = list(graph.all_libs())
+        index = dict((lib, i) for i, lib in enumerate(all_libs))
+        libs = []
+        for lib in all_libs:
+            libs.append((
+                lib.path, lib.elf,
+                [index[dep] for dep in lib.deps_needed],
+                list(lib.unresolved_symbols),
+                list(lib.unresolved_dt_needed),
+                [(symbol, index[dep])
+                 for symbol, dep in lib.linked_symbols.items()],
+                [(index[dep], list(symbols))
+                 for dep, symbols in lib.imported_ext_symbols.items()]))
+        return ELFLinkerState(config, files, set(graph.apex_module_names),
+                              list(graph.vndk_lib_dirs), graph.ro_vndk_version,
+                              libs)
+
+
+    @staticmethod
+    def load(path, config):
+        """Load the state from the file.  Return None if there is no such
+        file, the file is corrupted, or the state was created with a different
+        config."""
+        try:
+            with open(path, 'rb') as state_file:
+                data = pickle.load(state_file)
+        except Exception:  # pylint: disable=broad-except
+            # Unpickling a corrupted state or a state written by another
+            # version of this module may raise almost any exception.
+            return None
+        if not isinstance(data, tuple) or len(data) != 7 or \
+                data[0] != ELFLinkerState.FORMAT_VERSION:
+            return None
+        state = ELFLinkerState(*data[1:])
+        if state.config != config:
+            return None
+        return state
+
+
+    def save(self, path):
+        data = (self.FORMAT_VERSION, self.config, self.files,
+                self.apex_module_names, self.vndk_lib_dirs,
+                self.ro_vndk_version, self.libs)
+
+        # Write to a temporary file first so that the previous state is kept if
+        # something goes wrong.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as state_file:
+                pickle.dump(data, state_file, self._PICKLE_PROTOCOL)
+            os.rename(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+    def is_compatible_with(self, graph):
+        """Check whether the search paths of graph are the same as the ones
+        of the graph captured in this state."""
+        return (self.apex_module_names == graph.apex_module_names and
+                self.vndk_lib_dirs == list(graph.vndk_lib_dirs) and
+                self.ro_vndk_version == graph.ro_vndk_version)
+
+
+# The graph and the libs to be resolved by _resolve_lib_deps_worker().  It is
+# set by ELFLinker._resolve_deps_in_workers() before forking the workers.
+_resolve_worker_state = None
+
+
+def _resolve_lib_deps_worker(task_id):
+    graph, tasks, lib_ids, resolve_symbols = _resolve_worker_state
+    lib, resolver, symbol_index = tasks[task_id]
+    deps, symbols = graph._find_lib_deps(lib, resolver, symbol_index,
+                                         resolve_symbols)
+    dep_ids = [lib_ids[dep] if dep else -1 for dep in deps]
+    if symbols is None:
+        return (dep_ids, None)
+    return (dep_ids, array('i', (lib_ids[dep] if dep else -1
+                                 for symbol, dep in symbols)))
+
+
 class ELFLinker(object):
     def __init__(self, tagged_paths=None, vndk_lib_dirs=None,
                  ro_vndk_version='current'):
@@ -2188,6 +4141,12 @@ class ELFLinker(object):
 
         self.apex_module_names = set()
 
+        # The number of the changes to the dependencies of the libs.  It is
+        # used to invalidate the ELFLinkIndex.
+        self.edge_version = 0
+        self._link_index = None
+        self._link_index_version = None
+
 
     def _add_lib_to_lookup_dict(self, lib):
         self.lib_pt[lib.partition].add(lib.path, lib)
@@ -2205,8 +4164,9 @@ class ELFLinker(object):
 
     def add_lib(self, partition, path, elf):
         lib = ELFLinkData(partition, path, elf,
-                          self.tagged_paths.get_path_tag_bit(path))
+                          self.tagged_paths.get_path_tag_bit(path), self)
         self._add_lib_to_lookup_dict(lib)
+        self._link_index = None
         return lib
 
 
@@ -2287,7 +4247,12 @@ class ELFLinker(object):
 
     def add_executables_in_dir(self, partition_name, partition, root,
                                alter_partition, alter_subdirs, ignored_subdirs,
-                               scan_elf_files, unzip_files):
+                               scan_elf_files, unzip_files, jobs=1,
+                               elf_cache=None, lazy_symbols=False,
+                               prev_files=None, files=None):
+        """Add the ELF files under root.  If files is not None, the files are
+        scanned with scan_elf_files_incremental() and prev_files, and the
+        scanned files are added to files."""
         root = os.path.abspath(root)
         prefix_len = len(root) + 1
 
@@ -2297,7 +4262,17 @@ class ELFLinker(object):
             ignored_patt = ELFLinker._compile_path_matcher(
                 root, ignored_subdirs)
 
-        for path, elf in scan_elf_files(root, unzip_files=unzip_files):
+        if files is None:
+            results = scan_elf_files(root, unzip_files=unzip_files, jobs=jobs,
+                                     elf_cache=elf_cache,
+                                     lazy_symbols=lazy_symbols)
+        else:
+            results, root_files = scan_elf_files_incremental(
+                root, prev_files or {}, unzip_files, jobs, elf_cache,
+                lazy_symbols)
+            files.update(root_files)
+
+        for path, elf in results:
             # Ignore ELF files with unknown machine ID (eg. DSP).
             if elf.e_machine not in ELF.ELF_MACHINES:
                 continue
@@ -2336,41 +4311,49 @@ class ELFLinker(object):
         return None
 
 
-    def _resolve_lib_imported_symbols(self, lib, imported_libs, generic_refs):
-        """Resolve the imported symbols in a library."""
-        for symbol in lib.elf.imported_symbols:
-            imported_lib = self._find_exported_symbol(symbol, imported_libs)
-            if not imported_lib:
-                lib.unresolved_symbols.add(symbol)
-            else:
-                lib.linked_symbols[symbol] = imported_lib
-                if generic_refs:
-                    ref_lib = generic_refs.refs.get(imported_lib.path)
-                    if not ref_lib or not symbol in ref_lib.exported_symbols:
-                        lib.imported_ext_symbols[imported_lib].add(symbol)
+    def _warn_missing_needed_lib(self, lib, resolver, dt_needed):
+        candidates = list(resolver.get_candidates(
+            lib.path, dt_needed, lib.elf.dt_rpath, lib.elf.dt_runpath))
+        print('warning: {}: Missing needed library: {}  Tried: {}'
+              .format(lib.path, dt_needed, candidates), file=sys.stderr)
+
 
+    def _find_lib_deps(self, lib, resolver, symbol_index=None,
+                       resolve_symbols=True):
+        """Find the libs for the DT_NEEDED entries and the imported symbols of
+        lib without changing the graph.  Return a list of libs (None if not
+        found) for the DT_NEEDED entries and a list of (symbol, lib) pairs
+        (None if resolve_symbols is false)."""
+        deps = [resolver.resolve(lib.path, dt_needed, lib.elf.dt_rpath,
+                                 lib.elf.dt_runpath)
+                for dt_needed in lib.elf.dt_needed]
 
-    def _resolve_lib_dt_needed(self, lib, resolver):
+        if not resolve_symbols:
+            return (deps, None)
+
+        imported_libs = [dep for dep in deps if dep]
+        if symbol_index is None:
+            symbols = [(symbol,
+                        self._find_exported_symbol(symbol, imported_libs))
+                       for symbol in lib.elf.imported_symbols]
+        else:
+            symbols = list(symbol_index.find_exported_symbols(
+                lib.elf.imported_symbols, imported_libs))
+        return (deps, symbols)
+
+
+    def _add_lib_deps(self, lib, resolver, generic_refs, deps, symbols):
+        """Add the dependencies found by _find_lib_deps() to the graph."""
+
+        # Add DT_NEEDED dependencies.
         imported_libs = []
-        for dt_needed in lib.elf.dt_needed:
-            dep = resolver.resolve(lib.path, dt_needed, lib.elf.dt_rpath,
-                                   lib.elf.dt_runpath)
+        for dt_needed, dep in zip(lib.elf.dt_needed, deps):
             if not dep:
-                candidates = list(resolver.get_candidates(
-                    lib.path, dt_needed, lib.elf.dt_rpath, lib.elf.dt_runpath))
-                print('warning: {}: Missing needed library: {}  Tried: {}'
-                      .format(lib.path, dt_needed, candidates),
-                      file=sys.stderr)
+                self._warn_missing_needed_lib(lib, resolver, dt_needed)
                 lib.unresolved_dt_needed.append(dt_needed)
                 continue
             lib.add_needed_dep(dep)
             imported_libs.append(dep)
-        return imported_libs
-
-
-    def _resolve_lib_deps(self, lib, resolver, generic_refs):
-        # Resolve DT_NEEDED entries.
-        imported_libs = self._resolve_lib_dt_needed(lib, resolver)
 
         if generic_refs:
             for imported_lib in imported_libs:
@@ -2380,13 +4363,38 @@ class ELFLinker(object):
                     # set.
                     lib.imported_ext_symbols[imported_lib].update()
 
-        # Resolve imported symbols.
-        self._resolve_lib_imported_symbols(lib, imported_libs, generic_refs)
+        # Add linked symbols.
+        if symbols is None:
+            return
+        for symbol, imported_lib in symbols:
+            if not imported_lib:
+                lib.unresolved_symbols.add(symbol)
+            else:
+                lib.linked_symbols[symbol] = imported_lib
+                if generic_refs:
+                    ref_lib = generic_refs.refs.get(imported_lib.path)
+                    if not ref_lib or not symbol in ref_lib.exported_symbols:
+                        lib.imported_ext_symbols[imported_lib].add(symbol)
+
 
+    def _resolve_lib_deps(self, lib, resolver, generic_refs,
+                          symbol_index=None, resolve_symbols=True):
+        deps, symbols = self._find_lib_deps(lib, resolver, symbol_index,
+                                            resolve_symbols)
+        self._add_lib_deps(lib, resolver, generic_refs, deps, symbols)
 
-    def _resolve_lib_set_deps(self, lib_set, resolver, generic_refs):
+
+    def _resolve_lib_set_deps(self, lib_set, resolver, generic_refs,
+                              symbol_index=None, resolve_symbols=True,
+                              libs=None):
         for lib in lib_set:
-            self._resolve_lib_deps(lib, resolver, generic_refs)
+            if libs is None or lib in libs:
+                self._resolve_lib_deps(lib, resolver, generic_refs,
+                                       symbol_index, resolve_symbols)
+            else:
+                # The lib has been resolved.  Print the same warnings.
+                for dt_needed in lib.unresolved_dt_needed:
+                    self._warn_missing_needed_lib(lib, resolver, dt_needed)
 
 
     def _get_apex_bionic_search_paths(self, lib_dir):
@@ -2439,7 +4447,11 @@ class ELFLinker(object):
         return vndk_sp_dirs + vndk_dirs + fallback_lib_dirs
 
 
-    def _resolve_elf_class_deps(self, lib_dir, elf_class, generic_refs):
+    def _get_elf_class_lib_groups(self, lib_dir, elf_class):
+        """Classify the libs in the ELF class and return a list of
+        (lib_set, resolver) pairs, in the order that they are resolved."""
+        groups = []
+
         # Classify libs.
         vndk_lib_dirs = self.vndk_lib_dirs
         lib_dict = self._compute_lib_dict(elf_class)
@@ -2452,12 +4464,17 @@ class ELFLinker(object):
         vendor_vndk_sp_libs, vendor_vndk_libs, vendor_libs = \
             vndk_lib_dirs.classify_vndk_libs(vendor_lib_dict.values())
 
-        # Resolve system libs.
+        # All resolvers share the directory index of lib_dict.
+        dir_index = ELFResolver.create_dir_index(lib_dict)
+
+        def create_resolver(search_paths):
+            return ELFResolver(lib_dict, search_paths, dir_index)
+
+        # System libs.
         search_paths = self._get_system_search_paths(lib_dir)
-        resolver = ELFResolver(lib_dict, search_paths)
-        self._resolve_lib_set_deps(system_libs, resolver, generic_refs)
+        groups.append((system_libs, create_resolver(search_paths)))
 
-        # Resolve vndk-sp libs
+        # VNDK-SP libs.
         for version in vndk_lib_dirs:
             vndk_sp_dirs, vndk_dirs = \
                 vndk_lib_dirs.create_vndk_search_paths(lib_dir, version)
@@ -2465,31 +4482,208 @@ class ELFLinker(object):
                 system_vndk_sp_libs[version] | vendor_vndk_sp_libs[version]
             search_paths = self._get_vndk_sp_search_paths(
                 lib_dir, vndk_sp_dirs)
-            resolver = ELFResolver(lib_dict, search_paths)
-            self._resolve_lib_set_deps(vndk_sp_libs, resolver, generic_refs)
+            groups.append((vndk_sp_libs, create_resolver(search_paths)))
 
-        # Resolve vndk libs
+        # VNDK libs.
         for version in vndk_lib_dirs:
             vndk_sp_dirs, vndk_dirs = \
                 vndk_lib_dirs.create_vndk_search_paths(lib_dir, version)
             vndk_libs = system_vndk_libs[version] | vendor_vndk_libs[version]
             search_paths = self._get_vndk_search_paths(
                 lib_dir, vndk_sp_dirs, vndk_dirs)
-            resolver = ELFResolver(lib_dict, search_paths)
-            self._resolve_lib_set_deps(vndk_libs, resolver, generic_refs)
+            groups.append((vndk_libs, create_resolver(search_paths)))
 
-        # Resolve vendor libs.
+        # Vendor libs.
         vndk_sp_dirs, vndk_dirs = vndk_lib_dirs.create_vndk_search_paths(
             lib_dir, self.ro_vndk_version)
         search_paths = self._get_vendor_search_paths(
             lib_dir, vndk_sp_dirs, vndk_dirs)
-        resolver = ELFResolver(lib_dict, search_paths)
-        self._resolve_lib_set_deps(vendor_libs, resolver, generic_refs)
+        groups.append((vendor_libs, create_resolver(search_paths)))
+
+        return groups
+
+
+    def _resolve_elf_class_deps(self, lib_dir, elf_class, generic_refs,
+                                resolve_symbols=True, libs=None):
+        """Resolve the libs in the ELF class.  If libs is specified, only the
+        libs in libs are resolved."""
+
+        # Build the index from exported symbols to shared libraries.  It is not
+        # worth building the index for the few libs in libs.
+        if resolve_symbols and libs is None:
+            symbol_index = ELFSymbolIndex(
+                self._compute_lib_dict(elf_class).values())
+        else:
+            symbol_index = None
+
+        for lib_set, resolver in self._get_elf_class_lib_groups(lib_dir,
+                                                                elf_class):
+            self._resolve_lib_set_deps(lib_set, resolver, generic_refs,
+                                       symbol_index, resolve_symbols, libs)
+
+
+    def _resolve_deps_in_workers(self, generic_refs, resolve_symbols, jobs,
+                                 context, libs=None):
+        """Find the dependencies of the libs in worker processes and add them
+        to the graph in the same order as _resolve_elf_class_deps().  If libs
+        is specified, only the libs in libs are resolved."""
+        global _resolve_worker_state
+
+        tasks = []
+        for lib_dir, elf_class in (('lib', ELF.ELFCLASS32),
+                                   ('lib64', ELF.ELFCLASS64)):
+            if resolve_symbols and libs is None:
+                symbol_index = ELFSymbolIndex(
+                    self._compute_lib_dict(elf_class).values())
+            else:
+                symbol_index = None
+            for lib_set, resolver in self._get_elf_class_lib_groups(
+                    lib_dir, elf_class):
+                for lib in lib_set:
+                    tasks.append((lib, resolver, symbol_index))
+
+        # The worker processes inherit the graph when they are forked.  They
+        # refer to the libs by the indices in all_libs.
+        all_libs = list(self.all_libs())
+        lib_ids = dict((lib, i) for i, lib in enumerate(all_libs))
+        _resolve_worker_state = (self, tasks, lib_ids, resolve_symbols)
+
+        def get_lib(lib_id):
+            return all_libs[lib_id] if lib_id >= 0 else None
 
+        task_ids = [i for i, task in enumerate(tasks)
+                    if libs is None or task[0] in libs]
 
-    def resolve_deps(self, generic_refs=None):
-        self._resolve_elf_class_deps('lib', ELF.ELFCLASS32, generic_refs)
-        self._resolve_elf_class_deps('lib64', ELF.ELFCLASS64, generic_refs)
+        try:
+            results = iter(parallel_imap(_resolve_lib_deps_worker, task_ids,
+                                         jobs, 64, context))
+            for lib, resolver, _ in tasks:
+                if libs is not None and lib not in libs:
+                    # The lib has been resolved.  Print the same warnings.
+                    for dt_needed in lib.unresolved_dt_needed:
+                        self._warn_missing_needed_lib(lib, resolver,
+                                                      dt_needed)
+                    continue
+                dep_ids, symbol_lib_ids = next(results)
+                deps = [get_lib(dep_id) for dep_id in dep_ids]
+                if symbol_lib_ids is None:
+                    symbols = None
+                else:
+                    symbols = [(symbol, get_lib(lib_id)) for symbol, lib_id in
+                               zip(lib.elf.imported_symbols, symbol_lib_ids)]
+                self._add_lib_deps(lib, resolver, generic_refs, deps, symbols)
+        finally:
+            _resolve_worker_state = None
+
+
+    def resolve_deps(self, generic_refs=None, resolve_symbols=True, jobs=1):
+        """Resolve the dependencies between ELF files.  If resolve_symbols is
+        false, only DT_NEEDED entries are resolved and neither linked_symbols
+        nor unresolved_symbols are computed.  If jobs is greater than 1, the
+        dependencies are found by worker processes (if the platform can fork
+        them) and the result is the same."""
+        self._resolve_libs_deps(generic_refs, resolve_symbols, jobs)
+
+
+    def _resolve_libs_deps(self, generic_refs, resolve_symbols, jobs,
+                           libs=None):
+        """Resolve the dependencies of the libs in libs (or all libs if libs
+        is None) like resolve_deps()."""
+        if jobs is not None and jobs > 1:
+            context = get_fork_context()
+            if context is not None:
+                self._resolve_deps_in_workers(generic_refs, resolve_symbols,
+                                              jobs, context, libs)
+                return
+
+        self._resolve_elf_class_deps('lib', ELF.ELFCLASS32, generic_refs,
+                                     resolve_symbols, libs)
+        self._resolve_elf_class_deps('lib64', ELF.ELFCLASS64, generic_refs,
+                                     resolve_symbols, libs)
+
+
+    def _find_libs_affected_by_state(self, state, prev_libs):
+        """Find the libs which must be resolved again.  prev_libs[i] is the
+        current lib for state.libs[i] if its ELF file has not been changed or
+        None otherwise."""
+
+        # Changed or added libs.
+        unchanged_libs = set(lib for lib in prev_libs if lib is not None)
+        affected = set(lib for lib in self.all_libs()
+                       if lib not in unchanged_libs)
+
+        # Users of changed or removed libs.
+        prev_users = collections.defaultdict(list)
+        for i, entry in enumerate(state.libs):
+            for dep in entry[2]:
+                prev_users[dep].append(i)
+        for i, lib in enumerate(prev_libs):
+            if lib is None:
+                affected.update(prev_libs[user] for user in prev_users[i]
+                                if prev_libs[user] is not None)
+
+        # Libs with DT_NEEDED entries that may be resolved to added libs.
+        prev_keys = set((entry[0], entry[1].ei_class) for entry in state.libs)
+        added_paths = collections.defaultdict(list)
+        for lib in affected:
+            if (lib.path, lib.elf.ei_class) not in prev_keys:
+                key = (lib.elf.ei_class, posixpath.basename(lib.path))
+                added_paths[key].append(lib.path)
+        if added_paths:
+            for lib in unchanged_libs - affected:
+                for dt_needed in lib.elf.dt_needed:
+                    key = (lib.elf.ei_class, posixpath.basename(dt_needed))
+                    if any(path == dt_needed or path.endswith('/' + dt_needed)
+                           for path in added_paths.get(key, ())):
+                        affected.add(lib)
+                        break
+
+        return affected
+
+
+    def resolve_deps_incrementally(self, state, generic_refs=None,
+                                   resolve_symbols=True, jobs=1):
+        """Resolve the dependencies like resolve_deps() but copy the results
+        from the ELFLinkerState for the libs which are not affected by the
+        changed files."""
+
+        if not state.is_compatible_with(self):
+            self.resolve_deps(generic_refs, resolve_symbols, jobs)
+            return
+
+        # Map the libs in the state to the current libs.  The ELF objects of
+        # the unchanged files are reused by scan_elf_files_incremental().
+        lib_dicts = {
+            ELF.ELFCLASS32: self._compute_lib_dict(ELF.ELFCLASS32),
+            ELF.ELFCLASS64: self._compute_lib_dict(ELF.ELFCLASS64),
+        }
+        prev_libs = []
+        for entry in state.libs:
+            path, elf = entry[0:2]
+            lib = lib_dicts.get(elf.ei_class, {}).get(path)
+            prev_libs.append(lib if lib is not None and lib.elf is elf
+                             else None)
+
+        affected = self._find_libs_affected_by_state(state, prev_libs)
+
+        # Copy the results of the libs that are not affected.  Their deps have
+        # not been changed, otherwise they would have been affected.
+        for lib, entry in zip(prev_libs, state.libs):
+            if lib is None or lib in affected:
+                continue
+            (_, _, deps_needed, unresolved_symbols, unresolved_dt_needed,
+             linked_symbols, imported_ext_symbols) = entry
+            for dep in deps_needed:
+                lib.add_needed_dep(prev_libs[dep])
+            lib.unresolved_symbols.update(unresolved_symbols)
+            lib.unresolved_dt_needed.extend(unresolved_dt_needed)
+            for symbol, dep in linked_symbols:
+                lib.linked_symbols[symbol] = prev_libs[dep]
+            for dep, symbols in imported_ext_symbols:
+                lib.imported_ext_symbols[prev_libs[dep]].update(symbols)
+
+        # Resolve the affected libs.
+        self._resolve_libs_deps(generic_refs, resolve_symbols, jobs, affected)
 
 
     def compute_predefined_sp_hal(self):
@@ -2884,20 +5078,231 @@ class ELFLinker(object):
         return closure
 
 
-    @classmethod
-    def compute_deps_closure(cls, root_set, is_excluded,
+    def _get_link_index(self, root_set):
+        """Get the ELFLinkIndex of the libs, which is rebuilt if any lib or
+        dependency has been added since it was built.  Return None if a lib
+        in root_set is not in this graph."""
+        if (self._link_index is None or
+                self._link_index_version != self.edge_version):
+            self._link_index = ELFLinkIndex(self.all_libs())
+            self._link_index_version = self.edge_version
+        lib_ids = self._link_index.lib_ids
+        if not all(lib in lib_ids for lib in root_set):
+            return None
+        return self._link_index
+
+
+    def compute_deps_closure(self, root_set, is_excluded,
                              ignore_hidden_deps=False):
+        link_index = self._get_link_index(root_set)
+        if link_index is not None:
+            name = 'deps_good' if ignore_hidden_deps else 'deps_all'
+            return link_index.compute_closure(root_set, is_excluded, name)
+
         get_successors = (lambda x: x.deps_good) if ignore_hidden_deps else \
                          (lambda x: x.deps_all)
-        return cls._compute_closure(root_set, is_excluded, get_successors)
+        return self._compute_closure(root_set, is_excluded, get_successors)
 
 
-    @classmethod
-    def compute_users_closure(cls, root_set, is_excluded,
+    def compute_users_closure(self, root_set, is_excluded,
                               ignore_hidden_users=False):
+        link_index = self._get_link_index(root_set)
+        if link_index is not None:
+            name = 'users_good' if ignore_hidden_users else 'users_all'
+            return link_index.compute_closure(root_set, is_excluded, name)
+
         get_successors = (lambda x: x.users_good) if ignore_hidden_users else \
                          (lambda x: x.users_all)
-        return cls._compute_closure(root_set, is_excluded, get_successors)
+        return self._compute_closure(root_set, is_excluded, get_successors)
+
+
+    def _compute_closures(self, root_libs, is_excluded, name):
+        """Compute the closure of each lib in root_libs as if
+        compute_closure() were called with each lib as the root set, but in
+        one pass.  The strongly connected components of the libs which are not
+        excluded are visited in reverse topological order, and the closure of
+        a component is a bitset shared by all libs in the component.  Yield
+        (lib, closure) pairs in the order of root_libs."""
+        root_libs = list(root_libs)
+        link_index = self._get_link_index(root_libs)
+        if link_index is None:
+            get_successors = lambda x: getattr(x, name)
+            for lib in root_libs:
+                yield (lib, self._compute_closure({lib}, is_excluded,
+                                                  get_successors))
+            return
+
+        offsets, targets = link_index.get_adjacency(name)
+        libs = link_index.libs
+        excluded = [is_excluded(lib) for lib in libs]
+
+        succs = []
+        for i, is_lib_excluded in enumerate(excluded):
+            if is_lib_excluded:
+                succs.append(())
+            else:
+                succs.append([succ for succ in
+                              targets[offsets[i]:offsets[i + 1]]
+                              if not excluded[succ]])
+
+        closures = [0] * len(libs)
+        for component in self._find_strongly_connected_components(succs):
+            bits = 0
+            for i in component:
+                bits |= 1 << i
+                for succ in succs[i]:
+                    bits |= closures[succ]
+            for i in component:
+                closures[i] = bits
+
+        lib_ids = link_index.lib_ids
+        for lib in root_libs:
+            i = lib_ids[lib]
+            if excluded[i]:
+                # An excluded root is still in its own closure.
+                bits = 1 << i
+                for succ in targets[offsets[i]:offsets[i + 1]]:
+                    if not excluded[succ]:
+                        bits |= closures[succ]
+            else:
+                bits = closures[i]
+            yield (lib, set(libs[j] for j in self._get_bit_indices(bits)))
+
+
+    def compute_deps_closures(self, root_libs, is_excluded,
+                              ignore_hidden_deps=False):
+        """Compute the dependency closure of each lib in root_libs.  Yield
+        (lib, closure) pairs in the order of root_libs."""
+        name = 'deps_good' if ignore_hidden_deps else 'deps_all'
+        return self._compute_closures(root_libs, is_excluded, name)
+
+
+    def compute_users_closures(self, root_libs, is_excluded,
+                               ignore_hidden_users=False):
+        """Compute the user closure of each lib in root_libs.  Yield
+        (lib, closure) pairs in the order of root_libs."""
+        name = 'users_good' if ignore_hidden_users else 'users_all'
+        return self._compute_closures(root_libs, is_excluded, name)
+
+
+    @staticmethod
+    def _find_strongly_connected_components(succs):
+        """Find the strongly connected components of the graph, where succs[i]
+        is the list of the successors of the node i.  The components are
+        returned in reverse topological order, i.e. the successors of a
+        component come before it."""
+        num_nodes = len(succs)
+        index = [-1] * num_nodes
+        lowlink = [0] * num_nodes
+        on_stack = [False] * num_nodes
+        stack = []
+        components = []
+        next_index = 0
+
+        # Tarjan's algorithm without recursion.
+        for root in range(num_nodes):
+            if index[root] >= 0:
+                continue
+            index[root] = lowlink[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(succs[root]))]
+            while work:
+                node, succ_iter = work[-1]
+                for succ in succ_iter:
+                    if index[succ] < 0:
+                        index[succ] = lowlink[succ] = next_index
+                        next_index += 1
+                        stack.append(succ)
+                        on_stack[succ] = True
+                        work.append((succ, iter(succs[succ])))
+                        break
+                    if on_stack[succ] and index[succ] < lowlink[node]:
+                        lowlink[node] = index[succ]
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        if lowlink[node] < lowlink[parent]:
+                            lowlink[parent] = lowlink[node]
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        return components
+
+
+    _ONE_BIT_PATTERN = re.compile('1')
+
+
+    @classmethod
+    def _get_bit_indices(cls, bits):
+        """Get the sorted indices of the bits that are set in bits."""
+        return [match.start() for match in
+                cls._ONE_BIT_PATTERN.finditer(bin(bits)[:1:-1])]
+
+
+    @classmethod
+    def compute_deps_layers(cls, libs):
+        """Compute the breadth-first layers of the dependencies (deps_all) of
+        each lib in libs, which must include all dependencies of the libs.
+        Return a list whose i-th element is the list of the layers of libs[i].
+        The k-th layer (counting from 0) is the sorted list of the indices of
+        the libs whose shortest distance from libs[i] is k + 1.  libs[i]
+        itself is not included."""
+        return [[list(layer) for layer in lib_layers]
+                for lib_layers in cls._compute_deps_layer_arrays(libs)]
+
+
+    @classmethod
+    def _compute_deps_layer_arrays(cls, libs):
+        """Compute the layers for compute_deps_layers() as arrays of the
+        indices, which are smaller than lists.
+
+        The libs at distance k from a lib are the libs at distance k - 1 from
+        its dependencies minus the libs at shorter distances, thus the layers
+        of all libs are computed depth by depth, and only the bitsets at the
+        previous depth are kept."""
+        num_libs = len(libs)
+        lib_ids = dict((lib, i) for i, lib in enumerate(libs))
+        succs = [sorted(set(lib_ids[dep] for dep in lib.deps_all))
+                 for lib in libs]
+
+        layers = [[] for _ in range(num_libs)]
+
+        # prev_layers[i] is the bitset of the libs whose shortest distance from
+        # libs[i] is depth - 1, and seen[i] is the bitset of the libs whose
+        # shortest distance from libs[i] is less than depth.
+        prev_layers = [1 << i for i in range(num_libs)]
+        active = [i for i in range(num_libs) if succs[i]]
+        seen = dict((i, prev_layers[i]) for i in active)
+        while active:
+            new_layers = []
+            for i in active:
+                layer = 0
+                for succ in succs[i]:
+                    layer |= prev_layers[succ]
+                new_layers.append(layer & ~seen[i])
+
+            prev_layers = [0] * num_libs
+            next_active = []
+            for i, layer in zip(active, new_layers):
+                if layer:
+                    layers[i].append(array('I', cls._get_bit_indices(layer)))
+                    prev_layers[i] = layer
+                    seen[i] |= layer
+                    next_active.append(i)
+                else:
+                    del seen[i]
+            active = next_active
+
+        return layers
 
 
     @staticmethod
@@ -2905,33 +5310,79 @@ class ELFLinker(object):
                          system_dirs_ignored, vendor_dirs,
                          vendor_dirs_as_system, vendor_dirs_ignored,
                          extra_deps, generic_refs, tagged_paths,
-                         vndk_lib_dirs, unzip_files):
+                         vndk_lib_dirs, unzip_files, jobs=1,
+                         elf_cache=None, resolve_symbols=True,
+                         incremental_graph=None):
         if vndk_lib_dirs is None:
             vndk_lib_dirs = VNDKLibDir.create_from_dirs(
                 system_dirs, vendor_dirs)
         ro_vndk_version = vndk_lib_dirs.find_vendor_vndk_version(vendor_dirs)
         graph = ELFLinker(tagged_paths, vndk_lib_dirs, ro_vndk_version)
 
+        # Load the state saved by the previous run.
+        state = None
+        files = None
+        if incremental_graph:
+            config = (
+                [os.path.abspath(path) for path in system_dirs or ()],
+                list(system_dirs_as_vendor or ()),
+                list(system_dirs_ignored or ()),
+                [os.path.abspath(path) for path in vendor_dirs or ()],
+                list(vendor_dirs_as_system or ()),
+                list(vendor_dirs_ignored or ()),
+                unzip_files, resolve_symbols,
+                generic_refs.get_digest() if generic_refs else None)
+            state = ELFLinkerState.load(incremental_graph, config)
+            files = dict()
+        prev_files = state.files if state is not None else None
+
+        def count_libs():
+            return sum(len(lib_set.lib32) + len(lib_set.lib64)
+                       for lib_set in graph.lib_pt)
+
         if system_dirs:
             for path in system_dirs:
-                graph.add_executables_in_dir(
-                    'system', PT_SYSTEM, path, PT_VENDOR,
-                    system_dirs_as_vendor, system_dirs_ignored,
-                    scan_elf_files, unzip_files)
+                with timed_phase('scan', 'system') as phase:
+                    num_libs = count_libs()
+                    graph.add_executables_in_dir(
+                        'system', PT_SYSTEM, path, PT_VENDOR,
+                        system_dirs_as_vendor, system_dirs_ignored,
+                        scan_elf_files, unzip_files, jobs, elf_cache,
+                        not resolve_symbols, prev_files, files)
+                    phase.count += count_libs() - num_libs
 
         if vendor_dirs:
             for path in vendor_dirs:
-                graph.add_executables_in_dir(
-                    'vendor', PT_VENDOR, path, PT_SYSTEM,
-                    vendor_dirs_as_system, vendor_dirs_ignored,
-                    scan_elf_files, unzip_files)
+                with timed_phase('scan', 'vendor') as phase:
+                    num_libs = count_libs()
+                    graph.add_executables_in_dir(
+                        'vendor', PT_VENDOR, path, PT_SYSTEM,
+                        vendor_dirs_as_system, vendor_dirs_ignored,
+                        scan_elf_files, unzip_files, jobs, elf_cache,
+                        not resolve_symbols, prev_files, files)
+                    phase.count += count_libs() - num_libs
 
         if extra_deps:
-            for path in extra_deps:
-                graph.add_dlopen_deps(path)
+            with timed_phase('load_extra_deps') as phase:
+                for path in extra_deps:
+                    graph.add_dlopen_deps(path)
+                    phase.count += 1
+
+        with timed_phase('rewrite_apex_modules'):
+            graph.rewrite_apex_modules()
+
+        with timed_phase('resolve_deps') as phase:
+            if state is not None:
+                graph.resolve_deps_incrementally(state, generic_refs,
+                                                 resolve_symbols, jobs)
+            else:
+                graph.resolve_deps(generic_refs, resolve_symbols, jobs)
+            phase.count += count_libs()
 
-        graph.rewrite_apex_modules()
-        graph.resolve_deps(generic_refs)
+        if incremental_graph:
+            with timed_phase('save_incremental_graph'):
+                ELFLinkerState.create(config, files, graph).save(
+                    incremental_graph)
 
         return graph
 
@@ -2941,12 +5392,174 @@ class ELFLinker(object):
                system_dirs_ignored=None, vendor_dirs=None,
                vendor_dirs_as_system=None, vendor_dirs_ignored=None,
                extra_deps=None, generic_refs=None, tagged_paths=None,
-               vndk_lib_dirs=None, unzip_files=True):
+               vndk_lib_dirs=None, unzip_files=True, jobs=1,
+               elf_cache=None, resolve_symbols=True, incremental_graph=None):
+        """Scan the ELF files and resolve the dependencies.  If
+        incremental_graph is specified, the graph is saved to the file, and
+        the next call with the same arguments only rescans the changed files
+        and re-resolves the libraries affected by them."""
         return ELFLinker._create_internal(
             scan_elf_files, system_dirs, system_dirs_as_vendor,
             system_dirs_ignored, vendor_dirs, vendor_dirs_as_system,
             vendor_dirs_ignored, extra_deps, generic_refs, tagged_paths,
-            vndk_lib_dirs, unzip_files)
+            vndk_lib_dirs, unzip_files, jobs, elf_cache, resolve_symbols,
+            incremental_graph)
+
+
+    # The graph file is a packed file (see PackedFileWriter), where libraries
+    # are referred by their indices as well.
+    GRAPH_MAGIC = b'VNDKGRPH'
+
+    GRAPH_FORMAT_VERSION = 1
+
+
+    def save_graph(self, path):
+        """Save the libraries and the resolved dependencies to a graph file,
+        which can be loaded with load_graph()."""
+        writer = PackedFileWriter()
+        ints = writer.ints
+        add_str = writer.add_str
+        add_strs = writer.add_strs
+        add_u64 = writer.add_u64
+
+        all_libs = list(self.all_libs())
+        index = dict((lib, i) for i, lib in enumerate(all_libs))
+
+        def add_libs(libs):
+            ints.append(len(libs))
+            ints.extend(sorted(index[lib] for lib in libs))
+
+        add_str(self.ro_vndk_version)
+        add_strs(list(self.vndk_lib_dirs))
+
+        ints.append(len(all_libs))
+        for lib in all_libs:
+            elf = lib.elf
+            ints.append(lib.partition)
+            add_str(lib.path)
+            ints.append(elf.ei_class)
+            ints.append(elf.ei_data)
+            ints.append(elf.e_machine)
+            add_u64(elf.file_size)
+            add_u64(elf.ro_seg_file_size)
+            add_u64(elf.ro_seg_mem_size)
+            add_u64(elf.rw_seg_file_size)
+            add_u64(elf.rw_seg_mem_size)
+            add_strs(elf.dt_rpath)
+            add_strs(elf.dt_runpath)
+            add_strs(elf.dt_needed)
+            add_strs(list(elf.exported_symbols))
+            add_strs(list(elf.imported_symbols))
+
+        for lib in all_libs:
+            add_libs(lib.deps_needed)
+            add_libs(lib.deps_needed_hidden)
+            add_libs(lib.deps_dlopen)
+            add_libs(lib.deps_dlopen_hidden)
+            add_strs(sorted(lib.unresolved_symbols))
+            add_strs(lib.unresolved_dt_needed)
+            ints.append(len(lib.linked_symbols))
+            for symbol, dep in lib.linked_symbols.items():
+                add_str(symbol)
+                ints.append(index[dep])
+
+        writer.save(path, self.GRAPH_MAGIC, self.GRAPH_FORMAT_VERSION)
+
+
+    @staticmethod
+    def load_graph(path, tag_file=None, generic_refs=None):
+        """Load the graph saved by save_graph().  The tags are read from
+        tag_file (or the minimum tag file) and imported_ext_symbols are
+        re-computed with generic_refs, thus they may differ from the ones
+        that were used when the graph was saved."""
+        reader = PackedFileReader(path, ELFLinker.GRAPH_MAGIC,
+                                  ELFLinker.GRAPH_FORMAT_VERSION, 'graph')
+        read_int = reader.read_int
+        read_str = reader.read_str
+        read_strs = reader.read_strs
+        read_u64 = reader.read_u64
+
+        with reader.reading():
+            ro_vndk_version = read_str()
+            vndk_lib_dirs = VNDKLibDir()
+            vndk_lib_dirs.extend(read_strs())
+
+        if tag_file:
+            tagged_paths = TaggedPathDict.create_from_csv_path(
+                tag_file, vndk_lib_dirs)
+        else:
+            tagged_paths = None
+
+        graph = ELFLinker(tagged_paths, vndk_lib_dirs, ro_vndk_version)
+
+        with reader.reading():
+            libs = []
+            for i in range(read_int()):
+                partition = read_int()
+                lib_path = read_str()
+                ei_class = read_int()
+                ei_data = read_int()
+                e_machine = read_int()
+                file_size = read_u64()
+                ro_seg_file_size = read_u64()
+                ro_seg_mem_size = read_u64()
+                rw_seg_file_size = read_u64()
+                rw_seg_mem_size = read_u64()
+                elf = ELF(ei_class, ei_data, e_machine, read_strs(),
+                          read_strs(), read_strs(), read_strs(), read_strs(),
+                          file_size, ro_seg_file_size, ro_seg_mem_size,
+                          rw_seg_file_size, rw_seg_mem_size)
+
+                # rewrite_apex_modules() renamed the libraries under
+                # /system/apex.  Add them with the scanned paths so that the
+                # tags and the apex module names are the same as the saved
+                # ones.
+                if lib_path.startswith('/apex/'):
+                    lib_path = '/system' + lib_path
+                libs.append(graph.add_lib(partition, lib_path, elf))
+
+        graph.rewrite_apex_modules()
+
+        def read_libs():
+            return [libs[read_int()] for i in range(read_int())]
+
+        with reader.reading():
+            for lib in libs:
+                for dep in read_libs():
+                    lib.add_needed_dep(dep)
+                for dep in read_libs():
+                    lib.add_needed_dep(dep)
+                    lib.hide_needed_dep(dep)
+                for dep in read_libs():
+                    lib.add_dlopen_dep(dep)
+                for dep in read_libs():
+                    lib.add_dlopen_dep(dep)
+                    lib.hide_dlopen_dep(dep)
+                lib.unresolved_symbols.update(read_strs())
+                lib.unresolved_dt_needed.extend(read_strs())
+                for j in range(read_int()):
+                    symbol = read_str()
+                    lib.linked_symbols[symbol] = libs[read_int()]
+
+        # Print the warnings for the unresolved DT_NEEDED entries without
+        # resolving any libs.
+        graph._resolve_elf_class_deps('lib', ELF.ELFCLASS32, None, False,
+                                      frozenset())
+        graph._resolve_elf_class_deps('lib64', ELF.ELFCLASS64, None, False,
+                                      frozenset())
+
+        if generic_refs:
+            for lib in libs:
+                for dep in itertools.chain(lib.deps_needed,
+                                           lib.deps_needed_hidden):
+                    if dep.path not in generic_refs.refs:
+                        lib.imported_ext_symbols[dep].update()
+                for symbol, dep in lib.linked_symbols.items():
+                    ref_lib = generic_refs.refs.get(dep.path)
+                    if not ref_lib or symbol not in ref_lib.exported_symbols:
+                        lib.imported_ext_symbols[dep].add(symbol)
+
+        return graph
 
 
 #------------------------------------------------------------------------------
@@ -2959,6 +5572,15 @@ class GenericRefs(object):
     EXPORT_SUPER_SET = 2
     MODIFIED = 3
 
+    # The packed generic reference file is a packed file (see
+    # PackedFileWriter), which starts with the list of all symbol names and the
+    # index of the library paths in sorted order.  They are followed by the ELF
+    # information of the libraries in the same order, where the symbols are
+    # referred by their indices in the list of symbol names.
+    PACKED_MAGIC = b'VNDKREFS'
+
+    PACKED_FORMAT_VERSION = 1
+
 
     def __init__(self):
         self.refs = dict()
@@ -2989,17 +5611,103 @@ class GenericRefs(object):
         return result
 
 
-    def _load_from_image_dir(self, root, prefix):
+    def save_packed(self, path):
+        """Save the references to a packed file, which can be loaded with
+        create_from_packed_file()."""
+        writer = PackedFileWriter()
+        lib_paths = sorted(self.refs)
+
+        symbols = set()
+        for elf in self.refs.values():
+            symbols.update(elf.exported_symbols)
+            symbols.update(elf.imported_symbols)
+        symbols = sorted(symbols)
+        symbol_indices = dict((symbol, i) for i, symbol in enumerate(symbols))
+
+        def add_symbols(symbol_set):
+            writer.add_ints(sorted(symbol_indices[symbol]
+                                   for symbol in symbol_set))
+
+        writer.add_strs(symbols)
+        writer.add_strs(lib_paths)
+        for lib_path in lib_paths:
+            elf = self.refs[lib_path]
+            writer.add_int(elf.ei_class)
+            writer.add_int(elf.ei_data)
+            writer.add_int(elf.e_machine)
+            writer.add_u64(elf.file_size)
+            writer.add_u64(elf.ro_seg_file_size)
+            writer.add_u64(elf.ro_seg_mem_size)
+            writer.add_u64(elf.rw_seg_file_size)
+            writer.add_u64(elf.rw_seg_mem_size)
+            writer.add_strs(elf.dt_rpath)
+            writer.add_strs(elf.dt_runpath)
+            writer.add_strs(elf.dt_needed)
+            add_symbols(elf.exported_symbols)
+            add_symbols(elf.imported_symbols)
+        writer.save(path, self.PACKED_MAGIC, self.PACKED_FORMAT_VERSION)
+
+
+    def _load_from_packed_file(self, path):
+        reader = PackedFileReader(path, self.PACKED_MAGIC,
+                                  self.PACKED_FORMAT_VERSION,
+                                  'generic reference')
+        read_int = reader.read_int
+        read_strs = reader.read_strs
+        read_u64 = reader.read_u64
+
+        with reader.reading():
+            # Look up the symbol IDs once for each symbol name.
+            get_id = SymbolSet.table.get_id
+            symbol_ids = [get_id(symbol) for symbol in read_strs()]
+
+            def read_symbols():
+                return SymbolSet.from_ids(array('I', sorted(
+                    symbol_ids[i] for i in reader.read_ints())))
+
+            for lib_path in read_strs():
+                ei_class = read_int()
+                ei_data = read_int()
+                e_machine = read_int()
+                file_size = read_u64()
+                ro_seg_file_size = read_u64()
+                ro_seg_mem_size = read_u64()
+                rw_seg_file_size = read_u64()
+                rw_seg_mem_size = read_u64()
+                self.add(lib_path, ELF(
+                    ei_class, ei_data, e_machine, read_strs(), read_strs(),
+                    read_strs(), read_symbols(), read_symbols(), file_size,
+                    ro_seg_file_size, ro_seg_mem_size, rw_seg_file_size,
+                    rw_seg_mem_size))
+
+
+    @staticmethod
+    def create_from_packed_file(path):
+        result = GenericRefs()
+        result._load_from_packed_file(path)
+        return result
+
+
+    @staticmethod
+    def create_from_path(path):
+        """Load the references from a packed file or a directory of .sym
+        files."""
+        if os.path.isfile(path):
+            return GenericRefs.create_from_packed_file(path)
+        return GenericRefs.create_from_sym_dir(path)
+
+
+    def _load_from_image_dir(self, root, prefix, jobs=1, elf_cache=None):
         root = os.path.abspath(root)
         root_len = len(root) + 1
-        for path, elf in scan_elf_files(root):
+        for path, elf in scan_elf_files(root, jobs=jobs, elf_cache=elf_cache):
             self.add(os.path.join(prefix, path[root_len:]), elf)
 
 
     @staticmethod
-    def create_from_image_dir(root, prefix):
+    def create_from_image_dir(root, prefix, jobs=1, elf_cache=None):
         result = GenericRefs()
-        result._load_from_image_dir(root, prefix)
+        result._load_from_image_dir(root, prefix, jobs, elf_cache)
         return result
 
 
@@ -3019,6 +5727,16 @@ class GenericRefs(object):
         return self.classify_lib(lib) == GenericRefs.EXPORT_EQUAL
 
 
+    def get_digest(self):
+        """Compute a digest of the paths and the exported symbols."""
+        digest = hashlib.sha1()
+        for path in sorted(self.refs):
+            digest.update(path.encode('utf-8') + b'\0')
+            for symbol in sorted(self.refs[path].exported_symbols):
+                digest.update(symbol.encode('utf-8') + b'\n')
+        return digest.hexdigest()
+
+
     def has_same_name_lib(self, lib):
         return os.path.basename(lib.path) in self._lib_names
 
@@ -3065,53 +5783,61 @@ def _enumerate_partition_paths(partition, root):
 
 
 def _enumerate_paths(system_dirs, vendor_dirs):
-    for root in system_dirs:
+    for root in system_dirs or ():
         for ap, path in _enumerate_partition_paths('system', root):
             yield (ap, path)
-    for root in vendor_dirs:
+    for root in vendor_dirs or ():
         for ap, path in _enumerate_partition_paths('vendor', root):
             yield (ap, path)
 
 
-def scan_apk_dep(graph, system_dirs, vendor_dirs):
-    libnames = _build_lib_names_dict(graph)
-    results = []
+# The MUTF-8 encoded strings to be found by _scan_apk_dep_worker().  It is set
+# by scan_apk_dep() before forking the workers.
+_scan_apk_dep_worker_strings = None
 
-    if str is bytes:
-        def decode(string):  # PY2
-            return string.decode('mutf-8').encode('utf-8')
-    else:
-        def decode(string):  # PY3
-            return string.decode('mutf-8')
 
-    for ap, path in _enumerate_paths(system_dirs, vendor_dirs):
-        # Read the dex file from various file formats
-        try:
-            dex_string_iter = DexFileReader.enumerate_dex_strings(path)
-            if dex_string_iter is None:
-                continue
+def _scan_apk_dep_worker(paths):
+    ap, path = paths
+    try:
+        strings = DexFileReader.find_dex_strings(
+            path, _scan_apk_dep_worker_strings, required=b'loadLibrary')
+    except FileNotFoundError:
+        return (ap, None)
+    except:
+        print('error: Failed to parse', path, file=sys.stderr)
+        raise
+    return (ap, sorted(strings) if strings is not None else None)
+
+
+def scan_apk_dep(graph, system_dirs, vendor_dirs, jobs=1):
+    global _scan_apk_dep_worker_strings
 
-            strings = set()
-            for string in dex_string_iter:
-                try:
-                    strings.add(decode(string))
-                except UnicodeSurrogateDecodeError:
-                    pass
-        except FileNotFoundError:
-            continue
-        except:
-            print('error: Failed to parse', path, file=sys.stderr)
-            raise
+    # Match the raw MUTF-8 strings in the dex files against the lib names, so
+    # that the other strings are not decoded.
+    libnames = dict((name.encode('mutf-8'), libs)
+                    for name, libs in _build_lib_names_dict(graph).items())
+    _scan_apk_dep_worker_strings = frozenset(libnames) | {b'loadLibrary'}
 
-        # Skip the file that does not call System.loadLibrary()
-        if 'loadLibrary' not in strings:
-            continue
+    # The workers read _scan_apk_dep_worker_strings, thus they must be forked
+    # after it is set.  Scan the files in this process if the platform cannot
+    # fork.
+    context = get_fork_context()
+    if context is None:
+        jobs = 1
 
-        # Collect libraries from string tables
-        libs = set()
-        for string in strings:
-            try:
-                for dep_file in libnames[string]:
+    results = []
+    try:
+        paths = _enumerate_paths(system_dirs, vendor_dirs)
+        for ap, strings in parallel_imap(_scan_apk_dep_worker, paths, jobs, 4,
+                                         context):
+            # Skip the file that does not call System.loadLibrary()
+            if not strings or b'loadLibrary' not in strings:
+                continue
+
+            # Collect libraries from string tables
+            libs = set()
+            for string in strings:
+                for dep_file in libnames.get(string, ()):
                     match = _APP_DIR_PATTERNS.match(dep_file.path)
 
                     # List the lib if it is not embedded in the app.
@@ -3124,11 +5850,11 @@ def scan_apk_dep(graph, system_dirs, vendor_dirs):
                     if len(common) > len(match.group(0)):
                         libs.add(dep_file)
                         continue
-            except KeyError:
-                pass
 
-        if libs:
-            results.append((ap, sorted_lib_path_list(libs)))
+            if libs:
+                results.append((ap, sorted_lib_path_list(libs)))
+    finally:
+        _scan_apk_dep_worker_strings = None
 
     results.sort()
     return results
@@ -3174,6 +5900,348 @@ class ModuleInfo(object):
             return ModuleInfo.load(f)
 
 
+#------------------------------------------------------------------------------
+# JSON Writer
+#------------------------------------------------------------------------------
+
+def write_json_array(fp, items):
+    """Write the items to fp as a JSON array.  The items are serialized one at a
+    time, thus the array is never built as a whole string.  The output is the
+    same as json.dumps(list(items))."""
+    fp.write('[')
+    for i, item in enumerate(items):
+        if i:
+            fp.write(', ')
+        fp.write(json.dumps(item))
+    fp.write(']')
+
+
+def write_json_array_shards(output_dir, name, items, shard_size, prefix,
+                            suffix):
+    """Split the items into shards with at most shard_size items and write
+    each shard as a JSON array (surrounded by prefix and suffix) to
+    ${name}-${index}.js in output_dir.  Return the list of the file names."""
+    items = iter(items)
+    file_names = []
+    while True:
+        shard = list(itertools.islice(items, shard_size))
+        if not shard:
+            break
+        file_name = '{}-{}.js'.format(name, len(file_names))
+        with open(os.path.join(output_dir, file_name), 'w') as f:
+            f.write(prefix)
+            write_json_array(f, shard)
+            f.write(suffix)
+        file_names.append(file_name)
+    return file_names
+
+
+#------------------------------------------------------------------------------
+# Graph Query Server
+#------------------------------------------------------------------------------
+
+class GraphQueryServer(object):
+    """Answer the queries on a linked graph, so that the graph is only built
+    once for many queries.  Each request is a JSON object on a line, e.g.
+    {"id": 1, "query": "deps", "lib": "/system/lib/libc.so"}.  Each response
+    is a JSON object on a line with the id of the request and either a
+    "result" or an "error"."""
+
+    _DEPS_KINDS = {
+        'all': 'all',
+        'good': 'good',
+        'needed': 'needed_all',
+        'dlopen': 'dlopen_all',
+    }
+
+
+    def __init__(self, graph, tagged_paths=None):
+        self.graph = graph
+        self.tagged_paths = tagged_paths
+        self._shutdown = False
+        self._queries = {
+            'libs': self._query_libs,
+            'deps': self._query_deps,
+            'users': self._query_users,
+            'closure': self._query_closure,
+            'unresolved': self._query_unresolved,
+            'tag': self._query_tag,
+            'symbols': self._query_symbols,
+            'shutdown': self._query_shutdown,
+        }
+
+
+    def _get_lib(self, path):
+        lib = self.graph.get_lib(path)
+        if lib is None:
+            raise ValueError('no such lib: {}'.format(path))
+        return lib
+
+
+    def _get_assoc_libs(self, request, prefix):
+        lib = self._get_lib(request['lib'])
+        kind = request.get('kind', 'all')
+        try:
+            kind = self._DEPS_KINDS[kind]
+        except KeyError:
+            raise ValueError('unknown kind: {}'.format(kind))
+        return sorted_lib_path_list(getattr(lib, prefix + kind))
+
+
+    def _query_libs(self, request):
+        path_filter = request.get('path_filter')
+        libs = self.graph.all_libs()
+        if path_filter:
+            path_filter = re.compile(path_filter)
+            libs = [lib for lib in libs if path_filter.match(lib.path)]
+        return sorted_lib_path_list(libs)
+
+
+    def _query_deps(self, request):
+        return self._get_assoc_libs(request, 'deps_')
+
+
+    def _query_users(self, request):
+        return self._get_assoc_libs(request, 'users_')
+
+
+    def _query_closure(self, request):
+        root_libs = set(self._get_lib(path) for path in request['libs'])
+        excluded_libs = set(self._get_lib(path)
+                            for path in request.get('exclude_libs', ()))
+
+        if request.get('exclude_ndk'):
+            def is_excluded_libs(lib):
+                return lib.is_ll_ndk or lib in excluded_libs
+        else:
+            def is_excluded_libs(lib):
+                return lib in excluded_libs
+
+        if request.get('revert'):
+            closure = self.graph.compute_users_closure(root_libs,
+                                                       is_excluded_libs)
+        else:
+            closure = self.graph.compute_deps_closure(root_libs,
+                                                      is_excluded_libs)
+        return sorted_lib_path_list(closure)
+
+
+    def _query_unresolved(self, request):
+        lib = self._get_lib(request['lib'])
+        return {
+            'dt_needed': sorted(lib.unresolved_dt_needed),
+            'symbols': sorted(lib.unresolved_symbols),
+        }
+
+
+    def _query_tag(self, request):
+        if self.tagged_paths is None:
+            raise ValueError('no tag file')
+        lib = self._get_lib(request['lib'])
+        return self.tagged_paths.get_path_tag(lib.path)
+
+
+    def _query_symbols(self, request):
+        lib = self._get_lib(request['lib'])
+        if 'dep' in request:
+            return lib.get_dep_linked_symbols(self._get_lib(request['dep']))
+        result = collections.defaultdict(list)
+        for symbol, dep in lib.linked_symbols.items():
+            result[dep.path].append(symbol)
+        for symbols in result.values():
+            symbols.sort()
+        return result
+
+
+    def _query_shutdown(self, request):
+        self._shutdown = True
+        return None
+
+
+    def handle_request(self, request):
+        """Answer a request and return the response."""
+        if not isinstance(request, dict):
+            return {'id': None, 'error': 'request must be a JSON object'}
+
+        response = {'id': request.get('id')}
+        try:
+            query = self._queries[request.get('query')]
+        except (KeyError, TypeError):
+            response['error'] = 'unknown query: {}'.format(request.get('query'))
+            return response
+
+        try:
+            response['result'] = query(request)
+        except KeyError as e:
+            response['error'] = 'missing field: {}'.format(e.args[0])
+        except (ValueError, TypeError, re.error) as e:
+            response['error'] = str(e)
+        return response
+
+
+    def handle_line(self, line):
+        """Answer a request in a JSON line (str or UTF-8 bytes) and return
+        the JSON response."""
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            request = json.loads(line)
+        except ValueError as e:
+            response = {'id': None, 'error': 'bad request: {}'.format(e)}
+        else:
+            response = self.handle_request(request)
+        return json.dumps(response, sort_keys=True)
+
+
+    def serve(self, input_file, output_file):
+        """Answer the requests from input_file until the end of file or a
+        shutdown query."""
+        while True:
+            line = input_file.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            output_file.write(self.handle_line(line) + '\n')
+            output_file.flush()
+            if self._shutdown:
+                break
+
+
+    def serve_unix_socket(self, path):
+        """Answer the requests from the connections to the UNIX socket at the
+        path one at a time until a shutdown query."""
+        server_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        bound = False
+        try:
+            server_sock.bind(path)
+            bound = True
+            server_sock.listen(8)
+            while not self._shutdown:
+                sock, _ = server_sock.accept()
+                try:
+                    # Read bytes, so that the lines which are not valid UTF-8
+                    # are answered with errors by handle_line().
+                    input_file = sock.makefile('rb')
+                    if sys.version_info >= (3, 0):
+                        output_file = sock.makefile('w', encoding='utf-8')
+                    else:
+                        output_file = sock.makefile('w')
+                    try:
+                        self.serve(input_file, output_file)
+                    finally:
+                        input_file.close()
+                        output_file.close()
+                except (IOError, OSError) as e:
+                    print('warning: Connection closed: {}'.format(e),
+                          file=sys.stderr)
+                finally:
+                    sock.close()
+        finally:
+            server_sock.close()
+            # Do not remove the file of another server if bind() failed.
+            if bound and os.path.exists(path):
+                os.unlink(path)
+
+
+#------------------------------------------------------------------------------
+# Graph Diff
+#------------------------------------------------------------------------------
+
+LibDiff = collections.namedtuple(
+    'LibDiff',
+    'path added_deps removed_deps added_unresolved_symbols '
+    'added_exported_symbols removed_exported_symbols')
+
+
+class GraphDiff(object):
+    """GraphDiff compares two linked graphs.  The libraries are matched by
+    path.  The dependencies, the exported symbols, and the unresolved symbols
+    of each library are checked for equality first, so that the differences
+    are only computed for the changed libraries."""
+
+    def __init__(self, base_graph, graph):
+        self.added_libs = []
+        self.removed_libs = []
+        self.changed_libs = []
+        self.num_unchanged_libs = 0
+
+        base_libs = dict((lib.path, lib) for lib in base_graph.all_libs())
+        for lib in graph.all_libs():
+            base_lib = base_libs.pop(lib.path, None)
+            if base_lib is None:
+                self.added_libs.append(lib.path)
+                continue
+            lib_diff = None
+            if not self._is_lib_unchanged(base_lib, lib):
+                lib_diff = self._diff_lib(base_lib, lib)
+            if lib_diff is None:
+                self.num_unchanged_libs += 1
+            else:
+                self.changed_libs.append(lib_diff)
+        self.removed_libs.extend(base_libs)
+
+        self.added_libs.sort()
+        self.removed_libs.sort()
+        self.changed_libs.sort()
+
+
+    @staticmethod
+    def _is_lib_unchanged(base_lib, lib):
+        return (base_lib.elf.exported_symbols == lib.elf.exported_symbols and
+                base_lib.unresolved_symbols == lib.unresolved_symbols and
+                set(dep.path for dep in base_lib.deps_needed_all) ==
+                set(dep.path for dep in lib.deps_needed_all))
+
+
+    @staticmethod
+    def _diff_lib(base_lib, lib):
+        """Compare two libraries with the same path.  Return a LibDiff or None
+        if there are no differences to report."""
+        base_deps = set(dep.path for dep in base_lib.deps_needed_all)
+        deps = set(dep.path for dep in lib.deps_needed_all)
+        base_exported = base_lib.elf.exported_symbols
+        exported = lib.elf.exported_symbols
+        lib_diff = LibDiff(
+            lib.path, sorted(deps - base_deps), sorted(base_deps - deps),
+            sorted(lib.unresolved_symbols - base_lib.unresolved_symbols),
+            sorted(exported.difference(base_exported)),
+            sorted(base_exported.difference(exported)))
+        if any(lib_diff[1:]):
+            return lib_diff
+        return None
+
+
+    def dump(self, fp):
+        for path in self.added_libs:
+            print('ADDED:', path, file=fp)
+        for path in self.removed_libs:
+            print('REMOVED:', path, file=fp)
+        for lib_diff in self.changed_libs:
+            print('CHANGED:', lib_diff.path, file=fp)
+            for dep in lib_diff.added_deps:
+                print('\tADDED_DT_NEEDED:', dep, file=fp)
+            for dep in lib_diff.removed_deps:
+                print('\tREMOVED_DT_NEEDED:', dep, file=fp)
+            for symbol in lib_diff.added_unresolved_symbols:
+                print('\tNEW_UNRESOLVED_SYMBOL:', symbol, file=fp)
+            for symbol in lib_diff.added_exported_symbols:
+                print('\tADDED_EXP_SYMBOL:', symbol, file=fp)
+            for symbol in lib_diff.removed_exported_symbols:
+                print('\tREMOVED_EXP_SYMBOL:', symbol, file=fp)
+
+
+    def to_json(self):
+        return {
+            'added_libs': self.added_libs,
+            'removed_libs': self.removed_libs,
+            'changed_libs': [lib_diff._asdict()
+                             for lib_diff in self.changed_libs],
+            'num_unchanged_libs': self.num_unchanged_libs,
+        }
+
+
 #------------------------------------------------------------------------------
 # Commands
 #------------------------------------------------------------------------------
@@ -3211,6 +6279,11 @@ class ELFDumpCommand(Command):
 
 
 class CreateGenericRefCommand(Command):
+    _WRITE_BATCH_SIZE = 256
+
+    _PROGRESS_INTERVAL = 5.0
+
+
     def __init__(self):
         super(CreateGenericRefCommand, self).__init__(
             'create-generic-ref', help='Create generic references')
@@ -3222,18 +6295,88 @@ class CreateGenericRefCommand(Command):
         parser.add_argument('-o', '--output', required=True,
                             help='output directory')
 
+        parser.add_argument(
+            '--packed', action='store_true',
+            help='write a packed generic reference file to the output path '
+                 'instead of .sym files')
+
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='number of worker processes to scan ELF files')
+
+        parser.add_argument(
+            '--elf-cache',
+            help='directory to cache parsed ELF files across runs')
+
+
+    @staticmethod
+    def _write_sym_files(output_dir, batch, created_dirs):
+        """Dump a batch of (name, elf) pairs to .sym files and clear the
+        batch.  created_dirs keeps the directories that have been created."""
+        for name, elf in batch:
+            out = os.path.join(output_dir, name) + '.sym'
+            out_dir = os.path.dirname(out)
+            if out_dir not in created_dirs:
+                makedirs(out_dir, exist_ok=True)
+                created_dirs.add(out_dir)
+            with open(out, 'w') as f:
+                elf.dump(f)
+        del batch[:]
+
 
     def main(self, args):
         root = os.path.abspath(args.dir)
         print(root)
         prefix_len = len(root) + 1
-        for path, elf in scan_elf_files(root):
+        elf_cache = ELFCache(args.elf_cache) if args.elf_cache else None
+        generic_refs = GenericRefs() if args.packed else None
+        batch = []
+        created_dirs = set()
+        num_elfs = 0
+        start_time = time.time()
+        next_progress_time = start_time + self._PROGRESS_INTERVAL
+        for path, elf in scan_elf_files(root, jobs=args.jobs,
+                                        elf_cache=elf_cache):
             name = path[prefix_len:]
-            print('Processing:', name, file=sys.stderr)
-            out = os.path.join(args.output, name) + '.sym'
-            makedirs(os.path.dirname(out), exist_ok=True)
-            with open(out, 'w') as f:
-                elf.dump(f)
+            num_elfs += 1
+            if generic_refs is not None:
+                generic_refs.add('/' + name, elf)
+            else:
+                batch.append((name, elf))
+                if len(batch) >= self._WRITE_BATCH_SIZE:
+                    self._write_sym_files(args.output, batch, created_dirs)
+
+            now = time.time()
+            if now >= next_progress_time:
+                print('Processed {} ELF files'.format(num_elfs),
+                      file=sys.stderr)
+                next_progress_time = now + self._PROGRESS_INTERVAL
+
+        if generic_refs is not None:
+            generic_refs.save_packed(args.output)
+        else:
+            self._write_sym_files(args.output, batch, created_dirs)
+        print('Created generic references for {} ELF files in {:.1f}s'
+              .format(num_elfs, time.time() - start_time), file=sys.stderr)
+        return 0
+
+
+class PackGenericRefCommand(Command):
+    def __init__(self):
+        super(PackGenericRefCommand, self).__init__(
+            'pack-generic-ref',
+            help='Convert generic references (.sym files) to a packed file')
+
+
+    def add_argparser_options(self, parser):
+        parser.add_argument('dir', help='directory of .sym files')
+
+        parser.add_argument('-o', '--output', required=True,
+                            help='output file')
+
+
+    def main(self, args):
+        GenericRefs.create_from_sym_dir(args.dir).save_packed(args.output)
         return 0
 
 
@@ -3269,7 +6412,8 @@ class ELFGraphCommand(Command):
 
         parser.add_argument(
             '--load-generic-refs',
-            help='compare with generic reference symbols')
+            help='compare with generic reference symbols (a directory of '
+                 '.sym files or a packed file)')
 
         parser.add_argument(
             '--aosp-system',
@@ -3287,13 +6431,71 @@ class ELFGraphCommand(Command):
             '--tag-file', required=is_tag_file_required,
             help='lib tag file')
 
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='number of worker processes to scan ELF files and resolve '
+                 'dependencies')
+
+        parser.add_argument(
+            '--elf-cache',
+            help='directory to cache parsed ELF files across runs')
+
+        parser.add_argument(
+            '--incremental-graph',
+            help='file to save the linked graph, so that the next run only '
+                 'rescans the changed files and re-resolves the affected '
+                 'libraries')
+
+        parser.add_argument(
+            '--graph',
+            help='load the linked graph saved with --save-graph instead of '
+                 'scanning --system and --vendor')
+
+        parser.add_argument(
+            '--save-graph',
+            help='save the linked graph to the file')
+
+        parser.add_argument(
+            '--profile', action='store_true',
+            help='print the wall time, the CPU time, the peak RSS, and the '
+                 'number of items of each phase to stderr')
+
+        parser.add_argument(
+            '--timings-json',
+            help='write the timings of each phase to the JSON file')
+
+        parser.add_argument(
+            '--cprofile',
+            help='write the cProfile statistics of the command to the file')
+
+
+    def is_symbol_resolution_required(self, args):
+        """Whether the command reads linked or unresolved symbols.  Commands
+        that only need DT_NEEDED dependencies may override this to skip
+        .dynsym parsing and symbol resolution."""
+        return True
+
+
+    def get_elf_cache_from_args(self, args):
+        if args.elf_cache:
+            return ELFCache(args.elf_cache)
+        return None
+
 
     def get_generic_refs_from_args(self, args):
         if args.load_generic_refs:
-            return GenericRefs.create_from_sym_dir(args.load_generic_refs)
+            with timed_phase('load_generic_refs') as phase:
+                generic_refs = GenericRefs.create_from_path(
+                    args.load_generic_refs)
+                phase.count += len(generic_refs.refs)
+            return generic_refs
         if args.aosp_system:
-            return GenericRefs.create_from_image_dir(
-                args.aosp_system, '/system')
+            with timed_phase('load_generic_refs') as phase:
+                generic_refs = GenericRefs.create_from_image_dir(
+                    args.aosp_system, '/system', args.jobs,
+                    self.get_elf_cache_from_args(args))
+                phase.count += len(generic_refs.refs)
+            return generic_refs
         return None
 
 
@@ -3310,8 +6512,18 @@ class ELFGraphCommand(Command):
 
 
     def check_dirs_from_args(self, args):
-        self._check_arg_dir_exists('--system', args.system)
-        self._check_arg_dir_exists('--vendor', args.vendor)
+        self._check_arg_dir_exists('--system', args.system or ())
+        self._check_arg_dir_exists('--vendor', args.vendor or ())
+
+
+    def check_apk_dirs_from_args(self, args):
+        """Check that the partition dirs are specified for the APK scan,
+        because the APK files are not saved in the graph file."""
+        if not args.system and not args.vendor:
+            print('error: --system or --vendor must be specified to scan APK '
+                  'files (the APK files are not saved with --save-graph)',
+                  file=sys.stderr)
+            sys.exit(1)
 
 
     def create_from_args(self, args):
@@ -3319,14 +6531,30 @@ class ELFGraphCommand(Command):
 
         generic_refs = self.get_generic_refs_from_args(args)
 
+        if args.graph:
+            with timed_phase('load_graph') as phase:
+                graph = ELFLinker.load_graph(args.graph, args.tag_file,
+                                             generic_refs)
+                phase.count += sum(1 for _ in graph.all_libs())
+            tagged_paths = graph.tagged_paths if args.tag_file else None
+            if args.save_graph:
+                with timed_phase('save_graph'):
+                    graph.save_graph(args.save_graph)
+            return (generic_refs, graph, tagged_paths, graph.vndk_lib_dirs)
+
         vndk_lib_dirs = VNDKLibDir.create_from_dirs(args.system, args.vendor)
 
         if args.tag_file:
-            tagged_paths = TaggedPathDict.create_from_csv_path(
-                args.tag_file, vndk_lib_dirs)
+            with timed_phase('load_tag_file'):
+                tagged_paths = TaggedPathDict.create_from_csv_path(
+                    args.tag_file, vndk_lib_dirs)
         else:
             tagged_paths = None
 
+        # The saved graph must have the symbols for all commands.
+        resolve_symbols = (self.is_symbol_resolution_required(args) or
+                           bool(args.save_graph))
+
         graph = ELFLinker.create(args.system, args.system_dir_as_vendor,
                                  args.system_dir_ignored,
                                  args.vendor, args.vendor_dir_as_system,
@@ -3334,7 +6562,15 @@ class ELFGraphCommand(Command):
                                  args.load_extra_deps,
                                  generic_refs=generic_refs,
                                  tagged_paths=tagged_paths,
-                                 unzip_files=args.unzip_files)
+                                 unzip_files=args.unzip_files,
+                                 jobs=args.jobs,
+                                 elf_cache=self.get_elf_cache_from_args(args),
+                                 resolve_symbols=resolve_symbols,
+                                 incremental_graph=args.incremental_graph)
+
+        if args.save_graph:
+            with timed_phase('save_graph'):
+                graph.save_graph(args.save_graph)
 
         return (generic_refs, graph, tagged_paths, vndk_lib_dirs)
 
@@ -3558,20 +6794,22 @@ class VNDKCommand(VNDKCommandBase):
             self._warn_incorrect_partition(graph)
 
         # Compute vndk heuristics.
-        vndk_lib = graph.compute_degenerated_vndk(
-            generic_refs, tagged_paths, args.action_ineligible_vndk_sp,
-            args.action_ineligible_vndk)
-
-        # Print results.
-        if args.output_format == 'make':
-            self._print_make(vndk_lib)
-        else:
-            self._print_tags(vndk_lib, args.full)
+        with timed_phase('compute_degenerated_vndk'):
+            vndk_lib = graph.compute_degenerated_vndk(
+                generic_refs, tagged_paths, args.action_ineligible_vndk_sp,
+                args.action_ineligible_vndk)
+
+        with timed_phase('output'):
+            # Print results.
+            if args.output_format == 'make':
+                self._print_make(vndk_lib)
+            else:
+                self._print_tags(vndk_lib, args.full)
 
-        # Calculate and print file sizes.
-        if args.file_size_output:
-            with open(args.file_size_output, 'w') as fp:
-                self._print_file_size_output(graph, vndk_lib, file=fp)
+            # Calculate and print file sizes.
+            if args.file_size_output:
+                with open(args.file_size_output, 'w') as fp:
+                    self._print_file_size_output(graph, vndk_lib, file=fp)
         return 0
 
 
@@ -3589,9 +6827,24 @@ class DepsInsightCommand(VNDKCommandBase):
         parser.add_argument('-o', '--output', required=True,
                             help='output directory')
 
+        parser.add_argument(
+            '--shard-size', type=int, default=0,
+            help='split the module records into files with at most this '
+                 'number of records, which are loaded by the viewer one by one')
+
 
     @staticmethod
     def serialize_data(libs, vndk_lib, module_info):
+        strs, mods = DepsInsightCommand.iter_serialized_data(
+            libs, vndk_lib, module_info)
+        return (strs, list(mods))
+
+
+    @staticmethod
+    def iter_serialized_data(libs, vndk_lib, module_info):
+        """Serialize the libs into a string table and an iterator of module
+        records.  The string table is complete when this function returns,
+        and the module records are created when they are iterated."""
         strs = []
         strs_dict = dict()
 
@@ -3610,28 +6863,16 @@ class DepsInsightCommand(VNDKCommandBase):
         def collect_path_sorted_lib_idxs(libs):
             return [libs_dict[lib] for lib in sorted(libs)]
 
-        def collect_deps(lib):
-            queue = list(lib.deps_all)
-            visited = set(queue)
-            visited.add(lib)
-            deps = []
-
-            # Traverse dependencies with breadth-first search.
-            while queue:
-                # Collect dependencies for next queue.
-                next_queue = []
-                for lib in queue:
-                    for dep in lib.deps_all:
-                        if dep not in visited:
-                            next_queue.append(dep)
-                            visited.add(dep)
-
-                # Append current queue to result.
-                deps.append(collect_path_sorted_lib_idxs(queue))
+        deps_layers = ELFLinker._compute_deps_layer_arrays(libs)
 
-                queue = next_queue
-
-            return deps
+        def collect_deps(lib):
+            # The first layer lists the direct dependencies as they are (a lib
+            # linked by both NEEDED and DLOPEN is listed twice).
+            first_layer = collect_path_sorted_lib_idxs(lib.deps_all)
+            if not first_layer:
+                return []
+            return [first_layer] + [
+                list(layer) for layer in deps_layers[libs_dict[lib]][1:]]
 
         def collect_source_dir_paths(lib):
             return [get_str_idx(path)
@@ -3644,16 +6885,21 @@ class DepsInsightCommand(VNDKCommandBase):
                     tags.append(get_str_idx(field_name))
             return tags
 
-        mods = []
-        for lib in libs:
-            mods.append([get_str_idx(lib.path),
-                         32 if lib.elf.is_32bit else 64,
-                         collect_tags(lib),
-                         collect_deps(lib),
-                         collect_path_sorted_lib_idxs(lib.users_all),
-                         collect_source_dir_paths(lib)])
+        # Collect the strings in the same order as the module records.
+        lib_strs = [(get_str_idx(lib.path), collect_tags(lib),
+                     collect_source_dir_paths(lib)) for lib in libs]
+
+        def iter_mods():
+            for lib, (path_idx, tags, source_dir_paths) in \
+                    zip(libs, lib_strs):
+                yield [path_idx,
+                       32 if lib.elf.is_32bit else 64,
+                       tags,
+                       collect_deps(lib),
+                       collect_path_sorted_lib_idxs(lib.users_all),
+                       source_dir_paths]
 
-        return (strs, mods)
+        return (strs, iter_mods())
 
 
     def main(self, args):
@@ -3662,12 +6908,20 @@ class DepsInsightCommand(VNDKCommandBase):
         module_info = ModuleInfo.load_from_path_or_default(args.module_info)
 
         # Compute vndk heuristics.
-        vndk_lib = graph.compute_degenerated_vndk(
-            generic_refs, tagged_paths, args.action_ineligible_vndk_sp,
-            args.action_ineligible_vndk)
+        with timed_phase('compute_degenerated_vndk'):
+            vndk_lib = graph.compute_degenerated_vndk(
+                generic_refs, tagged_paths, args.action_ineligible_vndk_sp,
+                args.action_ineligible_vndk)
 
+        with timed_phase('output'):
+            self._write_output(args, graph, vndk_lib, module_info)
+
+        return 0
+
+
+    def _write_output(self, args, graph, vndk_lib, module_info):
         # Serialize data.
-        strs, mods = self.serialize_data(
+        strs, mods = self.iter_serialized_data(
             list(graph.all_libs()), vndk_lib, module_info)
 
         # Generate output files.
@@ -3679,14 +6933,24 @@ class DepsInsightCommand(VNDKCommandBase):
                 os.path.join(args.output, name))
 
         with open(os.path.join(args.output, 'insight-data.js'), 'w') as f:
-            f.write('''(function () {
+            if args.shard_size > 0:
+                shards = write_json_array_shards(
+                    args.output, 'insight-data', mods, args.shard_size,
+                    'insight.addModules(', ');\n')
+                f.write('''(function () {
     var strs = ''' + json.dumps(strs) + ''';
-    var mods = ''' + json.dumps(mods) + ''';
+    var shards = ''' + json.dumps(shards) + ''';
+    insight.initShards(document, strs, shards);
+})();''')
+            else:
+                f.write('''(function () {
+    var strs = ''' + json.dumps(strs) + ''';
+    var mods = ''')
+                write_json_array(f, mods)
+                f.write(''';
     insight.init(document, strs, mods);
 })();''')
 
-        return 0
-
 
 class DepsCommand(ELFGraphCommand):
     def __init__(self):
@@ -3716,6 +6980,10 @@ class DepsCommand(ELFGraphCommand):
         parser.add_argument('--module-info')
 
 
+    def is_symbol_resolution_required(self, args):
+        return args.symbols
+
+
     def main(self, args):
         _, graph, _, _ = self.create_from_args(args)
 
@@ -3798,6 +7066,10 @@ class DepsClosureCommand(ELFGraphCommand):
                             help='print closure for each lib instead of union')
 
 
+    def is_symbol_resolution_required(self, args):
+        return False
+
+
     def print_deps_closure(self, root_libs, graph, is_excluded_libs,
                            is_reverted, indent):
         if is_reverted:
@@ -3832,10 +7104,16 @@ class DepsClosureCommand(ELFGraphCommand):
         else:
             if not root_libs:
                 root_libs = list(graph.all_libs())
-            for lib in sorted(root_libs):
+            if args.revert:
+                closures = graph.compute_users_closures(
+                    sorted(root_libs), is_excluded_libs)
+            else:
+                closures = graph.compute_deps_closures(
+                    sorted(root_libs), is_excluded_libs)
+            for lib, closure in closures:
                 print(lib.path)
-                self.print_deps_closure({lib}, graph, is_excluded_libs,
-                                        args.revert, '\t')
+                for path in sorted_lib_path_list(closure):
+                    print('\t' + path)
         return 0
 
 
@@ -3888,9 +7166,11 @@ class ApkDepsCommand(ELFGraphCommand):
 
 
     def main(self, args):
+        self.check_apk_dirs_from_args(args)
+
         _, graph, _, _ = self.create_from_args(args)
 
-        apk_deps = scan_apk_dep(graph, args.system, args.vendor)
+        apk_deps = scan_apk_dep(graph, args.system, args.vendor, args.jobs)
 
         for apk_path, dep_paths in apk_deps:
             print(apk_path)
@@ -4055,7 +7335,8 @@ class CheckDepCommand(CheckDepCommandBase):
         return num_errors
 
 
-    def _check_apk_dep(self, graph, system_dirs, vendor_dirs, module_info):
+    def _check_apk_dep(self, graph, system_dirs, vendor_dirs, module_info,
+                       jobs=1):
         num_errors = 0
 
         def is_in_system_partition(path):
@@ -4063,7 +7344,7 @@ class CheckDepCommand(CheckDepCommandBase):
                    path.startswith('/product/') or \
                    path.startswith('/oem/')
 
-        apk_deps = scan_apk_dep(graph, system_dirs, vendor_dirs)
+        apk_deps = scan_apk_dep(graph, system_dirs, vendor_dirs, jobs)
 
         for apk_path, dep_paths in apk_deps:
             apk_in_system = is_in_system_partition(apk_path)
@@ -4082,6 +7363,9 @@ class CheckDepCommand(CheckDepCommandBase):
 
 
     def main(self, args):
+        if args.check_apk:
+            self.check_apk_dirs_from_args(args)
+
         generic_refs, graph, tagged_paths, vndk_lib_dirs = \
             self.create_from_args(args)
 
@@ -4105,11 +7389,115 @@ class CheckDepCommand(CheckDepCommandBase):
 
         if args.check_apk:
             num_errors += self._check_apk_dep(graph, args.system, args.vendor,
-                                              module_info)
+                                              module_info, args.jobs)
 
         return 0 if num_errors == 0 else 1
 
 
+class ServeCommand(ELFGraphCommand):
+    def __init__(self):
+        super(ServeCommand, self).__init__(
+            'serve', help='Answer graph queries in JSON lines')
+
+
+    def add_argparser_options(self, parser):
+        super(ServeCommand, self).add_argparser_options(parser)
+
+        parser.add_argument(
+            '--socket',
+            help='path to the UNIX socket to listen on (default: answer the '
+                 'queries from stdin)')
+
+
+    def main(self, args):
+        _, graph, tagged_paths, _ = self.create_from_args(args)
+
+        server = GraphQueryServer(graph, tagged_paths)
+        if args.socket:
+            server.serve_unix_socket(args.socket)
+        else:
+            server.serve(sys.stdin, sys.stdout)
+        return 0
+
+
+class GraphDiffCommand(ELFGraphCommand):
+    def __init__(self):
+        super(GraphDiffCommand, self).__init__(
+            'graph-diff', help='Compare the linked graphs of two images')
+
+
+    def add_argparser_options(self, parser):
+        super(GraphDiffCommand, self).add_argparser_options(parser)
+
+        parser.add_argument(
+            '--base-graph',
+            help='load the base graph saved with --save-graph')
+
+        parser.add_argument(
+            '--base-system', action='append',
+            help='path to system partition contents of the base image')
+
+        parser.add_argument(
+            '--base-vendor', action='append',
+            help='path to vendor partition contents of the base image')
+
+        parser.add_argument(
+            '--json', action='store_true',
+            help='print the differences in JSON')
+
+
+    def check_dirs_from_args(self, args):
+        super(GraphDiffCommand, self).check_dirs_from_args(args)
+        self._check_arg_dir_exists('--base-system', args.base_system or ())
+        self._check_arg_dir_exists('--base-vendor', args.base_vendor or ())
+
+
+    def create_base_graph_from_args(self, args):
+        if args.base_graph:
+            with timed_phase('load_graph') as phase:
+                graph = ELFLinker.load_graph(args.base_graph)
+                phase.count += sum(1 for _ in graph.all_libs())
+            return graph
+
+        return ELFLinker.create(args.base_system, args.system_dir_as_vendor,
+                                args.system_dir_ignored,
+                                args.base_vendor, args.vendor_dir_as_system,
+                                args.vendor_dir_ignored,
+                                args.load_extra_deps,
+                                unzip_files=args.unzip_files,
+                                jobs=args.jobs,
+                                elf_cache=self.get_elf_cache_from_args(args))
+
+
+    def main(self, args):
+        if not (args.base_graph or args.base_system or args.base_vendor):
+            print('error: --base-graph, --base-system, or --base-vendor must '
+                  'be specified', file=sys.stderr)
+            return 1
+
+        base_graph = self.create_base_graph_from_args(args)
+        _, graph, _, _ = self.create_from_args(args)
+
+        with timed_phase('diff') as phase:
+            graph_diff = GraphDiff(base_graph, graph)
+            phase.count += (len(graph_diff.changed_libs) +
+                            graph_diff.num_unchanged_libs)
+
+        with timed_phase('output'):
+            if args.json:
+                json.dump(graph_diff.to_json(), sys.stdout, indent=2,
+                          sort_keys=True)
+                print()
+            else:
+                graph_diff.dump(sys.stdout)
+
+        summary = '{} added, {} removed, {} changed, {} unchanged libs'.format(
+            len(graph_diff.added_libs), len(graph_diff.removed_libs),
+            len(graph_diff.changed_libs), graph_diff.num_unchanged_libs)
+        print(summary, file=sys.stderr)
+        return 0
+
+
 class DumpDexStringCommand(Command):
     def __init__(self):
         super(DumpDexStringCommand, self).__init__(
@@ -4144,6 +7532,11 @@ class DepGraphCommand(ELFGraphCommand):
         parser.add_argument('-o', '--output', required=True,
                             help='output directory')
 
+        parser.add_argument(
+            '--shard-size', type=int, default=0,
+            help='split the dependency records into files with at most this '
+                 'number of records, which are loaded by the viewer one by one')
+
 
     @staticmethod
     def _create_tag_hierarchy():
@@ -4176,41 +7569,50 @@ class DepGraphCommand(ELFGraphCommand):
 
 
     def _get_dep_graph(self, graph, tagged_paths):
+        """Build violate_libs and an iterator of the dependency records, which
+        are created when they are iterated."""
         hierarchy = self._create_tag_hierarchy()
 
-        # Build data and violate_libs.
-        data = []
+        def get_lib_tag(lib):
+            return self._get_lib_tag(hierarchy, tagged_paths, lib)
+
+        # Count the violations and build violate_libs.
+        entries = []
         violate_libs = collections.defaultdict(list)
 
         for lib in graph.all_libs():
-            lib_tag = self._get_lib_tag(hierarchy, tagged_paths, lib)
-            lib_item = {
-                'name': lib.path,
-                'tag': lib_tag,
-                'depends': [],
-                'violates': [],
-            }
+            lib_tag = get_lib_tag(lib)
             violate_count = 0
             for dep in lib.deps_all:
-                dep_tag = self._get_lib_tag(hierarchy, tagged_paths, dep)
-                if self._is_dep_allowed(lib_tag, dep_tag):
-                    lib_item['depends'].append(dep.path)
-                else:
-                    lib_item['violates'].append([
-                        dep.path, lib.get_dep_linked_symbols(dep)])
+                if not self._is_dep_allowed(lib_tag, get_lib_tag(dep)):
                     violate_count += 1
-            lib_item['violate_count'] = violate_count
             if violate_count > 0:
                 violate_libs[lib_tag].append((lib.path, violate_count))
-            data.append(lib_item)
+            entries.append((lib_tag, violate_count, lib))
 
         # Sort data and violate_libs.
-        data.sort(
-            key=lambda lib_item: (lib_item['tag'], lib_item['violate_count']))
+        entries.sort(key=lambda entry: entry[0:2])
         for libs in violate_libs.values():
             libs.sort(key=lambda violate_item: violate_item[1], reverse=True)
 
-        return data, violate_libs
+        def iter_data():
+            for lib_tag, violate_count, lib in entries:
+                lib_item = {
+                    'name': lib.path,
+                    'tag': lib_tag,
+                    'depends': [],
+                    'violates': [],
+                }
+                for dep in lib.deps_all:
+                    if self._is_dep_allowed(lib_tag, get_lib_tag(dep)):
+                        lib_item['depends'].append(dep.path)
+                    else:
+                        lib_item['violates'].append([
+                            dep.path, lib.get_dep_linked_symbols(dep)])
+                lib_item['violate_count'] = violate_count
+                yield lib_item
+
+        return iter_data(), violate_libs
 
 
     def main(self, args):
@@ -4218,6 +7620,14 @@ class DepGraphCommand(ELFGraphCommand):
 
         data, violate_libs = self._get_dep_graph(graph, tagged_paths)
 
+        with timed_phase('output'):
+            self._write_output(args, data, violate_libs)
+
+        return 0
+
+
+    @staticmethod
+    def _write_output(args, data, violate_libs):
         makedirs(args.output, exist_ok=True)
         script_dir = os.path.dirname(os.path.abspath(__file__))
         for name in ('index.html', 'dep-graph.js', 'dep-graph.css'):
@@ -4225,9 +7635,58 @@ class DepGraphCommand(ELFGraphCommand):
                             os.path.join(args.output, name))
         with open(os.path.join(args.output, 'dep-data.js'), 'w') as f:
             f.write('var violatedLibs = ' + json.dumps(violate_libs) + ';\n')
-            f.write('var depData = ' + json.dumps(data) + ';\n')
-
-        return 0
+            if args.shard_size > 0:
+                shards = write_json_array_shards(
+                    args.output, 'dep-data', data, args.shard_size,
+                    'depData = depData.concat(', ');\n')
+                f.write('''var depData = [];
+(function () {
+    var shards = ''' + json.dumps(shards) + ''';
+    for (var i = 0; i < shards.length; ++i) {
+        var script = document.createElement('script');
+        script.src = shards[i];
+        script.async = false;
+        document.head.appendChild(script);
+    }
+})();
+''')
+            else:
+                f.write('var depData = ')
+                write_json_array(f, data)
+                f.write(';\n')
+
+
+def run_command(cmd, args):
+    """Run the command and report the phase timings if --profile,
+    --timings-json, or --cprofile is specified."""
+    profile = getattr(args, 'profile', False)
+    timings_json = getattr(args, 'timings_json', None)
+    cprofile = getattr(args, 'cprofile', None)
+
+    if not (profile or timings_json or cprofile):
+        return cmd.main(args)
+
+    profiler = None
+    if cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with timed_phase(cmd.name):
+            return cmd.main(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+        if profile:
+            _phase_timings.dump(sys.stderr)
+        if timings_json:
+            with open(timings_json, 'w') as fp:
+                json.dump(collections.OrderedDict((
+                    ('command', cmd.name),
+                    ('phases', _phase_timings.to_json()),
+                )), fp, indent=2)
+                fp.write('\n')
 
 
 def main():
@@ -4242,6 +7701,7 @@ def main():
 
     register_subcmd(ELFDumpCommand())
     register_subcmd(CreateGenericRefCommand())
+    register_subcmd(PackGenericRefCommand())
     register_subcmd(VNDKCommand())
     register_subcmd(DepsCommand())
     register_subcmd(DepsClosureCommand())
@@ -4250,13 +7710,15 @@ def main():
     register_subcmd(ApkDepsCommand())
     register_subcmd(CheckDepCommand())
     register_subcmd(DepGraphCommand())
+    register_subcmd(ServeCommand())
+    register_subcmd(GraphDiffCommand())
     register_subcmd(DumpDexStringCommand())
 
     args = parser.parse_args()
     if not args.subcmd:
         parser.print_help()
         sys.exit(1)
-    return subcmds[args.subcmd].main(args)
+    return run_command(subcmds[args.subcmd], args)
 
 if __name__ == '__main__':
     sys.exit(main())